@@ -0,0 +1,369 @@
+# Scripts/api_client.py
+
+"""
+Shared OpenAI client layer used by every pipeline stage.
+
+All chat and embedding requests go through chat_completion() / create_embedding(), which
+    - wait on a process-wide token bucket for requests-per-minute and tokens-per-minute,
+      so throughput sits at the quota ceiling instead of behind a fixed sleep,
+    - retry transient errors with jittered exponential backoff, honouring Retry-After,
+    - record per-stage metrics (calls, retries, failures, tokens, latency),
+    - write one trace span per call when API_TRACE=true (see Scripts/tracing.py),
+    - optionally record every response to, or replay it from, the cassette store
+      (API_CASSETTE_MODE, see Scripts/cassette.py).
+The limiter is thread-safe, so concurrent workers (see main_interview) share one quota.
+"""
+
+import json
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from collections import defaultdict, deque
+
+import openai
+from openai.util import convert_to_openai_object
+from config.config import (OPENAI_API_KEY, OPENAI_API_BASE, GPT_MODEL, EMBEDDING_MODEL, OPENAI_RPM, OPENAI_TPM,
+                           API_MAX_RETRIES, INITIAL_DELAY, API_BACKOFF_CAP, API_CASSETTE_MODE,
+                           API_COMPLETION_ESTIMATE)
+from Scripts.cassette import cassette, request_key, CassetteMiss
+from Scripts.tracing import record_span, trace_context
+
+logger = logging.getLogger(__name__)
+openai.api_key = OPENAI_API_KEY
+if OPENAI_API_BASE:
+    # OpenAI-compatible endpoint, e.g. the local fake_openai_server.py for load tests
+    openai.api_base = OPENAI_API_BASE
+    logger.info("Using OpenAI-compatible API at %s", OPENAI_API_BASE)
+
+# Errors worth retrying; anything else (bad request, auth...) fails immediately
+RETRYABLE_ERRORS = tuple(
+    getattr(openai.error, name) for name in
+    ("RateLimitError", "APIError", "Timeout", "APIConnectionError", "ServiceUnavailableError", "TryAgain")
+    if hasattr(openai.error, name)
+)
+
+LATENCY_SAMPLES = 2048          # latencias recientes por etapa usadas para p50/p95
+
+CASSETTE_MODES = ("off", "record", "replay", "auto")
+if API_CASSETTE_MODE not in CASSETTE_MODES:
+    raise ValueError(f"API_CASSETTE_MODE must be one of {CASSETTE_MODES}, got {API_CASSETTE_MODE!r}")
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (≈ 4 characters per token in Spanish)."""
+    return max(1, len(text) // 4)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `per_minute` units per minute.
+    acquire() blocks until the requested amount is available; requests larger than the
+    bucket are clamped to its capacity so they can still go through.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Takes `amount` units, sleeping as needed. Returns the seconds waited."""
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def refund(self, amount: float):
+        """
+        Settles a request against its estimate: a positive amount returns unused units, a
+        negative one charges the overrun without waiting (the balance may go below zero, so
+        the next acquire() waits for it).
+        """
+        if not amount:
+            return
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+class StageMetrics:
+    """Counters for one pipeline stage."""
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency = 0.0
+        self.throttled = 0.0
+        self.replayed = 0
+        self.samples = deque(maxlen=LATENCY_SAMPLES)   # latencias (s) de las últimas llamadas exitosas
+        self.completion_budget = 0  # suma de max_tokens de las llamadas que lo fijaron
+        self.budget_used = 0        # completion tokens realmente usados en esas llamadas
+
+    def percentile(self, q: float) -> float:
+        """Latency percentile over the last LATENCY_SAMPLES successful calls."""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "latency_s": round(self.latency, 3),
+            "avg_latency_s": round(self.latency / self.calls, 3) if self.calls else 0.0,
+            "p50_latency_s": round(self.percentile(0.50), 3),
+            "p95_latency_s": round(self.percentile(0.95), 3),
+            "throttled_s": round(self.throttled, 3),
+            "replayed": self.replayed,
+        }
+
+request_bucket = TokenBucket(OPENAI_RPM)
+token_bucket = TokenBucket(OPENAI_TPM)
+
+_metrics = defaultdict(StageMetrics)
+_metrics_lock = threading.Lock()
+
+def get_metrics() -> dict:
+    """Snapshot of the per-stage metrics."""
+    with _metrics_lock:
+        return {stage: m.as_dict() for stage, m in _metrics.items()}
+
+_local = threading.local()
+
+@contextmanager
+def stage_timings():
+    """
+    Collects {stage: seconds} of API latency for the calls made by this thread inside the
+    block (e.g. the Stage-1 and Stage-2 requests of one classification batch).
+    """
+    timings = defaultdict(float)
+    previous = getattr(_local, "timings", None)
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+def _record_timing(stage: str, elapsed: float):
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        timings[stage] += elapsed
+
+@contextmanager
+def failed_requests():
+    """
+    Collects the stage of every request made by this thread inside the block that failed for
+    good (retries exhausted, or missing from the cassette in replay mode). Stages that fall
+    back on failure (cleaning, segmentation, classification) do not raise, so callers that
+    must not keep a fallback as finished work check this list instead.
+    """
+    failed = []
+    previous = getattr(_local, "failed", None)
+    _local.failed = failed
+    try:
+        yield failed
+    finally:
+        _local.failed = previous
+        if previous is not None:
+            previous.extend(failed)
+
+def _record_failure(stage: str):
+    failed = getattr(_local, "failed", None)
+    if failed is not None:
+        failed.append(stage)
+
+def log_metrics():
+    for stage, m in sorted(get_metrics().items()):
+        logger.info("API stage %-12s calls=%d retries=%d failures=%d tokens=%d/%d latency=%.1fs (p50=%.2fs p95=%.2fs) "
+                    "throttled=%.1fs replayed=%d",
+                    stage, m["calls"], m["retries"], m["failures"], m["prompt_tokens"], m["completion_tokens"],
+                    m["latency_s"], m["p50_latency_s"], m["p95_latency_s"], m["throttled_s"], m["replayed"])
+    if API_CASSETTE_MODE != "off":
+        logger.info("API cassette (%s): %s", API_CASSETTE_MODE, cassette.stats())
+
+def _retry_after(error) -> float:
+    """Seconds requested by the server through Retry-After / retry-after-ms, or None."""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000.0
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+def _backoff(attempt: int, error) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(API_BACKOFF_CAP, INITIAL_DELAY * (2 ** attempt)))
+    retry_after = _retry_after(error)
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, 0.25))
+    return delay
+
+def _usage(response) -> tuple:
+    usage = response.get("usage", {}) if hasattr(response, "get") else getattr(response, "usage", {}) or {}
+    return int(usage.get("prompt_tokens", 0) or 0), int(usage.get("completion_tokens", 0) or 0)
+
+def _call(stage: str, fn, estimated_tokens: int, max_retries: int, span=None, **kwargs):
+    """
+    Rate-limited, retried call of an openai resource method; raises the last error.
+    `span` holds the trace fields known by the caller (endpoint, model, prompt size).
+    """
+    attempts = max(1, max_retries)
+    span = span or {}
+    total_latency = total_throttled = 0.0
+    for attempt in range(attempts):
+        throttled = request_bucket.acquire(1)
+        throttled += token_bucket.acquire(estimated_tokens)
+        total_throttled += throttled
+        start = time.monotonic()
+        try:
+            response = fn(**kwargs)
+        except Exception as e:
+            elapsed = time.monotonic() - start
+            total_latency += elapsed
+            _record_timing(stage, elapsed)
+            last_attempt = attempt == attempts - 1 or not isinstance(e, RETRYABLE_ERRORS)
+            with _metrics_lock:
+                m = _metrics[stage]
+                m.latency += elapsed
+                m.throttled += throttled
+                if last_attempt:
+                    m.failures += 1
+                else:
+                    m.retries += 1
+            if last_attempt:
+                logger.error("%s request failed after %d attempt(s): %s", stage, attempt + 1, e)
+                _record_failure(stage)
+                record_span(stage, status="error", error=type(e).__name__, attempts=attempt + 1,
+                            latency_ms=total_latency * 1000, throttled_ms=total_throttled * 1000, **span)
+                raise
+            wait_time = _backoff(attempt, e)
+            logger.warning("%s request error (attempt %d/%d): %s. Retrying in %.2fs",
+                           stage, attempt + 1, attempts, e, wait_time)
+            time.sleep(wait_time)
+            continue
+
+        elapsed = time.monotonic() - start
+        total_latency += elapsed
+        _record_timing(stage, elapsed)
+        prompt_tokens, completion_tokens = _usage(response)
+        record_span(stage, status="ok", attempts=attempt + 1, latency_ms=total_latency * 1000,
+                    throttled_ms=total_throttled * 1000, prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens, **span)
+        if prompt_tokens or completion_tokens:
+            token_bucket.refund(estimated_tokens - prompt_tokens - completion_tokens)
+        budget = int(kwargs.get("max_tokens") or 0)
+        with _metrics_lock:
+            m = _metrics[stage]
+            m.calls += 1
+            m.latency += elapsed
+            m.samples.append(elapsed)
+            if budget:
+                m.completion_budget += budget
+                m.budget_used += completion_tokens
+            m.throttled += throttled
+            m.prompt_tokens += prompt_tokens
+            m.completion_tokens += completion_tokens
+        return response
+
+def _as_dict(response):
+    if hasattr(response, "to_dict_recursive"):
+        return response.to_dict_recursive()
+    return json.loads(json.dumps(response))
+
+def _recorded_call(endpoint: str, stage: str, fn, estimated_tokens: int, max_retries: int, span=None, **kwargs):
+    """_call behind the cassette: replayed responses skip the limiter and the network entirely."""
+    span = dict(span or {}, endpoint=endpoint, model=kwargs.get("model"))
+    if API_CASSETTE_MODE == "off":
+        return _call(stage, fn, estimated_tokens, max_retries, span=span, **kwargs)
+
+    key = request_key(endpoint, kwargs)
+    if API_CASSETTE_MODE in ("replay", "auto"):
+        recorded = cassette.get(key)
+        if recorded is not None:
+            with _metrics_lock:
+                _metrics[stage].replayed += 1
+            prompt_tokens, completion_tokens = _usage(recorded)
+            record_span(stage, cache="cassette", status="ok", attempts=0, latency_ms=0.0,
+                        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, **span)
+            return convert_to_openai_object(recorded)
+        if API_CASSETTE_MODE == "replay":
+            with _metrics_lock:
+                _metrics[stage].failures += 1
+            _record_failure(stage)
+            record_span(stage, cache="cassette", status="error", error="CassetteMiss", attempts=0, **span)
+            raise CassetteMiss(f"{stage} request {key[:12]} is not in the cassette {cassette.path}")
+
+    with trace_context(cache="miss"):
+        response = _call(stage, fn, estimated_tokens, max_retries, span=span, **kwargs)
+    try:
+        cassette.put(key, _as_dict(response), endpoint=endpoint, stage=stage)
+    except (TypeError, ValueError) as e:
+        logger.warning("Could not record %s response: %s", stage, e)
+    return response
+
+def completion_estimate(stage: str, max_tokens: int) -> int:
+    """
+    Completion tokens charged to the TPM bucket before a chat request: max_tokens times the
+    share of max_tokens the stage has actually used so far (API_COMPLETION_ESTIMATE until
+    the stage has a completed call). The difference with the real usage is settled when
+    the response arrives.
+    """
+    if not max_tokens:
+        return 0
+    with _metrics_lock:
+        m = _metrics.get(stage)
+        ratio = m.budget_used / m.completion_budget if m and m.completion_budget else API_COMPLETION_ESTIMATE
+    return int(max_tokens * min(1.0, ratio))
+
+def chat_completion(stage: str, messages, model: str = GPT_MODEL, max_retries: int = API_MAX_RETRIES, **kwargs):
+    """
+    openai.ChatCompletion.create through the shared limiter, retries and metrics.
+
+    Args:
+        stage (str): Pipeline stage name used for metrics (e.g. "cleaning", "stage1").
+        messages (list): Chat messages.
+        model (str): Chat model.
+        max_retries (int): Total attempts for transient errors.
+        **kwargs: Any other ChatCompletion parameter (temperature, max_tokens, ...).
+
+    Returns:
+        The API response. Raises the last error once retries are exhausted.
+    """
+    prompt_chars = sum(len(m.get("content") or "") for m in messages)
+    prompt_estimate = sum(estimate_tokens(m.get("content") or "") for m in messages)
+    estimated = prompt_estimate + completion_estimate(stage, int(kwargs.get("max_tokens") or 0))
+    return _recorded_call("chat", stage, openai.ChatCompletion.create, estimated, max_retries,
+                          span={"prompt_chars": prompt_chars, "prompt_estimate": prompt_estimate},
+                          model=model, messages=messages, **kwargs)
+
+def create_embedding(stage: str, input, model: str = EMBEDDING_MODEL, max_retries: int = API_MAX_RETRIES, **kwargs):
+    """openai.Embedding.create (single text or list input) through the shared limiter."""
+    texts = input if isinstance(input, list) else [input]
+    estimated = sum(estimate_tokens(t) for t in texts)
+    return _recorded_call("embeddings", stage, openai.Embedding.create, estimated, max_retries,
+                          span={"prompt_chars": sum(len(t) for t in texts), "prompt_estimate": estimated,
+                                "inputs": len(texts)},
+                          model=model, input=input, **kwargs)
@@ -0,0 +1,112 @@
+# Scripts/cassette.py
+
+"""
+Record/replay store for raw OpenAI requests (see API_CASSETTE_MODE in config/config.py).
+
+Every request that goes through api_client is identified by a hash of its canonical JSON
+(endpoint, model, messages or input, sampling parameters, response_format...). In record
+mode each successful response is stored under that hash; in replay mode responses are
+served from the store without touching the network or the rate limiter, so experiments on
+the post-processing (thresholds, parse bonuses...) re-run in seconds and reproduce exactly.
+
+Responses are stored as zlib-compressed JSON in one SQLite file.
+
+    python -m Scripts.cassette stats
+    python -m Scripts.cassette clear
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from config.config import OUTPUT_DIR, API_CASSETTE_PATH
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_PATH = API_CASSETTE_PATH or os.path.join(OUTPUT_DIR, "api_cassette.sqlite3")
+
+class CassetteMiss(Exception):
+    """Raised in replay mode when a request was never recorded."""
+
+def request_key(endpoint: str, request: dict) -> str:
+    """sha256 over the canonical JSON of one request."""
+    payload = json.dumps([endpoint, request], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class CassetteStore:
+    """SQLite table of key -> compressed response JSON, with per-session hit/miss counters."""
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, endpoint TEXT, stage TEXT, value BLOB NOT NULL, recorded_at REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str):
+        """Decoded response dict for `key`, or None."""
+        with self._lock:
+            row = self._connect().execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def put(self, key: str, response: dict, endpoint: str = "", stage: str = ""):
+        value = zlib.compress(json.dumps(response, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, stage, value, recorded_at) VALUES (?, ?, ?, ?, ?)",
+                (key, endpoint, stage, value, time.time())
+            )
+            self.recorded += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute("SELECT stage, COUNT(*), SUM(LENGTH(value)) FROM responses GROUP BY stage").fetchall()
+        return {
+            "entries": sum(n for _, n, _ in rows),
+            "bytes": sum(b or 0 for _, _, b in rows),
+            "by_stage": {stage: n for stage, n, _ in rows},
+            "hits": self.hits,
+            "misses": self.misses,
+            "recorded": self.recorded,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM responses")
+
+cassette = CassetteStore(CASSETTE_PATH)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or clear the API record/replay cassette.")
+    parser.add_argument("command", choices=["stats", "clear"])
+    args = parser.parse_args()
+
+    if args.command == "clear":
+        cassette.clear()
+    print(cassette.stats())
@@ -3,23 +3,27 @@
 """
 Module for cleaning text using the OpenAI API.
 Removes unwanted content (headers, footers, image captions, etc.) from text.
-Processes large texts in chunks with debugging, retries, and exponential back-off.
+Processes large texts in chunks; requests go through the shared rate-limited client.
 """
 
-import time
-import openai
 import logging
-from config.config import OPENAI_API_KEY, GPT_MODEL, MAX_CHUNK_LENGTH, API_DELAY, INITIAL_DELAY
+from config.config import GPT_MODEL, MAX_CHUNK_LENGTH
 from utils.utils import split_text_into_chunks
+from Scripts.api_client import chat_completion
+from Scripts.response_cache import cached_completion
 
 logger = logging.getLogger(__name__)
-openai.api_key = OPENAI_API_KEY
+
+# Subir esta versión cada vez que cambie el prompt de limpieza (invalida la cache de respuestas)
+CLEANING_PROMPT_VERSION = "1"
+CLEANING_TEMPERATURE = 0.2
 
 def clean_text_chunk(chunk, retries=3):
     """
     Cleans a single text chunk using the OpenAI API.
     Only removes specific unwanted elements while preserving all actual content.
-    Uses exponential back-off for retries and adds a fixed delay after a successful call.
+    Rate limiting and jittered retries are handled by the shared API client; answers are
+    served from the persistent response cache when the chunk, prompt and model are unchanged.
     """
     prompt = (
         "You are a text cleaning assistant. Your task is to clean the following text by ONLY removing:\n"
@@ -37,27 +41,28 @@ def clean_text_chunk(chunk, retries=3):
     )
     logger.debug("Cleaning chunk with length %d", len(chunk))
     
-    for attempt in range(retries):
-        try:
-            response = openai.ChatCompletion.create(
-                model=GPT_MODEL,
-                messages=[
-                    {"role": "system", "content": "You are a conservative text cleaning assistant that preserves all meaningful content."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.2,
-                max_tokens=1500
-            )
-            cleaned_chunk = response.choices[0].message.content.strip()
-            logger.debug("Successfully cleaned chunk on attempt %d", attempt + 1)
-            time.sleep(API_DELAY)
-            return cleaned_chunk
-        except Exception as e:
-            wait_time = INITIAL_DELAY * (2 ** attempt)
-            logger.error("Error cleaning text chunk (attempt %d): %s. Retrying in %.2fs", attempt + 1, e, wait_time)
-            time.sleep(wait_time)
-    logger.warning("Returning original chunk after %d failed attempts", retries)
-    return chunk
+    def compute():
+        response = chat_completion(
+            "cleaning",
+            model=GPT_MODEL,
+            messages=[
+                {"role": "system", "content": "You are a conservative text cleaning assistant that preserves all meaningful content."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=CLEANING_TEMPERATURE,
+            max_tokens=1500,
+            max_retries=retries
+        )
+        return response.choices[0].message.content.strip()
+
+    try:
+        cleaned_chunk = cached_completion("cleaning", CLEANING_PROMPT_VERSION, GPT_MODEL,
+                                          CLEANING_TEMPERATURE, chunk, compute)
+        logger.debug("Successfully cleaned chunk")
+        return cleaned_chunk
+    except Exception as e:
+        logger.warning("Returning original chunk after %d failed attempts: %s", retries, e)
+        return chunk
 
 def clean_text(text):
     """
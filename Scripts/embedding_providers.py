@@ -0,0 +1,119 @@
+# Scripts/embedding_providers.py
+
+"""
+Embedding backends behind one interface, selected with EMBEDDING_PROVIDER in config/config.py.
+
+    openai                : the OpenAI embeddings endpoint (EMBEDDING_MODEL), through api_client
+    hashing               : offline, CPU-only signed hashing of character n-grams; no key, no
+                            network, deterministic across processes. Good enough for the
+                            similarity fallback, local prefilter tests and benchmarks.
+    sentence_transformers : a local model loaded from LOCAL_EMBEDDING_MODEL (path or name),
+                            only if the sentence-transformers package is installed.
+
+Every provider exposes `model_id`, which names the embedding space: the embedding store
+keeps one folder per model_id, so vectors of different providers never mix.
+"""
+
+import re
+import zlib
+import logging
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+import numpy as np
+
+from config.config import EMBEDDING_PROVIDER, EMBEDDING_MODEL, LOCAL_EMBEDDING_DIM, LOCAL_EMBEDDING_MODEL
+from utils.utils import normalize_text
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingProvider(ABC):
+    """Base class: embed(texts) returns one vector per text, in order, or raises."""
+
+    model_id = "base"
+
+    @abstractmethod
+    def embed(self, texts: List[str], max_retries: int = 3) -> List[np.ndarray]:
+        ...
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI embeddings through the shared rate limiter, retries and metrics."""
+
+    def __init__(self, model: str = EMBEDDING_MODEL):
+        self.model = model
+        self.model_id = model
+
+    def embed(self, texts, max_retries=3):
+        from Scripts.api_client import create_embedding
+
+        response = create_embedding("embedding", input=list(texts), model=self.model, max_retries=max_retries)
+        data = sorted(response['data'], key=lambda d: d['index'])
+        return [d['embedding'] for d in data]
+
+_TOKEN_RE = re.compile(r'\w+')
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Character n-grams (within word boundaries, 3 to 5 chars) of the normalized text are
+    hashed with crc32 into `dim` signed buckets; counts are log-scaled and the vector is
+    L2-normalized. Stable across runs and machines (no Python hash randomization).
+    """
+
+    def __init__(self, dim: int = LOCAL_EMBEDDING_DIM, ngram_range=(3, 5)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.model_id = f"hashing-char{ngram_range[0]}-{ngram_range[1]}-{dim}"
+
+    def _vector(self, text: str) -> np.ndarray:
+        counts = {}
+        lo, hi = self.ngram_range
+        for token in _TOKEN_RE.findall(normalize_text(text)):
+            word = f" {token} "
+            for n in range(lo, hi + 1):
+                for i in range(max(1, len(word) - n + 1)):
+                    h = zlib.crc32(word[i:i + n].encode("utf-8"))
+                    counts[h] = counts.get(h, 0) + 1
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if not counts:
+            return vector
+        hashes = np.fromiter(counts.keys(), dtype=np.uint64, count=len(counts))
+        values = np.log1p(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        signs = np.where(hashes & np.uint64(1 << 31), -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, (hashes % np.uint64(self.dim)).astype(np.int64), signs * values)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed(self, texts, max_retries=3):
+        return [self._vector(text) for text in texts]
+
+class SentenceTransformerProvider(EmbeddingProvider):
+    """A local sentence-transformers model (optional dependency)."""
+
+    def __init__(self, model: str = LOCAL_EMBEDDING_MODEL):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("EMBEDDING_PROVIDER=sentence_transformers needs the sentence-transformers package") from e
+        if not model:
+            raise ValueError("Set LOCAL_EMBEDDING_MODEL to a model path or name")
+        self.model = SentenceTransformer(model, device="cpu")
+        self.model_id = "st-" + re.sub(r"[^A-Za-z0-9_.-]+", "_", model.rstrip("/\\").split("/")[-1].split("\\")[-1])
+
+    def embed(self, texts, max_retries=3):
+        vectors = self.model.encode(list(texts), convert_to_numpy=True, normalize_embeddings=True)
+        return [np.asarray(v, dtype=np.float32) for v in vectors]
+
+PROVIDERS = {
+    "openai": OpenAIEmbeddingProvider,
+    "hashing": HashingEmbeddingProvider,
+    "sentence_transformers": SentenceTransformerProvider,
+}
+
+def get_provider(name: Optional[str] = None) -> EmbeddingProvider:
+    """Instantiates the configured (or named) provider."""
+    name = (name or EMBEDDING_PROVIDER).lower()
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown EMBEDDING_PROVIDER {name!r} (expected one of {sorted(PROVIDERS)})")
+    provider = PROVIDERS[name]()
+    logger.debug("Embedding provider %s (%s)", name, provider.model_id)
+    return provider
@@ -0,0 +1,370 @@
+# Scripts/embedding_store.py
+
+"""
+Append-only, sharded persistent store for embeddings.
+
+Vectors are keyed by a hash of the text and appended to one of several shard logs,
+so each insert writes only the new record instead of re-pickling the whole cache.
+Every record carries its own CRC; a torn record left by a crash mid-append is
+detected and truncated on the next load, leaving every earlier vector intact.
+compact() rewrites the shards (dropping duplicates) through temp files + os.replace.
+
+In memory the vectors are rows of one growing float32 matrix with a digest -> row map;
+get() hands out read-only row views, so nothing is copied or converted per lookup and a
+1536-dim vector costs 6 KB instead of ~50 KB as a list of Python floats. Rows are never
+rewritten once handed out: put(overwrite=True) writes the new vector to a new row and
+repoints the key, so earlier views keep the old value. The stale rows are dropped by
+compact().
+
+Record layout (little-endian):
+    <digest: 16 bytes> <dim: uint32> <crc32(payload): uint32> <payload: dim x float32>
+"""
+
+import os
+import glob
+import zlib
+import pickle
+import struct
+import hashlib
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("<16sII")
+DIGEST_SIZE = 16
+DEFAULT_SHARDS = 16
+SHARD_PATTERN = "shard_*.log"
+DISK_DTYPE = np.dtype("<f4")
+INITIAL_ROWS = 1024
+
+
+def text_key(text: str) -> bytes:
+    """Returns the 16-byte digest used as the store key for a text."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=DIGEST_SIZE).digest()
+
+
+def _encode(vector) -> bytes:
+    return np.asarray(vector, dtype=DISK_DTYPE).tobytes()
+
+
+def _fsync_dir(path):
+    # Makes the rename/creation of shard files durable (no-op where unsupported, e.g. Windows)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class EmbeddingStore:
+    """
+    Dict-like persistent embedding store: `text in store`, `store.get(text)`,
+    `store[text] = vector`. Lookups and inserts are O(1) against an in-memory index
+    built from the shard logs the first time the store is touched. Vectors come back
+    as read-only float32 views into the store's matrix.
+
+    Args:
+        directory (str): Folder holding the shard logs.
+        n_shards (int): Number of shard files new records are spread across.
+        fsync (bool): fsync each append so an acknowledged insert survives a crash.
+        legacy_pickle (str): Optional path to an old whole-dict pickle cache that is
+            imported once when the store is empty.
+    """
+
+    def __init__(self, directory, n_shards=DEFAULT_SHARDS, fsync=True, legacy_pickle=None):
+        self.directory = directory
+        self.n_shards = n_shards
+        self.fsync = fsync
+        self.legacy_pickle = legacy_pickle
+        self._index = {}                # digest -> row of self._matrix
+        self._matrix = None
+        self._rows = 0
+        self._records_on_disk = 0
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    # ------------------------------------------------------------------ loading
+
+    def _shard_path(self, digest: bytes) -> str:
+        return os.path.join(self.directory, f"shard_{digest[0] % self.n_shards:02d}.log")
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            for path in sorted(glob.glob(os.path.join(self.directory, SHARD_PATTERN))):
+                self._load_shard(path)
+            self._loaded = True
+            logger.debug("Embedding store loaded with %d items from %s", len(self._index), self.directory)
+            if not self._index and self.legacy_pickle and os.path.exists(self.legacy_pickle):
+                self._import_legacy_pickle(self.legacy_pickle)
+
+    def _add_rows(self, digests, vectors, reuse_rows=False):
+        """
+        Copies an (n, dim) block into the matrix (growing it by doubling) and indexes it.
+        Existing digests get a new row, so views already handed out never change; with
+        reuse_rows (loading, before any view exists) they are overwritten in place.
+        Caller holds the lock.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or not len(vectors):
+            return
+        matrix = self._matrix
+        if matrix is None:
+            matrix = np.empty((max(INITIAL_ROWS, len(vectors)), vectors.shape[1]), dtype=np.float32)
+        elif vectors.shape[1] != matrix.shape[1]:
+            logger.error("Ignoring %d embeddings of dimension %d in a store of dimension %d",
+                         len(vectors), vectors.shape[1], matrix.shape[1])
+            return
+
+        rows, new_rows, placed = [], self._rows, {}
+        for digest in digests:
+            row = placed.get(digest)
+            if row is None and reuse_rows:
+                row = self._index.get(digest)
+            if row is None:
+                row = new_rows
+                new_rows += 1
+            placed[digest] = row
+            rows.append(row)
+        if new_rows > len(matrix):
+            grown = np.empty((max(new_rows, 2 * len(matrix)), matrix.shape[1]), dtype=np.float32)
+            grown[:self._rows] = matrix[:self._rows]
+            matrix = grown
+        matrix[rows] = vectors
+        # Publish the (possibly new) matrix before the rows, so readers never see a row it lacks
+        self._matrix = matrix
+        self._rows = new_rows
+        for digest, row in zip(digests, rows):
+            self._index[digest] = row
+
+    def _row(self, digest):
+        row = self._index.get(digest)
+        if row is None:
+            return None
+        view = self._matrix[row]
+        view.flags.writeable = False
+        return view
+
+    def _load_shard(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        offset, size = 0, len(data)
+        digests, payloads = [], []
+        while offset < size:
+            if offset + HEADER.size > size:
+                break
+            digest, dim, crc = HEADER.unpack_from(data, offset)
+            end = offset + HEADER.size + dim * 4
+            if end > size:
+                break
+            payload = data[offset + HEADER.size:end]
+            if zlib.crc32(payload) != crc:
+                break
+            if payloads and len(payload) != len(payloads[0]):
+                self._add_rows(digests, np.frombuffer(b"".join(payloads), dtype=DISK_DTYPE).reshape(len(payloads), -1),
+                               reuse_rows=True)
+                digests, payloads = [], []
+            digests.append(digest)
+            payloads.append(payload)
+            self._records_on_disk += 1
+            offset = end
+        if payloads:
+            self._add_rows(digests, np.frombuffer(b"".join(payloads), dtype=DISK_DTYPE).reshape(len(payloads), -1),
+                           reuse_rows=True)
+        if offset < size:
+            # Torn or corrupt tail (crash mid-append): drop it so later appends stay aligned
+            logger.warning("Truncating %d damaged trailing bytes in %s", size - offset, path)
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _import_legacy_pickle(self, path):
+        try:
+            with open(path, "rb") as f:
+                legacy = pickle.load(f)
+        except Exception as e:
+            logger.error("Error loading legacy embeddings cache %s: %s", path, e)
+            return
+        self.put_many(legacy.items())
+        logger.info("Imported %d embeddings from legacy cache %s", len(legacy), path)
+
+    # ------------------------------------------------------------------ writing
+
+    def _append(self, records):
+        """Appends (digest, payload) records grouped by shard; one write + fsync per shard."""
+        by_shard = {}
+        for digest, payload in records:
+            record = HEADER.pack(digest, len(payload) // 4, zlib.crc32(payload)) + payload
+            by_shard.setdefault(self._shard_path(digest), []).append(record)
+        for path, chunks in by_shard.items():
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0), 0o644)
+            try:
+                os.write(fd, b"".join(chunks))
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._records_on_disk += len(chunks)
+
+    def put(self, text: str, vector, overwrite: bool = False):
+        """
+        Stores the embedding of `text`. Existing keys are kept unless overwrite=True; an
+        overwritten key moves to a new row, so vectors returned earlier by get() keep the
+        old value.
+        """
+        self.put_many([(text, vector)], overwrite=overwrite)
+
+    def put_many(self, items, overwrite: bool = False):
+        """Stores several (text, vector) pairs with a single append per touched shard."""
+        self._ensure_loaded()
+        with self._lock:
+            pending = {}
+            size = self._matrix.shape[1] * 4 if self._matrix is not None else None
+            for text, vector in items:
+                if vector is None:
+                    continue
+                digest = text_key(text)
+                if not overwrite and (digest in self._index or digest in pending):
+                    continue
+                payload = _encode(vector)
+                if size is None:
+                    size = len(payload)
+                elif len(payload) != size:
+                    logger.error("Ignoring embedding of dimension %d (store dimension %d)", len(payload) // 4, size // 4)
+                    continue
+                pending[digest] = payload
+            if not pending:
+                return
+            self._append(pending.items())
+            self._add_rows(list(pending),
+                           np.frombuffer(b"".join(pending.values()), dtype=DISK_DTYPE).reshape(len(pending), -1))
+
+    def compact(self):
+        """
+        Rewrites every shard with exactly one record per key.
+        Each shard is written to a temp file, fsync'd and atomically swapped in,
+        so a crash during compaction leaves either the old or the new shard.
+        The in-memory matrix is rebuilt without the rows left behind by overwrites
+        (into a new array, so views already handed out stay valid).
+        """
+        self._ensure_loaded()
+        with self._lock:
+            by_shard = {}
+            for digest, row in self._index.items():
+                by_shard.setdefault(self._shard_path(digest), []).append((digest, _encode(self._matrix[row])))
+            old_paths = set(glob.glob(os.path.join(self.directory, SHARD_PATTERN)))
+            for path, records in by_shard.items():
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    for digest, payload in records:
+                        f.write(HEADER.pack(digest, len(payload) // 4, zlib.crc32(payload)))
+                        f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+            for path in old_paths - set(by_shard):
+                os.remove(path)
+            _fsync_dir(self.directory)
+            if self._rows > len(self._index):
+                self._rebuild_matrix()
+            before = self._records_on_disk
+            self._records_on_disk = len(self._index)
+            logger.info("Embedding store compacted: %d records -> %d", before, self._records_on_disk)
+
+    def _rebuild_matrix(self):
+        """Copies the live rows, in row order, into a new matrix. Caller holds the lock."""
+        digests = sorted(self._index, key=self._index.get)
+        live = self._matrix[[self._index[d] for d in digests]]
+        matrix = np.empty((max(INITIAL_ROWS, len(live)), live.shape[1]), dtype=np.float32)
+        matrix[:len(live)] = live
+        self._matrix = matrix
+        self._rows = len(live)
+        self._index = {digest: row for row, digest in enumerate(digests)}
+
+    def flush(self):
+        """Appends are durable as they happen; kept for API symmetry with the old save_cache."""
+        return None
+
+    # ------------------------------------------------------------------ dict-like access
+
+    def get(self, text: str, default=None):
+        """Read-only float32 view of the stored vector (no copy), or `default`."""
+        self._ensure_loaded()
+        vector = self._row(text_key(text))
+        return default if vector is None else vector
+
+    def __getitem__(self, text: str):
+        vector = self.get(text)
+        if vector is None:
+            raise KeyError(text[:60])
+        return vector
+
+    def __setitem__(self, text: str, vector):
+        self.put(text, vector)
+
+    def __contains__(self, text: str) -> bool:
+        self._ensure_loaded()
+        return text_key(text) in self._index
+
+    def matrix(self) -> np.ndarray:
+        """
+        Read-only (items, dim) float32 array of every stored vector, in row order: a view,
+        or a copy without the stale rows when keys were overwritten since the last compact().
+        """
+        self._ensure_loaded()
+        if self._matrix is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        with self._lock:
+            if self._rows > len(self._index):
+                view = self._matrix[np.sort(np.fromiter(self._index.values(), dtype=np.int64, count=len(self._index)))]
+            else:
+                view = self._matrix[:self._rows]
+        view.flags.writeable = False
+        return view
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._index)
+
+    def stats(self) -> dict:
+        self._ensure_loaded()
+        shards = glob.glob(os.path.join(self.directory, SHARD_PATTERN))
+        return {
+            "items": len(self._index),
+            "records_on_disk": self._records_on_disk,
+            "stale_rows": self._rows - len(self._index),
+            "shards": len(shards),
+            "bytes_on_disk": sum(os.path.getsize(p) for p in shards),
+            "bytes_in_memory": self._matrix.nbytes if self._matrix is not None else 0,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or compact an embedding store.")
+    parser.add_argument("command", choices=["stats", "compact"])
+    parser.add_argument("directory", nargs="?", help="Store folder (defaults to the configured one)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.directory:
+        store = EmbeddingStore(args.directory)
+    else:
+        from Scripts.vectorize import embedding_cache as store
+    if args.command == "compact":
+        store.compact()
+    print(store.stats())
@@ -0,0 +1,136 @@
+# Scripts/manifest.py
+
+"""
+Run manifest and per-file checkpoints for incremental, resumable corpus runs.
+
+RunManifest is one JSON file that records, per input file, the content hash it was
+last processed with and which stages completed under which configuration fingerprint.
+A re-run skips a file whose hash and fingerprint are unchanged.
+
+PairCheckpoint is an append-only JSONL file per transcript holding every finished unit
+of work (a cleaned + segmented Q–A pair, a classified fragment), keyed by the hash of
+its input. After a crash the pipeline replays the checkpoint and only calls the API for
+the units that are missing. Checkpoints are deleted once their file completes.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+def file_hash(path: str) -> str:
+    """sha256 of a file's bytes."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def fingerprint(*parts) -> str:
+    """Short stable hash of any JSON-serialisable configuration (models, prompt versions, codebook...)."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def _atomic_write_json(path: str, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class RunManifest:
+    """
+    Per-file stage completion record, persisted atomically after every update.
+
+    Layout:
+        {"version": 1, "files": {<key>: {"hash": ..., "stages": {<stage>: {"fingerprint": ..., "completed_at": ...}}}}}
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = {"version": MANIFEST_VERSION, "files": {}}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    loaded = json.load(f)
+                if loaded.get("version") == MANIFEST_VERSION:
+                    self.data = loaded
+                else:
+                    logger.warning("Ignoring manifest %s with unknown version %s", path, loaded.get("version"))
+            except Exception as e:
+                logger.error("Error reading manifest %s, starting a new one: %s", path, e)
+
+    def is_complete(self, key: str, content_hash: str, stage: str, stage_fingerprint: str) -> bool:
+        """True if `key` was completed for `stage` with this exact content and configuration."""
+        with self._lock:
+            entry = self.data["files"].get(key)
+            if not entry or entry.get("hash") != content_hash:
+                return False
+            done = entry.get("stages", {}).get(stage)
+            return bool(done) and done.get("fingerprint") == stage_fingerprint
+
+    def mark_complete(self, key: str, content_hash: str, stage: str, stage_fingerprint: str, **info):
+        """Records a completed stage (dropping stages recorded for an older content hash) and saves."""
+        with self._lock:
+            entry = self.data["files"].get(key)
+            if not entry or entry.get("hash") != content_hash:
+                entry = {"hash": content_hash, "stages": {}}
+                self.data["files"][key] = entry
+            entry["stages"][stage] = dict(fingerprint=stage_fingerprint,
+                                          completed_at=time.strftime("%Y-%m-%dT%H:%M:%S"), **info)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            _atomic_write_json(self.path, self.data)
+
+class PairCheckpoint:
+    """
+    Append-only JSONL log of finished work units for one file.
+    Each line is {"kind": ..., "key": ..., "value": ...}; a torn last line is ignored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning("Ignoring damaged checkpoint line in %s", path)
+                        continue
+                    self.entries[(record["kind"], record["key"])] = record["value"]
+            if self.entries:
+                logger.info("Resuming from checkpoint %s (%d finished units)", path, len(self.entries))
+
+    @staticmethod
+    def key_for(*parts) -> str:
+        return fingerprint(*parts)
+
+    def get(self, kind: str, key: str):
+        return self.entries.get((kind, key))
+
+    def put(self, kind: str, key: str, value):
+        line = json.dumps({"kind": kind, "key": key, "value": value}, ensure_ascii=False)
+        with self._lock:
+            self.entries[(kind, key)] = value
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def discard(self):
+        """Removes the checkpoint file once its file has been fully processed."""
+        with self._lock:
+            self.entries = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
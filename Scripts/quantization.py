@@ -0,0 +1,118 @@
+# Scripts/quantization.py
+
+"""
+Reduced-precision embedding matrices for similarity scans (CodebookIndex in
+Scripts/classification.py, with EMBEDDING_QUANTIZATION).
+
+A QuantizedMatrix keeps the rows it scans as
+    - float16 (2 bytes per value), or
+    - int8 with one float32 scale per row (1 byte per value),
+optionally after an uncentered PCA projection (SVD of the L2-normalized rows), so projected
+dot products still approximate cosines. CodebookIndex scans the compact form and re-scores
+the best candidates of each fragment with the full float32 vectors, so the final ranking of
+the top results matches the exact one as long as they survive the approximate pass.
+
+See check_quantization.py for the accuracy report against the float32 CodebookIndex.
+"""
+
+import logging
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ("none", "float16", "int8")
+SCAN_BLOCK_ROWS = 8192          # filas de int8 convertidas a float32 por bloque durante un scan
+
+def normalize_rows(matrix) -> np.ndarray:
+    """L2-normalized float32 copy of a matrix (zero rows stay zero)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+class PCAProjection:
+    """
+    Uncentered PCA (top right-singular vectors of the normalized rows).
+    Without centering, x·y ≈ Px·Py for vectors that live mostly in the fitted subspace,
+    which is what cosine scoring needs.
+    """
+
+    def __init__(self, components: np.ndarray):
+        self.components = np.ascontiguousarray(components, dtype=np.float32)   # (dim_out, dim_in)
+
+    @classmethod
+    def fit(cls, matrix, dim: int) -> "PCAProjection":
+        unit = normalize_rows(matrix)
+        dim = max(1, min(dim, *unit.shape))
+        # Eigenvectors of the (dim_in x dim_in) Gram matrix: same subspace as the SVD, much cheaper for many rows
+        energy, vectors = np.linalg.eigh(unit.T.astype(np.float64) @ unit)
+        order = np.argsort(energy)[::-1]
+        kept = float(energy[order[:dim]].sum() / max(energy.sum(), 1e-12))
+        logger.info("PCA projection %d -> %d dims keeps %.1f%% of the energy", unit.shape[1], dim, kept * 100)
+        return cls(vectors[:, order[:dim]].T)
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[0]
+
+    def project(self, matrix) -> np.ndarray:
+        return np.asarray(matrix, dtype=np.float32) @ self.components.T
+
+    def save(self, path: str):
+        np.save(path, self.components)
+
+    @classmethod
+    def load(cls, path: str) -> "PCAProjection":
+        return cls(np.load(path))
+
+class QuantizedMatrix:
+    """Row-normalized vectors stored as float16, or int8 codes with a per-row scale."""
+
+    def __init__(self, matrix, mode: str = "int8", pca: Optional[PCAProjection] = None):
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode {mode!r} (expected one of {QUANTIZATION_MODES})")
+        self.mode = mode
+        self.pca = pca
+        unit = normalize_rows(matrix)
+        if pca is not None:
+            unit = pca.project(unit)
+        self.scales = None
+        if mode == "int8":
+            scales = np.abs(unit).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self.codes = np.round(unit / scales[:, None]).astype(np.int8)
+            self.scales = scales.astype(np.float32)
+        elif mode == "float16":
+            self.codes = unit.astype(np.float16)
+        else:
+            self.codes = np.ascontiguousarray(unit)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def cosines(self, unit_queries) -> np.ndarray:
+        """Approximate cosines (n_queries, n_rows) for already-normalized queries."""
+        queries = np.asarray(unit_queries, dtype=np.float32)
+        if self.pca is not None:
+            queries = self.pca.project(queries)
+        out = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), SCAN_BLOCK_ROWS):
+            block = self.codes[start:start + SCAN_BLOCK_ROWS].astype(np.float32)
+            out[:, start:start + len(block)] = queries @ block.T
+        if self.scales is not None:
+            out *= self.scales[None, :]
+        return out
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k highest scores of each row, best first."""
+    k = max(1, min(k, scores.shape[1]))
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1)
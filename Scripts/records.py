@@ -0,0 +1,181 @@
+# Scripts/records.py
+
+"""
+Fragment records: the intermediate format shared by segmentation, classification and the
+corpus outputs.
+
+Every fragment carries a stable id and its provenance (document, source file, Q–A index,
+position within the answer and character offsets in the cleaned answer), so later stages
+join by id instead of re-deriving the question by fuzzy text matching. The text itself is
+stored once, in segmented/<document>_segmented.json; partial/*.json and all_interviews.json
+only reference ids. To read them with their question and fragment text:
+
+    python -m Scripts.records                                  # -> all_interviews_readable.json
+    python -m Scripts.records path/to/partial/<document>.json --output readable.json
+
+Segmented file layout (SEGMENTED_FORMAT):
+    {"format": ..., "document": ..., "source": ..., "questions": [...], "records": [...]}
+Questions are stored once per Q–A pair and referenced by qa_index. Older segmented files
+(a bare list of strings) still load, as records without provenance.
+"""
+
+import os
+import json
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from utils.utils import normalize_text
+
+SEGMENTED_FORMAT = "fragment-records/1"
+
+def text_hash(text: str) -> str:
+    """Short content hash of a fragment's text."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+def make_fragment_id(document: str, qa_index: int, fragment_index: int) -> str:
+    """'<document>#<qa>.<fragment>', e.g. 2025_05_14_EG_SED_OCE#012.1"""
+    return f"{document}#{qa_index:03d}.{fragment_index}"
+
+@dataclass
+class FragmentRecord:
+    """One segmented fragment with its provenance."""
+    id: str
+    document: str
+    text: str
+    qa_index: Optional[int] = None
+    fragment_index: int = 0
+    question: Optional[str] = None
+    source: Optional[str] = None
+    start: int = -1                 # offsets of the text in the cleaned answer (-1 if not verbatim)
+    end: int = -1
+    hash: str = ""
+    _normalized: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if not self.hash:
+            self.hash = text_hash(self.text)
+
+    @property
+    def normalized(self) -> str:
+        """normalize_text(text), computed once."""
+        if self._normalized is None:
+            self._normalized = normalize_text(self.text)
+        return self._normalized
+
+    @classmethod
+    def create(cls, document: str, qa_index: int, fragment_index: int, text: str,
+               question: Optional[str] = None, source: Optional[str] = None, cleaned: Optional[str] = None):
+        """New record; offsets are located in the cleaned answer when the text is verbatim."""
+        start = cleaned.find(text) if cleaned else -1
+        return cls(
+            id=make_fragment_id(document, qa_index, fragment_index),
+            document=document, text=text, qa_index=qa_index, fragment_index=fragment_index,
+            question=question, source=source,
+            start=start, end=start + len(text) if start >= 0 else -1,
+        )
+
+    def to_dict(self) -> Dict[str, object]:
+        """Compact form used inside segmented files (document, source and question live at file level)."""
+        return {"id": self.id, "qa": self.qa_index, "n": self.fragment_index,
+                "start": self.start, "end": self.end, "hash": self.hash, "text": self.text}
+
+def write_segmented(path: str, document: str, records: List[FragmentRecord], source: Optional[str] = None):
+    """Writes a document's records (with a per-file question table) atomically."""
+    questions, question_pos = [], {}
+    for record in records:
+        if record.qa_index is not None and record.qa_index not in question_pos:
+            question_pos[record.qa_index] = len(questions)
+            questions.append({"qa": record.qa_index, "question": record.question})
+    data = {
+        "format": SEGMENTED_FORMAT,
+        "document": document,
+        "source": source,
+        "questions": questions,
+        "records": [record.to_dict() for record in records],
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def load_segmented(path: str) -> List[FragmentRecord]:
+    """
+    Reads a segmented file. Legacy files (bare list of strings) yield records with ids
+    '<document>#F001'... and no question, so callers can fall back to text matching.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    if isinstance(data, list):
+        document = os.path.splitext(os.path.basename(path))[0]
+        if document.endswith("_segmented"):
+            document = document[:-len("_segmented")]
+        return [FragmentRecord(id=f"{document}#F{n:03d}", document=document, text=text, fragment_index=n)
+                for n, text in enumerate(data, 1) if isinstance(text, str)]
+
+    document = data.get("document", "")
+    source = data.get("source")
+    questions = {q["qa"]: q.get("question") for q in data.get("questions", [])}
+    return [
+        FragmentRecord(
+            id=r["id"], document=document, text=r["text"], qa_index=r.get("qa"),
+            fragment_index=r.get("n", 0), question=questions.get(r.get("qa")), source=source,
+            start=r.get("start", -1), end=r.get("end", -1), hash=r.get("hash", ""),
+        )
+        for r in data.get("records", [])
+    ]
+
+def is_legacy_segmented(path) -> bool:
+    """True for an older segmented file (bare list of strings), without reading all of it."""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read(64).lstrip("\ufeff \t\r\n").startswith("[")
+
+def load_records(segmented_dir: str) -> Dict[str, FragmentRecord]:
+    """All records of a segmented folder, keyed by id, for O(1) joins."""
+    records = {}
+    for name in sorted(os.listdir(segmented_dir)):
+        if name.endswith(".json"):
+            for record in load_segmented(os.path.join(segmented_dir, name)):
+                records[record.id] = record
+    return records
+
+def expand_results(results: List[Dict[str, object]], records: Dict[str, FragmentRecord]) -> List[Dict[str, object]]:
+    """
+    Turns id-only results ({"id", "codigos"}) back into readable entries with question and
+    fragment text. Entries that already carry text (legacy outputs) are returned unchanged.
+    """
+    expanded = []
+    for entry in results:
+        record = records.get(entry.get("id")) if "fragment" not in entry else None
+        if record is None:
+            expanded.append(entry)
+            continue
+        expanded.append({"id": record.id, "question": record.question, "fragment": record.text,
+                         "codigos": entry.get("codigos", [])})
+    return expanded
+
+if __name__ == "__main__":
+    import argparse
+    from config.config import OUTPUT_DIR
+
+    parser = argparse.ArgumentParser(description="Export id-only results with their question and fragment text.")
+    parser.add_argument("results", nargs="?", default=os.path.join(OUTPUT_DIR, "all_interviews.json"),
+                        help="all_interviews.json or a partial/<document>.json file")
+    parser.add_argument("--segmented", default=os.path.join(OUTPUT_DIR, "segmented"), help="Segmented folder")
+    parser.add_argument("--output", help="Default: <results>_readable.json next to the input")
+    args = parser.parse_args()
+
+    with open(args.results, "r", encoding="utf-8") as f:
+        results = json.load(f)
+    expanded = expand_results(results, load_records(args.segmented))
+    output = args.output or os.path.splitext(args.results)[0] + "_readable.json"
+    tmp_path = output + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(expanded, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, output)
+
+    unresolved = sum(1 for entry in expanded if "fragment" not in entry)
+    print(f"Wrote {len(expanded)} entries to {output}")
+    if unresolved:
+        print(f"{unresolved} ids have no record in {args.segmented} and were left as they are")
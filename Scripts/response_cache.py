@@ -0,0 +1,167 @@
+# Scripts/response_cache.py
+
+"""
+Persistent, content-addressed cache for chat completions.
+
+Entries are keyed on a hash of (stage, model, prompt template version, temperature,
+input text), so a re-run with the same transcript, prompt and model reuses the stored
+answer instead of calling the API again. Bumping a stage's prompt version (or changing
+the model) simply produces new keys; the stale entries age out through eviction.
+
+Storage is a single SQLite file (stdlib, safe across threads and crashes). The cache is
+bounded by total stored bytes: when the bound is exceeded the least recently used
+entries are evicted until the cache is back under RESPONSE_CACHE_EVICT_TO of the limit.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from config.config import OUTPUT_DIR, RESPONSE_CACHE_MAX_MB
+from Scripts.tracing import record_span, trace_context
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = os.path.join(OUTPUT_DIR, "llm_response_cache.sqlite3")
+RESPONSE_CACHE_EVICT_TO = 0.9   # fracción del límite que queda tras una evicción
+
+def cache_key(stage: str, model: str, prompt_version: str, temperature: float, text: str) -> str:
+    """Content address of one request: sha256 over its canonical JSON description."""
+    payload = json.dumps([stage, model, str(prompt_version), float(temperature), text],
+                         ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    LRU-evicted, size-bounded SQLite cache of model outputs.
+
+    Args:
+        path (str): SQLite file.
+        max_bytes (int): Upper bound on the stored text; 0 disables the cache.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._total = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, stage TEXT, value TEXT NOT NULL,"
+                " size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses(last_access)")
+            self._total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str):
+        """Stored output for `key`, or None. A hit refreshes the entry's LRU position."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str, stage: str = ""):
+        """Stores `value` under `key` and evicts LRU entries if the size bound is exceeded."""
+        if not self.enabled or value is None:
+            return
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            conn = self._connect()
+            old = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, stage, value, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, stage, value, size, time.time())
+            )
+            self._total += size - (old[0] if old else 0)
+            if self._total > self.max_bytes:
+                self._evict(conn)
+
+    def _evict(self, conn):
+        target = int(self.max_bytes * RESPONSE_CACHE_EVICT_TO)
+        evicted = 0
+        while self._total > target:
+            rows = conn.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT 256").fetchall()
+            if not rows:
+                break
+            victims = []
+            for key, size in rows:
+                victims.append((key,))
+                self._total -= size
+                if self._total <= target:
+                    break
+            conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+            evicted += len(victims)
+        logger.info("Response cache evicted %d entries (now %.1f MB)", evicted, self._total / 1e6)
+
+    def stats(self) -> dict:
+        if not self.enabled:
+            return {"entries": 0, "bytes": 0, "hits": self.hits, "misses": self.misses}
+        with self._lock:
+            conn = self._connect()
+            entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {"entries": entries, "bytes": self._total, "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            self._total = 0
+
+response_cache = ResponseCache(CACHE_PATH, RESPONSE_CACHE_MAX_MB * 1024 * 1024)
+
+def cached_completion(stage, prompt_version, model, temperature, text, compute):
+    """
+    Returns the cached output for this request, or calls `compute()` and caches its result.
+    `compute` should raise on failure so fallbacks are never cached.
+    """
+    if not response_cache.enabled:
+        return compute()
+    key = cache_key(stage, model, prompt_version, temperature, text)
+    cached = response_cache.get(key)
+    if cached is not None:
+        logger.debug("Response cache hit for %s (text length %d)", stage, len(text))
+        record_span(stage, "chat", model=model, cache="hit", status="ok", attempts=0, latency_ms=0.0,
+                    prompt_chars=len(text))
+        return cached
+    with trace_context(cache="miss"):
+        value = compute()
+    response_cache.put(key, value, stage=stage)
+    return value
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or clear the LLM response cache.")
+    parser.add_argument("command", choices=["stats", "clear"])
+    args = parser.parse_args()
+
+    if args.command == "clear":
+        response_cache.clear()
+    print(response_cache.stats())
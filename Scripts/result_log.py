@@ -0,0 +1,163 @@
+# Scripts/result_log.py
+
+"""
+Machine-readable classification log.
+
+One JSONL record per classified fragment:
+    {"ts", "document", "fragment_id", "codes", "confidence", "chars", "preview", "timings_ms"}
+
+The classifier only puts the raw values on a queue (QueueHandler); a listener thread does
+the JSON encoding and writes to a size-rotated file, so logging costs a dict and a
+queue.put per fragment. The handler is installed on first use, not at import time.
+JsonlLog is the same writer for any event stream (the API trace in Scripts/tracing.py uses it).
+
+    python -m Scripts.result_log                     # summary of the current log
+    python -m Scripts.result_log path/to/log.jsonl
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from config.config import OUTPUT_DIR, CLASSIFICATION_LOG_PATH, CLASSIFICATION_LOG_MAX_MB, CLASSIFICATION_LOG_BACKUPS
+
+LOG_PATH = CLASSIFICATION_LOG_PATH or os.path.join(OUTPUT_DIR, "classification_results.jsonl")
+PREVIEW_CHARS = 60
+
+_setup_lock = threading.Lock()
+
+class _RecordQueueHandler(QueueHandler):
+    """Enqueues the record untouched: formatting is left to the listener thread."""
+
+    def prepare(self, record):
+        return record
+
+class JsonlLog:
+    """
+    A size-rotated JSONL file fed through a queue: emit() only enqueues the event dict;
+    `formatter` turns it into a line on the listener thread. Started on first use.
+    """
+
+    def __init__(self, name, path, formatter, max_mb, backups):
+        self.path = path
+        self.formatter = formatter
+        self.max_mb = max_mb
+        self.backups = backups
+        self.logger = logging.getLogger(name)
+        self.logger.propagate = False
+        self._listener = None
+
+    def _setup(self):
+        """Installs the queue handler and starts the writer thread (once per process)."""
+        with _setup_lock:
+            if self._listener is not None:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            file_handler = RotatingFileHandler(self.path, maxBytes=int(self.max_mb * 1024 * 1024),
+                                               backupCount=self.backups, encoding="utf-8")
+            file_handler.setFormatter(self.formatter)
+            log_queue = queue.SimpleQueue()
+            self.logger.handlers = [_RecordQueueHandler(log_queue)]
+            self.logger.setLevel(logging.INFO)
+            self._listener = QueueListener(log_queue, file_handler)
+            self._listener.start()
+            atexit.register(self.shutdown)
+
+    def emit(self, event: dict):
+        if self._listener is None:
+            self._setup()
+        self.logger.info("event", extra={"event": event})
+
+    def shutdown(self):
+        """Flushes pending records and stops the writer thread."""
+        with _setup_lock:
+            if self._listener is not None:
+                self._listener.stop()
+                for handler in self._listener.handlers:
+                    handler.close()
+                self._listener = None
+
+class JsonlFormatter(logging.Formatter):
+    """Serialises the `event` dict attached to a record as one JSON line."""
+
+    def format(self, record):
+        event = dict(record.event)
+        fragment = event.pop("fragment", None) or ""
+        line = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))}
+        line.update(event)
+        line["chars"] = len(fragment)
+        line["preview"] = fragment[:PREVIEW_CHARS]
+        timings = line.get("timings_ms")
+        if timings:
+            line["timings_ms"] = {stage: round(ms, 2) for stage, ms in timings.items()}
+        return json.dumps(line, ensure_ascii=False)
+
+result_log = JsonlLog("classification_results", LOG_PATH, JsonlFormatter(),
+                      CLASSIFICATION_LOG_MAX_MB, CLASSIFICATION_LOG_BACKUPS)
+shutdown = result_log.shutdown
+
+def log_result(document, fragment_id, fragment, codes, confidence, timings_ms=None):
+    """Queues one classification record. `fragment` is only sliced in the writer thread."""
+    result_log.emit({
+        "document": document,
+        "fragment_id": fragment_id,
+        "codes": codes,
+        "confidence": confidence,
+        "timings_ms": timings_ms,
+        "fragment": fragment,
+    })
+
+def iter_records(path=LOG_PATH, backups=CLASSIFICATION_LOG_BACKUPS):
+    """Reads a log and its rotated backups, oldest first; damaged lines are skipped."""
+    paths = [f"{path}.{n}" for n in range(backups, 0, -1)] + [path]
+    for p in paths:
+        if not os.path.exists(p):
+            continue
+        with open(p, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+def summarize(records) -> dict:
+    """Per-document counts, code frequencies, mean confidence and mean stage timings."""
+    documents = defaultdict(lambda: {"fragments": 0, "classified": 0})
+    codes = Counter()
+    confidence, timings, timed = 0.0, defaultdict(float), 0
+    total = classified = 0
+    for record in records:
+        total += 1
+        doc = documents[record.get("document")]
+        doc["fragments"] += 1
+        if record.get("codes"):
+            classified += 1
+            doc["classified"] += 1
+            codes.update(record["codes"])
+            confidence += record.get("confidence") or 0.0
+        if record.get("timings_ms"):
+            timed += 1
+            for stage, ms in record["timings_ms"].items():
+                timings[stage] += ms
+    return {
+        "fragments": total,
+        "classified": classified,
+        "mean_confidence": round(confidence / classified, 3) if classified else 0.0,
+        "mean_timings_ms": {stage: round(ms / timed, 2) for stage, ms in sorted(timings.items())},
+        "documents": dict(documents),
+        "top_codes": codes.most_common(10),
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarise the JSONL classification log.")
+    parser.add_argument("path", nargs="?", default=LOG_PATH)
+    args = parser.parse_args()
+    print(json.dumps(summarize(iter_records(args.path)), ensure_ascii=False, indent=2))
@@ -1,12 +1,15 @@
 # Scripts/segmentation.py
 
-import time
-import openai
 import logging
-from config.config import OPENAI_API_KEY, GPT_MODEL, API_DELAY, INITIAL_DELAY, MIN_FRAGMENT_LENGTH
+from config.config import GPT_MODEL, MIN_FRAGMENT_LENGTH
+from Scripts.api_client import chat_completion
+from Scripts.response_cache import cached_completion
 
 logger = logging.getLogger(__name__)
-openai.api_key = OPENAI_API_KEY
+
+# Subir esta versión cada vez que cambie el prompt de segmentación (invalida la cache de respuestas)
+SEGMENTATION_PROMPT_VERSION = "1"
+SEGMENTATION_TEMPERATURE = 0.2
 
 def segment_text(text, retries=3):
     """
@@ -51,30 +54,33 @@ def segment_text(text, retries=3):
     )
     logger.debug("Segmentation request for text of length %d", len(text))
     
-    for attempt in range(retries):
-        try:
-            response = openai.ChatCompletion.create(
-                model=GPT_MODEL,
-                messages=[
-                    {"role": "system", "content": "Eres un asistente experto en segmentación de texto para codificación cualitativa."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.2,
-                max_tokens=1500
-            )
-            raw_output = response.choices[0].message.content.strip()
-            logger.debug("Successful segmentation on attempt %d", attempt + 1)
-            # Cada línea de la respuesta se toma como un fragmento
-            fragments = [line.strip() for line in raw_output.split("\n") if line.strip()]
-            # Limitar a máximo 3 fragmentos
-            fragments = fragments[:3]
-            # Filtrar fragmentos muy cortos
-            fragments = [f for f in fragments if len(f) >= MIN_FRAGMENT_LENGTH]
-            time.sleep(API_DELAY)
-            return fragments
-        except Exception as e:
-            wait_time = INITIAL_DELAY * (2 ** attempt)
-            logger.error("Error en segmentación (intento %d): %s. Reintentando en %.2fs", attempt + 1, e, wait_time)
-            time.sleep(wait_time)
-    logger.warning("Devolviendo todo el texto como un solo fragmento tras %d intentos fallidos", retries)
-    return [text]
+    def compute():
+        response = chat_completion(
+            "segmentation",
+            model=GPT_MODEL,
+            messages=[
+                {"role": "system", "content": "Eres un asistente experto en segmentación de texto para codificación cualitativa."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=SEGMENTATION_TEMPERATURE,
+            max_tokens=1500,
+            max_retries=retries
+        )
+        return response.choices[0].message.content.strip()
+
+    # La salida cruda se guarda en la cache; el post-procesado de abajo se aplica siempre
+    try:
+        raw_output = cached_completion("segmentation", SEGMENTATION_PROMPT_VERSION, GPT_MODEL,
+                                       SEGMENTATION_TEMPERATURE, text, compute)
+    except Exception as e:
+        logger.warning("Devolviendo todo el texto como un solo fragmento tras %d intentos fallidos: %s", retries, e)
+        return [text]
+
+    logger.debug("Successful segmentation")
+    # Cada línea de la respuesta se toma como un fragmento
+    fragments = [line.strip() for line in raw_output.split("\n") if line.strip()]
+    # Limitar a máximo 3 fragmentos
+    fragments = fragments[:3]
+    # Filtrar fragmentos muy cortos
+    fragments = [f for f in fragments if len(f) >= MIN_FRAGMENT_LENGTH]
+    return fragments
@@ -0,0 +1,175 @@
+# Scripts/tracing.py
+
+"""
+Per-call API trace: one JSONL span per API interaction, written to API_TRACE_PATH
+(default OUTPUT_DIR/api_trace.jsonl) through the same queued, size-rotated writer as the
+classification log. Tracing is opt-in: set API_TRACE=true (environment or .env) for the
+runs you want to inspect; otherwise record_span() does nothing.
+
+    {"ts", "stage", "endpoint", "model", "document", "fragments", "cache", "status",
+     "attempts", "latency_ms", "throttled_ms", "prompt_tokens", "completion_tokens",
+     "prompt_estimate", "prompt_chars", "error"}
+
+api_client writes the spans; callers only say what the work is about: trace_context()
+sets the document / fragment ids (context variables, so they follow asyncio tasks and
+asyncio.to_thread workers) and the cache outcome. Responses served by the LLM response
+cache or the cassette are traced too (cache "hit" / "cassette", attempts 0), so the trace
+shows what a cache saves as well as what the API costs.
+
+    python -m Scripts.tracing                      # where time and tokens go, per stage and transcript
+    python -m Scripts.tracing path/to/api_trace.jsonl --top 20
+    python -m Scripts.tracing --json
+"""
+
+import os
+import json
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import defaultdict
+
+from config.config import OUTPUT_DIR, API_TRACE, API_TRACE_PATH, API_TRACE_MAX_MB, API_TRACE_BACKUPS
+from Scripts.result_log import JsonlLog, iter_records
+
+TRACE_PATH = API_TRACE_PATH or os.path.join(OUTPUT_DIR, "api_trace.jsonl")
+
+_document = ContextVar("trace_document", default=None)
+_fragments = ContextVar("trace_fragments", default=None)
+_cache = ContextVar("trace_cache", default=None)
+
+class SpanFormatter(logging.Formatter):
+    def format(self, record):
+        line = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))}
+        line.update(record.event)
+        for key in ("latency_ms", "throttled_ms"):
+            if line.get(key) is not None:
+                line[key] = round(line[key], 1)
+        return json.dumps(line, ensure_ascii=False)
+
+trace_log = JsonlLog("api_trace", TRACE_PATH, SpanFormatter(), API_TRACE_MAX_MB, API_TRACE_BACKUPS)
+shutdown = trace_log.shutdown
+
+@contextmanager
+def trace_context(document=None, fragments=None, cache=None):
+    """
+    Attributes the API calls made inside the block (in this task/thread and the workers it
+    starts) to a document and fragment id(s), and optionally marks them as cache misses.
+    """
+    if isinstance(fragments, str):
+        fragments = [fragments]
+    tokens = [(var, var.set(value)) for var, value in
+              ((_document, document), (_fragments, fragments), (_cache, cache)) if value is not None]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+def record_span(stage: str, endpoint: str = None, **fields):
+    """Queues one span; document, fragments and cache default to the current trace_context."""
+    if not API_TRACE:
+        return
+    event = {
+        "stage": stage,
+        "endpoint": endpoint,
+        "document": _document.get(),
+        "fragments": _fragments.get(),
+        "cache": fields.pop("cache", None) or _cache.get(),
+    }
+    event.update(fields)
+    trace_log.emit(event)
+
+def iter_spans(path=TRACE_PATH):
+    return iter_records(path, API_TRACE_BACKUPS)
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def summarize(spans) -> dict:
+    """
+    Totals per stage and per document: spans, API calls, attempts, errors, cache hits,
+    tokens (actual and estimated), latency (sum, p50, p95) and limiter wait.
+    """
+    def group():
+        return {"spans": 0, "api_calls": 0, "attempts": 0, "errors": 0, "cache_hits": 0,
+                "prompt_tokens": 0, "completion_tokens": 0, "prompt_estimate": 0,
+                "latency_ms": [], "throttled_ms": 0.0}
+
+    stages, documents = defaultdict(group), defaultdict(group)
+    for span in spans:
+        for g in (stages[span.get("stage")], documents[span.get("document") or "-"]):
+            g["spans"] += 1
+            attempts = span.get("attempts") or 0
+            g["attempts"] += attempts
+            if attempts:
+                g["api_calls"] += 1
+                g["latency_ms"].append(span.get("latency_ms") or 0.0)
+            if span.get("status") == "error":
+                g["errors"] += 1
+            if span.get("cache") in ("hit", "cassette"):
+                g["cache_hits"] += 1
+            g["prompt_tokens"] += span.get("prompt_tokens") or 0
+            g["completion_tokens"] += span.get("completion_tokens") or 0
+            if span.get("prompt_tokens"):
+                g["prompt_estimate"] += span.get("prompt_estimate") or 0
+            g["throttled_ms"] += span.get("throttled_ms") or 0.0
+
+    def finish(groups):
+        total_latency = sum(sum(g["latency_ms"]) for g in groups.values()) or 1.0
+        total_tokens = sum(g["prompt_tokens"] + g["completion_tokens"] for g in groups.values()) or 1
+        out = {}
+        for name, g in groups.items():
+            latencies = g.pop("latency_ms")
+            tokens = g["prompt_tokens"] + g["completion_tokens"]
+            g.update({
+                "retries": g["attempts"] - g["api_calls"],
+                "latency_s": round(sum(latencies) / 1000, 3),
+                "p50_latency_ms": round(_percentile(latencies, 0.50), 1),
+                "p95_latency_ms": round(_percentile(latencies, 0.95), 1),
+                "throttled_s": round(g.pop("throttled_ms") / 1000, 3),
+                "latency_share": round(sum(latencies) / total_latency, 3),
+                "token_share": round(tokens / total_tokens, 3),
+                # Real prompt tokens per len/4 estimated token, over the spans that report usage
+                "estimate_ratio": round(g["prompt_tokens"] / g["prompt_estimate"], 2) if g["prompt_estimate"] else None,
+            })
+            out[name] = g
+        return dict(sorted(out.items(), key=lambda item: -item[1]["latency_s"]))
+
+    return {"stages": finish(stages), "documents": finish(documents)}
+
+def print_summary(summary, top: int = 10):
+    columns = ("api_calls", "retries", "errors", "cache_hits", "prompt_tokens", "completion_tokens",
+               "latency_s", "p50_latency_ms", "p95_latency_ms", "throttled_s", "latency_share", "token_share")
+    for title, rows in (("stage", summary["stages"]), ("document", summary["documents"])):
+        names = list(rows)[:top] if title == "document" else list(rows)
+        width = max([len(str(n)) for n in names] + [len(title)])
+        print(f"{title:<{width}}  " + "  ".join(f"{c:>17}" for c in columns))
+        for name in names:
+            print(f"{str(name):<{width}}  " + "  ".join(f"{rows[name][c]:>17}" for c in columns))
+        if title == "document" and len(rows) > top:
+            print(f"... {len(rows) - top} more documents (use --top)")
+        print()
+    ratios = {s: g["estimate_ratio"] for s, g in summary["stages"].items() if g["estimate_ratio"] is not None}
+    if ratios:
+        print("Actual prompt tokens per len/4 estimate: " + ", ".join(f"{s} {r}" for s, r in ratios.items()))
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarise the per-call API trace.")
+    parser.add_argument("path", nargs="?", default=TRACE_PATH)
+    parser.add_argument("--top", type=int, default=10, help="Documents to list, most expensive first")
+    parser.add_argument("--json", action="store_true", help="Print the full summary as JSON")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        raise SystemExit(f"No trace at {args.path}; run the pipeline with API_TRACE=true to write one.")
+    summary = summarize(iter_spans(args.path))
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print_summary(summary, args.top)
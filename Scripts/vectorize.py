@@ -1,71 +1,111 @@
 # Scripts/vectorize.py
 
-import openai
 import logging
 import os
-import pickle
-import time
-from config.config import OPENAI_API_KEY, EMBEDDING_MODEL, OUTPUT_DIR
+import re
+from config.config import OUTPUT_DIR, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_CHARS
+from Scripts.embedding_store import EmbeddingStore
+from Scripts.embedding_providers import get_provider, OpenAIEmbeddingProvider
 
 logger = logging.getLogger(__name__)
-openai.api_key = OPENAI_API_KEY
 
+# Backend chosen with EMBEDDING_PROVIDER (OpenAI, local hashing, local model)
+embedding_provider = get_provider()
+
+# Legacy whole-dict pickle (OpenAI vectors); imported once into the store if present
 CACHE_PATH = os.path.join(OUTPUT_DIR, "embeddings_cache.pkl")
+# One store per embedding model so vectors of different models never mix
+STORE_DIR = os.path.join(OUTPUT_DIR, "embeddings", re.sub(r"[^A-Za-z0-9_.-]+", "_", embedding_provider.model_id))
+
+embedding_cache = EmbeddingStore(
+    STORE_DIR, legacy_pickle=CACHE_PATH if isinstance(embedding_provider, OpenAIEmbeddingProvider) else None
+)
 
 def load_cache():
-    if os.path.exists(CACHE_PATH):
-        try:
-            with open(CACHE_PATH, "rb") as f:
-                cache = pickle.load(f)
-                logger.debug("Persistent cache loaded with %d items", len(cache))
-                return cache
-        except Exception as e:
-            logger.error("Error loading persistent cache: %s", e)
-    return {}
+    """Returns the persistent embedding store (dict-like, loaded lazily on first access)."""
+    logger.debug("Persistent embedding store at %s", STORE_DIR)
+    return embedding_cache
 
 def save_cache(cache):
+    """
+    Kept for compatibility: the store persists every insert as it happens.
+    A plain dict passed here is merged into the store.
+    """
     try:
-        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
-        with open(CACHE_PATH, "wb") as f:
-            pickle.dump(cache, f)
-            logger.debug("Persistent cache saved with %d items", len(cache))
+        if cache is embedding_cache:
+            embedding_cache.flush()
+        else:
+            embedding_cache.put_many(cache.items())
+        logger.debug("Persistent embedding store holds %d items", len(embedding_cache))
     except Exception as e:
         logger.error("Error saving persistent cache: %s", e)
 
-embedding_cache = load_cache()
-
 def get_embedding(text, max_retries=3):
-    if text in embedding_cache:
+    cached = embedding_cache.get(text)
+    if cached is not None:
         logger.debug("Using cached embedding for text (length %d)", len(text))
-        return embedding_cache[text]
+        return cached
     logger.debug("Generating embedding for text (length %d)", len(text))
     
-    for attempt in range(max_retries):
-        try:
-            response = openai.Embedding.create(
-                model=EMBEDDING_MODEL,
-                input=text
-            )
-            embedding = response['data'][0]['embedding']
-            embedding_cache[text] = embedding
-            save_cache(embedding_cache)
-            logger.debug("Embedding generated (length %d)", len(embedding))
-            return embedding
-        except Exception as e:
-            wait_time = 2 ** attempt  # Exponential backoff
-            logger.error("Error generating embedding (attempt %d/%d): %s. Retrying in %ds", 
-                        attempt + 1, max_retries, e, wait_time)
-            if attempt < max_retries - 1:
-                time.sleep(wait_time)
-            else:
-                logger.error("Failed to generate embedding after %d attempts", max_retries)
-                return None
+    try:
+        vector = embedding_provider.embed([text], max_retries=max_retries)[0]
+    except Exception as e:
+        logger.error("Failed to generate embedding after %d attempts: %s", max_retries, e)
+        return None
+    embedding_cache.put(text, vector)
+    embedding = embedding_cache.get(text)
+    logger.debug("Embedding generated (length %d)", len(embedding))
+    return embedding
+
+def _iter_batches(texts, batch_size, max_chars):
+    """Splits texts into batches bounded both by count and by total characters."""
+    batch, chars = [], 0
+    for text in texts:
+        if batch and (len(batch) >= batch_size or chars + len(text) > max_chars):
+            yield batch
+            batch, chars = [], 0
+        batch.append(text)
+        chars += len(text)
+    if batch:
+        yield batch
+
+def _embed_batch(batch, max_retries=3):
+    """Sends one embeddings request for a list of texts; returns vectors in batch order or None."""
+    try:
+        return embedding_provider.embed(batch, max_retries=max_retries)
+    except Exception as e:
+        logger.error("Failed to generate batch of %d embeddings after %d attempts: %s", len(batch), max_retries, e)
+        return None
+
+def get_embeddings(texts, batch_size=EMBEDDING_BATCH_SIZE, max_chars=EMBEDDING_BATCH_MAX_CHARS, max_retries=3):
+    """
+    Batched counterpart of get_embedding.
+    Dedupes the input, serves cached vectors from the store and sends only the misses
+    in size-bounded requests (list input).
+
+    Args:
+        texts (List[str]): Texts to embed (duplicates allowed).
+        batch_size (int): Maximum number of texts per request.
+        max_chars (int): Maximum total characters per request.
+
+    Returns:
+        List: One embedding per input text, in input order (None where it could not be generated).
+    """
+    misses = [t for t in dict.fromkeys(texts) if t not in embedding_cache]
+    logger.debug("Embeddings requested for %d texts, %d unique misses", len(texts), len(misses))
+
+    for batch in _iter_batches(misses, batch_size, max_chars):
+        vectors = _embed_batch(batch, max_retries=max_retries)
+        if vectors is None:
+            continue
+        embedding_cache.put_many(zip(batch, vectors))
+
+    return [embedding_cache.get(t) for t in texts]
 
 def vectorize_fragments(fragments):
     logger.info("Vectorizing %d fragmentos", len(fragments))
     results = []
-    for fragment in fragments:
-        emb = get_embedding(fragment)
+    for fragment, emb in zip(fragments, get_embeddings(fragments)):
         if emb is not None:
             results.append((fragment, emb))
         else:
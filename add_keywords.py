@@ -1,8 +1,8 @@
 import json
-import time
 import importlib.util
 import os
-from config.config import OPENAI_API_KEY, GPT_MODEL, API_DELAY
+from config.config import GPT_MODEL
+from Scripts.api_client import chat_completion
 
 # Ruta absoluta al codebook original
 CODEBOOK_PATH = r"C:\Users\Felipe Nunez\Documents\Machine Learning Work\JER\codificacion_final\config\codebook_def.py"
@@ -52,9 +52,6 @@ def build_prompt(code_name, definition, keywords, examples, old_phrases):
     return prompt
 
 def refine_codebook(codebook, model=GPT_MODEL):
-    import openai
-    openai.api_key = OPENAI_API_KEY
-
     refined_codebook = {}
 
     for code_name, entry in codebook.items():
@@ -73,7 +70,8 @@ def refine_codebook(codebook, model=GPT_MODEL):
             old_phrases=phrases
         )
         try:
-            response = openai.ChatCompletion.create(
+            response = chat_completion(
+                "codebook",
                 model=model,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.0,
@@ -85,7 +83,6 @@ def refine_codebook(codebook, model=GPT_MODEL):
             entry["phrases"] = response_json["phrases"]
             refined_codebook[code_name] = entry
             print(f"Procesado: {code_name}")
-            time.sleep(API_DELAY)
         except Exception as e:
             print(f"Error procesando {code_name}: {e}")
             print("Respuesta bruta:", response.choices[0].message.content if 'response' in locals() else "")
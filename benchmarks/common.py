@@ -0,0 +1,150 @@
+# benchmarks/common.py
+
+"""
+Shared helpers for the benchmark scripts: timing, fixtures from the real transcripts and
+codebook, fixed-seed synthetic embeddings, and JSON result files.
+
+Each run writes benchmarks/results/<suite>-<git revision>.json (or --output), with the
+environment next to the numbers, so two revisions can be compared with --compare.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import statistics
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRANSCRIPTS_DIR = os.path.join(ROOT, "assets", "input", "interviews", "txt")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+EMBEDDING_DIM = 1536
+SEED = 20250514
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+def git_revision() -> str:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                             text=True, timeout=10).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True, timeout=30).stdout.strip()
+        return (rev or "unknown") + ("-dirty" if dirty else "")
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+def environment() -> dict:
+    return {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def transcript_paths(root: str = TRANSCRIPTS_DIR) -> list:
+    """Every .txt transcript under the input folder, sorted."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        paths.extend(os.path.join(dirpath, f) for f in sorted(filenames) if f.endswith(".txt"))
+    return paths
+
+def synthetic_embeddings(n: int, dim: int = EMBEDDING_DIM, seed: int = SEED, centers=None, noise: float = 1.0):
+    """
+    Fixed-seed float32 vectors. With `centers` (k, dim), row i is centers[i % k] plus noise,
+    so fragments land near codebook examples the way real embeddings do.
+    """
+    rng = np.random.default_rng(seed)
+    noise_rows = rng.standard_normal((n, dim)).astype(np.float32)
+    if centers is None:
+        return noise_rows
+    centers = np.asarray(centers, dtype=np.float32)
+    return centers[np.arange(n) % len(centers)] + noise * noise_rows
+
+def synthetic_codebook_index(seed: int = SEED):
+    """
+    CodebookIndex over the real FINAL_CODEBOOK_JER with synthetic embeddings: each category's
+    positive example sits near its own center, negatives are random. Returns (index, centers).
+    """
+    from config.codebook_def_def import FINAL_CODEBOOK_JER
+    from Scripts.classification import CodebookIndex
+
+    categories = list(FINAL_CODEBOOK_JER)
+    centers = synthetic_embeddings(len(categories), seed=seed)
+    labeled = []
+    for n, category in enumerate(categories):
+        details = FINAL_CODEBOOK_JER[category]
+        labeled.append((details.get("definition", ""), category, centers[n] + 0.3 * synthetic_embeddings(1, seed=seed + n)[0], True))
+        for m, neg in enumerate(details.get("negative_examples", [])):
+            labeled.append((neg, category, synthetic_embeddings(1, seed=seed + 1000 * (n + 1) + m)[0], False))
+    return CodebookIndex(labeled, quantization="none"), centers
+
+def measure(fn, repeat: int = 5, min_time: float = 0.2, items: int = 1) -> dict:
+    """
+    timeit-style measurement: calls fn() enough times per round to last `min_time`, runs
+    `repeat` rounds and reports per-call and per-item times (µs). `items` is how many units
+    one call processes (fragments, files...).
+    """
+    number, elapsed = 1, 0.0
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    rounds = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number)
+    best, median = min(rounds), statistics.median(rounds)
+    return {
+        "calls_per_round": number,
+        "rounds": repeat,
+        "best_us": round(best * 1e6, 3),
+        "median_us": round(median * 1e6, 3),
+        "items_per_call": items,
+        "median_us_per_item": round(median * 1e6 / max(items, 1), 3),
+    }
+
+def write_results(suite: str, results: dict, output: str = None, **extra) -> str:
+    """Writes {"suite", "environment", ..., "results"} and returns the path."""
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{suite}-{git_revision()}.json")
+    data = {"suite": suite, "environment": environment(), **extra, "results": results}
+    tmp = output + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, output)
+    return output
+
+def compare(previous_path: str, results: dict, key: str = "median_us") -> list:
+    """Rows of (benchmark, before, after, after/before) against an earlier result file."""
+    with open(previous_path, "r", encoding="utf-8") as f:
+        before = json.load(f)["results"]
+    rows = []
+    for name, after in results.items():
+        if name in before and key in before[name] and key in after and before[name][key]:
+            rows.append((name, before[name][key], after[key], after[key] / before[name][key]))
+    return rows
+
+def print_table(results: dict, columns=("median_us", "median_us_per_item", "items_per_call")):
+    width = max((len(n) for n in results), default=10)
+    print(f"{'benchmark':<{width}}  " + "  ".join(f"{c:>18}" for c in columns))
+    for name, row in results.items():
+        print(f"{name:<{width}}  " + "  ".join(f"{row.get(c, ''):>18}" for c in columns))
+
+def print_comparison(rows, unit: str = "µs"):
+    for name, before, after, ratio in rows:
+        flag = "  <-- slower" if ratio > 1.10 else ("  faster" if ratio < 0.90 else "")
+        print(f"{name:<40} {before:>14.1f} -> {after:>14.1f} {unit}  x{ratio:.2f}{flag}")
@@ -0,0 +1,159 @@
+# benchmarks/micro.py
+
+"""
+Micro-benchmarks for the CPU hot paths, on the real transcripts and the real codebook.
+
+Embeddings are synthetic (fixed seed, clustered around one center per codebook category),
+so the suite runs offline and gives the same inputs on every revision.
+
+    python -m benchmarks.micro                           # all benchmarks
+    python -m benchmarks.micro --only similarity parse   # names containing these words
+    python -m benchmarks.micro --compare benchmarks/results/micro-abc1234.json
+"""
+
+import os
+import json
+import random
+import logging
+import argparse
+
+from benchmarks.common import (TRANSCRIPTS_DIR, SEED, EMBEDDING_DIM, transcript_paths, synthetic_embeddings,
+                               synthetic_codebook_index, measure, write_results, compare, print_table,
+                               print_comparison)
+from config.config import MAX_CHUNK_LENGTH
+from config.codebook_def_def import FINAL_CODEBOOK_JER
+from utils.utils import normalize_text, split_text_into_chunks, read_text_file
+from Scripts.loader import load_fragments_with_question
+from Scripts.classification import (classify_by_similarity, classify_by_similarity_batch,
+                                    find_best_category_match, get_category_resolver, is_meaningful_content,
+                                    enhanced_parse_refined_categories)
+from classify_from_files import FragmentQuestionIndex, find_question_for_fragment
+
+logger = logging.getLogger(__name__)
+
+N_SIMILARITY_FRAGMENTS = 256
+N_PARSE_RESPONSES = 100
+
+# ---------------------------------------------------------------------- fixtures
+
+def build_fixtures(paths):
+    rng = random.Random(SEED)
+    texts = [read_text_file(p) for p in paths]
+    pairs = [pair for p in paths for pair in load_fragments_with_question(p)]
+    fragments = [pair["response"] for pair in pairs]
+    categories = list(FINAL_CODEBOOK_JER)
+
+    index, centers = synthetic_codebook_index()
+    frag_embeddings = synthetic_embeddings(N_SIMILARITY_FRAGMENTS, seed=SEED + 1, centers=centers, noise=0.6)
+
+    # Category names as a model writes them: exact, lower-cased, code only, no code, trailing dot, a typo
+    variants = []
+    for category in categories:
+        code, _, name = category.partition(" ")
+        typo = category[:len(category) // 2] + category[len(category) // 2 + 1:]
+        variants += [category, category.lower(), code.rstrip("."), name, category + ".", typo]
+
+    # Stage-2 style raw answers: plain JSON, fenced JSON, JSON followed by an explanation
+    raws = []
+    for n in range(N_PARSE_RESPONSES):
+        items = [{"código": rng.choice(categories), "confianza": round(rng.uniform(0.6, 0.98), 2),
+                  "justificación": rng.choice(["El fragmento desarrolla específicamente prácticas restaurativas.",
+                                               "Menciona de forma concreta el proceso en la institución.",
+                                               "Relación general con el tema."])}
+                 for _ in range(rng.randint(0, 3))]
+        raw = json.dumps(items, ensure_ascii=False, indent=2)
+        if n % 3 == 1:
+            raw = f"```json\n{raw}\n```"
+        elif n % 3 == 2:
+            raw = raw + "\n\nExplicación: se evaluaron todos los candidatos."
+        raws.append(raw)
+
+    # Fragment -> question lookups: exact, near-duplicate, contained, unknown
+    mapping = {}
+    for pair in pairs:
+        mapping.setdefault(normalize_text(pair["response"]), pair["question"])
+    stored = list(mapping)
+    queries = []
+    for text in rng.sample(stored, min(200, len(stored))):
+        queries.append(text)
+    for text in rng.sample(stored, min(100, len(stored))):
+        i = rng.randrange(len(text))
+        queries.append(text[:i] + text[i + 1:])
+    for text in rng.sample(stored, min(100, len(stored))):
+        if len(text) > 200:
+            start = rng.randrange(len(text) - 120)
+            queries.append(text[start:start + 120])
+    queries += [f"texto que no aparece en ninguna entrevista número {n} " * 3 for n in range(50)]
+
+    return {
+        "paths": paths, "texts": texts, "fragments": fragments, "categories": categories,
+        "index": index, "frag_embeddings": frag_embeddings, "variants": variants, "raws": raws,
+        "mapping": mapping, "queries": queries,
+    }
+
+# ---------------------------------------------------------------------- benchmarks
+
+def benchmarks(fx):
+    """name -> (callable, items per call)."""
+    paths, texts, fragments = fx["paths"], fx["texts"], fx["fragments"]
+    index, embs, categories = fx["index"], fx["frag_embeddings"], fx["categories"]
+    resolver = get_category_resolver(tuple(categories))
+    lookup_index = FragmentQuestionIndex(fx["mapping"])
+    queries = fx["queries"]
+
+    def resolve_cold():
+        resolver.resolve.cache_clear()
+        for v in fx["variants"]:
+            find_best_category_match(v, categories)
+
+    return {
+        "load_fragments_with_question": (lambda: [load_fragments_with_question(p) for p in paths], len(paths)),
+        "split_text_into_chunks": (lambda: [split_text_into_chunks(t, MAX_CHUNK_LENGTH) for t in texts], len(texts)),
+        "normalize_text": (lambda: [normalize_text(f) for f in fragments], len(fragments)),
+        "is_meaningful_content": (lambda: [is_meaningful_content(f) for f in fragments], len(fragments)),
+        "classify_by_similarity": (lambda: [classify_by_similarity(e, index) for e in embs], len(embs)),
+        "classify_by_similarity_batch": (lambda: classify_by_similarity_batch(embs, index), len(embs)),
+        "find_best_category_match_warm": (lambda: [find_best_category_match(v, categories) for v in fx["variants"]],
+                                          len(fx["variants"])),
+        "find_best_category_match_cold": (resolve_cold, len(fx["variants"])),
+        "enhanced_parse_refined_categories": (lambda: [enhanced_parse_refined_categories(r) for r in fx["raws"]],
+                                              len(fx["raws"])),
+        "fragment_question_index_build": (lambda: FragmentQuestionIndex(fx["mapping"]), len(fx["mapping"])),
+        "find_question_for_fragment": (lambda: [find_question_for_fragment(q, lookup_index) for q in queries],
+                                       len(queries)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU hot-path micro-benchmarks.")
+    parser.add_argument("--input", default=TRANSCRIPTS_DIR, help="Transcript folder")
+    parser.add_argument("--only", nargs="+", help="Run benchmarks whose name contains any of these words")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Seconds per measurement round")
+    parser.add_argument("--output", help="Result file (default benchmarks/results/micro-<revision>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, force=True)
+    paths = transcript_paths(args.input)
+    if not paths:
+        raise SystemExit(f"No transcripts found under {args.input}")
+    fx = build_fixtures(paths)
+
+    results = {}
+    for name, (fn, items) in benchmarks(fx).items():
+        if args.only and not any(word in name for word in args.only):
+            continue
+        results[name] = measure(fn, repeat=args.repeat, min_time=args.min_time, items=items)
+
+    path = write_results("micro", results, args.output, corpus={
+        "transcripts": len(paths), "fragments": len(fx["fragments"]), "categories": len(fx["categories"]),
+        "codebook_examples": len(fx["index"]), "embedding_dim": EMBEDDING_DIM, "seed": SEED,
+        "input": os.path.relpath(args.input),
+    })
+    print_table(results)
+    print(f"\nResults written to {path}")
+    if args.compare:
+        print_comparison(compare(args.compare, results))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+# benchmarks/pipeline.py
+
+"""
+End-to-end throughput benchmark: runs main_interview (clean, segment, embed, classify) or
+classify_from_files against fake_openai_server.py and sweeps concurrency, batch size and
+classification mode.
+
+Each configuration runs in a fresh process (config is read from the environment at import)
+with its own empty output folder, so nothing is served from the embedding store, the LLM
+response cache or the run manifest. Reported per configuration:
+    wall time, fragments/s, wall time per transcript, API calls (and retries) per fragment,
+    calls and p50/p95 latency per API stage, and mean per-fragment stage timings from the
+    classification log.
+
+    python -m benchmarks.pipeline --files 3 --latency-ms 200
+    python -m benchmarks.pipeline --target classify_files --modes two_stage local_prefilter similarity_only
+    python -m benchmarks.pipeline --in-flight 4 8 16 --batch-size 4 8 16 --latency-dist lognormal
+    python -m benchmarks.pipeline --compare benchmarks/results/pipeline-abc1234.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import asyncio
+import logging
+import argparse
+import itertools
+import subprocess
+import tempfile
+import urllib.request
+
+from benchmarks.common import ROOT, TRANSCRIPTS_DIR, transcript_paths, write_results, compare, print_comparison
+
+logger = logging.getLogger(__name__)
+
+TARGETS = ("main_interview", "classify_files")
+MODES = ("two_stage", "local_prefilter", "similarity_only")
+RESULT_MARKER = "BENCHMARK_RESULT "
+INPUT_SUBDIRS = ("directivos", "docentes", "estudiantes", "familia", "sed")   # las que lee main_interview
+
+# ---------------------------------------------------------------------- worker (one configuration)
+
+def _classification_summary():
+    from Scripts.result_log import shutdown, iter_records, summarize, LOG_PATH
+
+    shutdown()
+    return summarize(iter_records(LOG_PATH))
+
+def run_worker(target):
+    """Runs one target in this process (configured through the environment) and prints its numbers."""
+    output_dir = os.environ["OUTPUT_DIR"]
+    if target == "main_interview":
+        import main_interview
+
+        logging.getLogger().setLevel(logging.WARNING)
+        transcripts = len(main_interview.get_input_files())
+        start = time.perf_counter()
+        asyncio.run(main_interview.run_pipeline(force=True))
+        wall = time.perf_counter() - start
+    else:
+        from pathlib import Path
+        import classify_from_files
+
+        # classify_from_files keeps its own folder layout; point it at this run's output folder
+        base = Path(output_dir)
+        classify_from_files.SEGMENTED_DIR = base / "segmented"
+        classify_from_files.OUTPUT_DIR = base / "classified"
+        classify_from_files.ANALYSIS_DIR = base / "analysis"
+        classify_from_files.ALL_INTERVIEWS_PATH = base / "all_interviews.json"
+        classify_from_files.MANIFEST_PATH = base / "classified" / "classification_manifest.json"
+        logging.getLogger().setLevel(logging.WARNING)
+        transcripts = len(list(classify_from_files.SEGMENTED_DIR.glob("*.json")))
+        start = time.perf_counter()
+        classify_from_files.classify_files(force=True)
+        wall = time.perf_counter() - start
+
+    from Scripts.api_client import get_metrics
+
+    print(RESULT_MARKER + json.dumps({
+        "wall_s": wall,
+        "transcripts": transcripts,
+        "api": get_metrics(),
+        "classification": _classification_summary(),
+    }), flush=True)
+
+# ---------------------------------------------------------------------- driver
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _http(url, data=None, timeout=5):
+    request = urllib.request.Request(url, data=data, method="POST" if data is not None else "GET")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode("utf-8") or "null")
+
+class FakeServer:
+    """fake_openai_server.py in a subprocess, with its stats endpoints."""
+
+    def __init__(self, args):
+        self.port = args.port or _free_port()
+        self.base = f"http://127.0.0.1:{self.port}/v1"
+        command = [sys.executable, os.path.join(ROOT, "fake_openai_server.py"), "--port", str(self.port),
+                   "--latency-ms", str(args.latency_ms), "--latency-dist", args.latency_dist,
+                   "--ms-per-token", str(args.ms_per_token), "--rate-429", str(args.rate_429),
+                   "--rate-500", str(args.rate_500), "--seed", str(args.seed)]
+        self.process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                self.stats()
+                return
+            except OSError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.close()
+                    raise RuntimeError("fake_openai_server.py did not start")
+                time.sleep(0.1)
+
+    def stats(self):
+        return _http(f"{self.base}/stats")
+
+    def reset(self):
+        _http(f"{self.base}/stats/reset", data=b"")
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+def run_case(server, target, settings, input_dir, output_dir, timeout):
+    """Runs one configuration in a subprocess; returns its parsed result."""
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_BASE": server.base,
+        "OPENAI_API_KEY": "sk-benchmark",
+        "INPUT_DIR": input_dir,
+        "OUTPUT_DIR": output_dir,
+        "CLASSIFICATION_LOG_PATH": "",
+        "RESPONSE_CACHE_MAX_MB": "0",
+        "API_CASSETTE_MODE": "off",
+        "PYTHONIOENCODING": "utf-8",
+    })
+    env.update({name: str(value) for name, value in settings.items()})
+    server.reset()
+    completed = subprocess.run([sys.executable, "-m", "benchmarks.pipeline", "--worker", target], cwd=ROOT, env=env,
+                               capture_output=True, text=True, encoding="utf-8", timeout=timeout)
+    lines = [line for line in completed.stdout.splitlines() if line.startswith(RESULT_MARKER)]
+    if completed.returncode != 0 or not lines:
+        raise RuntimeError(f"{target} {settings} failed (exit {completed.returncode}):\n{completed.stderr[-2000:]}")
+    result = json.loads(lines[-1][len(RESULT_MARKER):])
+    result["server"] = server.stats()
+    return result
+
+def summarize_case(result):
+    """Flattens one worker result into the numbers the table and the comparison use."""
+    api = result["api"]
+    transcripts = result["transcripts"]
+    classification = result["classification"]
+    fragments = classification["fragments"]
+    wall = result["wall_s"]
+    calls = sum(m["calls"] + m["retries"] + m["failures"] for m in api.values())
+    return {
+        "wall_s": round(wall, 3),
+        "transcripts": transcripts,
+        "fragments": fragments,
+        "classified": classification["classified"],
+        "fragments_per_s": round(fragments / wall, 2) if wall else 0.0,
+        "wall_s_per_transcript": round(wall / transcripts, 3) if transcripts else 0.0,
+        "api_calls": calls,
+        "api_calls_per_fragment": round(calls / fragments, 3) if fragments else 0.0,
+        "retries": sum(m["retries"] for m in api.values()),
+        "stages": {stage: {key: m[key] for key in ("calls", "retries", "failures", "avg_latency_s",
+                                                   "p50_latency_s", "p95_latency_s", "throttled_s")}
+                   for stage, m in sorted(api.items())},
+        "fragment_timings_ms": classification["mean_timings_ms"],
+        "server": result["server"],
+    }
+
+def print_summary(results):
+    columns = ("wall_s", "fragments", "fragments_per_s", "wall_s_per_transcript", "api_calls_per_fragment", "retries")
+    width = max((len(n) for n in results), default=10)
+    print(f"{'configuration':<{width}}  " + "  ".join(f"{c:>22}" for c in columns))
+    for name, row in results.items():
+        print(f"{name:<{width}}  " + "  ".join(f"{row[c]:>22}" for c in columns))
+    print()
+    for name, row in results.items():
+        stages = ", ".join(f"{stage} {m['calls']}x p50={m['p50_latency_s']:.3f}s p95={m['p95_latency_s']:.3f}s"
+                           + (f" throttled={m['throttled_s']:.1f}s" if m["throttled_s"] else "")
+                           for stage, m in row["stages"].items())
+        print(f"{name}: {stages}")
+
+def prepare_input(paths, source_dir, workdir):
+    """Copies the selected transcripts to a private input folder, keeping their subfolders."""
+    input_dir = os.path.join(workdir, "input")
+    for path in paths:
+        target = os.path.join(input_dir, os.path.relpath(path, source_dir))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(path, target)
+    return input_dir
+
+def prepare_segmented(server, input_dir, workdir, timeout):
+    """One untimed main_interview run (similarity-only, no classification calls) to produce segmented files."""
+    prep_dir = os.path.join(workdir, "prepared")
+    run_case(server, "main_interview", {"CLASSIFICATION_MODE": "similarity_only", "MAX_IN_FLIGHT": 16},
+             input_dir, prep_dir, timeout)
+    return prep_dir
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline throughput against the fake OpenAI server.")
+    parser.add_argument("--worker", choices=TARGETS, help=argparse.SUPPRESS)
+    parser.add_argument("--target", choices=TARGETS, default="main_interview")
+    parser.add_argument("--input", default=TRANSCRIPTS_DIR, help="Transcript folder")
+    parser.add_argument("--files", type=int, default=0, help="Use only the first N transcripts (0 = all)")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=["two_stage"])
+    parser.add_argument("--in-flight", nargs="+", type=int, default=[8], help="MAX_IN_FLIGHT values")
+    parser.add_argument("--batch-size", nargs="+", type=int, default=[8], help="CLASSIFICATION_BATCH_SIZE values")
+    parser.add_argument("--embedding-provider", default="openai", help="EMBEDDING_PROVIDER for the runs")
+    parser.add_argument("--structured", action="store_true", help="Run with STRUCTURED_OUTPUT=true")
+    parser.add_argument("--client-rpm", type=float, help="OPENAI_RPM for the runs (default: as configured)")
+    parser.add_argument("--client-tpm", type=float, help="OPENAI_TPM for the runs (default: as configured)")
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Fake server base latency")
+    parser.add_argument("--latency-dist", default="lognormal", choices=["fixed", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--ms-per-token", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-500", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=0, help="Fake server port (0 = any free port)")
+    parser.add_argument("--timeout", type=float, default=3600, help="Seconds allowed per configuration")
+    parser.add_argument("--workdir", help="Keep run folders here instead of a temporary directory")
+    parser.add_argument("--output", help="Result file (default benchmarks/results/pipeline-<revision>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare wall times against")
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker)
+        return
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s", force=True)
+    paths = [p for p in transcript_paths(args.input)
+             if os.path.relpath(p, args.input).split(os.sep)[0] in INPUT_SUBDIRS]
+    if args.files:
+        paths = paths[:args.files]
+    if not paths:
+        raise SystemExit(f"No transcripts found under {args.input}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pipeline-bench-")
+    server = FakeServer(args)
+    results = {}
+    try:
+        input_dir = prepare_input(paths, args.input, workdir)
+        prepared = None
+        if args.target == "classify_files":
+            logger.info("Preparing segmented files for %d transcripts", len(paths))
+            prepared = prepare_segmented(server, input_dir, workdir, args.timeout)
+
+        for mode, in_flight, batch_size in itertools.product(args.modes, args.in_flight, args.batch_size):
+            name = f"{args.target}/{mode}/in_flight={in_flight}/batch={batch_size}"
+            output_dir = os.path.join(workdir, name.replace("/", "_").replace("=", ""))
+            shutil.rmtree(output_dir, ignore_errors=True)
+            if prepared is not None:
+                shutil.copytree(os.path.join(prepared, "segmented"), os.path.join(output_dir, "segmented"))
+            settings = {
+                "CLASSIFICATION_MODE": mode,
+                "MAX_IN_FLIGHT": in_flight,
+                "CLASSIFICATION_BATCH_SIZE": batch_size,
+                "EMBEDDING_PROVIDER": args.embedding_provider,
+                "STRUCTURED_OUTPUT": str(args.structured).lower(),
+            }
+            if args.client_rpm:
+                settings["OPENAI_RPM"] = args.client_rpm
+            if args.client_tpm:
+                settings["OPENAI_TPM"] = args.client_tpm
+            logger.info("Running %s", name)
+            results[name] = summarize_case(run_case(server, args.target, settings, input_dir, output_dir,
+                                                    args.timeout))
+            logger.info("  %.1fs, %.2f fragments/s", results[name]["wall_s"], results[name]["fragments_per_s"])
+    finally:
+        server.close()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    path = write_results("pipeline", results, args.output, settings={
+        "target": args.target, "transcripts": [os.path.basename(p) for p in paths],
+        "embedding_provider": args.embedding_provider, "structured_output": args.structured,
+        "client_rpm": args.client_rpm, "client_tpm": args.client_tpm,
+        "latency_ms": args.latency_ms, "latency_dist": args.latency_dist, "ms_per_token": args.ms_per_token,
+        "rate_429": args.rate_429, "rate_500": args.rate_500, "seed": args.seed,
+    })
+    print()
+    print_summary(results)
+    print(f"\nResults written to {path}")
+    if args.compare:
+        print_comparison(compare(args.compare, results, key="wall_s"), unit="s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# benchmarks/scaling.py
+
+"""
+How the CPU-side stages behave as the corpus grows, on synthetic transcripts
+(see benchmarks/synthetic_corpus.py) at several multiples of the real corpus size.
+
+For each scale:
+    loader      : load_fragments_with_question over every transcript
+    questions   : fragment -> question mapping (normalize + FragmentQuestionIndex build),
+                  then a fixed number of legacy lookups (exact / near-duplicate / contained / unknown)
+    similarity  : classify_by_similarity_batch of every fragment against the codebook index,
+                  with fixed-seed synthetic embeddings generated block by block
+    output      : segmented/<document>_segmented.json per transcript plus one
+                  all_interviews.json with an {"id", "codigos"} entry per fragment
+
+Times are reported per stage and per item, with the growth exponent between consecutive
+scales (1.0 = linear; clearly above 1 means the stage will not keep up with bigger rounds).
+
+    python -m benchmarks.scaling --scales 1x 10x
+    python -m benchmarks.scaling --scales 1x 10x 100x --workers 8 --stages loader similarity output
+"""
+
+import os
+import math
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+
+from benchmarks.common import (TRANSCRIPTS_DIR, SEED, transcript_paths, synthetic_embeddings, synthetic_codebook_index,
+                               write_results, compare, print_comparison)
+from benchmarks.synthetic_corpus import generate_corpus, parse_scale, PRESETS
+from utils.utils import normalize_text
+from Scripts.loader import load_fragments_with_question
+from Scripts.classification import classify_by_similarity_batch
+from Scripts.records import FragmentRecord, write_segmented
+from classify_from_files import FragmentQuestionIndex, find_question_for_fragment
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("loader", "questions", "similarity", "output")
+SIMILARITY_BLOCK = 4096         # fragmentos por bloque de embeddings sintéticos
+LOOKUP_QUERIES = 400
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)   # ru_maxrss is in KiB on Linux
+
+def _timed(fn):
+    start = time.perf_counter()
+    value = fn()
+    return value, time.perf_counter() - start
+
+def _row(seconds, items, **extra):
+    return {"seconds": round(seconds, 4), "items": items,
+            "us_per_item": round(seconds * 1e6 / items, 2) if items else 0.0, **extra}
+
+def load_corpus(corpus_dir):
+    """{document: [pair, ...]} for every transcript of the corpus."""
+    pairs = {}
+    for path in transcript_paths(corpus_dir):
+        pairs[os.path.splitext(os.path.basename(path))[0]] = load_fragments_with_question(path)
+    return pairs
+
+def lookup_queries(mapping, rng):
+    """Legacy lookup mix: exact, one-character edits, contained slices and unknown texts."""
+    stored = list(mapping)
+    sample = rng.sample(stored, min(LOOKUP_QUERIES // 4, len(stored)))
+    queries = list(sample)
+    for text in sample:
+        i = rng.randrange(len(text))
+        queries.append(text[:i] + text[i + 1:])
+    for text in sample:
+        if len(text) > 200:
+            start = rng.randrange(len(text) - 120)
+            queries.append(text[start:start + 120])
+    queries += [f"texto que no aparece en ninguna entrevista número {n} " * 3 for n in range(LOOKUP_QUERIES // 4)]
+    return queries
+
+def bench_questions(pairs, rng):
+    def build():
+        mapping = {}
+        for document_pairs in pairs.values():
+            for pair in document_pairs:
+                mapping.setdefault(normalize_text(pair["response"]), pair["question"])
+        return mapping, FragmentQuestionIndex(mapping)
+
+    (mapping, index), build_s = _timed(build)
+    queries = lookup_queries(mapping, rng)
+    _, lookup_s = _timed(lambda: [find_question_for_fragment(q, index) for q in queries])
+    return {
+        "questions_build": _row(build_s, len(mapping)),
+        "questions_lookup": _row(lookup_s, len(queries), found=len(queries) - index.stats["not_found"]),
+    }
+
+def bench_similarity(n_fragments, codebook, centers):
+    elapsed, matched = 0.0, 0
+    for block, start in enumerate(range(0, n_fragments, SIMILARITY_BLOCK)):
+        n = min(SIMILARITY_BLOCK, n_fragments - start)
+        embeddings = synthetic_embeddings(n, seed=SEED + 7 + block, centers=centers, noise=0.6)
+        results, seconds = _timed(lambda: classify_by_similarity_batch(embeddings, codebook))
+        elapsed += seconds
+        matched += sum(1 for r in results if r)
+    return {"similarity": _row(elapsed, n_fragments, with_matches=matched)}
+
+def bench_output(pairs, output_dir, rng, categories):
+    segmented_dir = os.path.join(output_dir, "segmented")
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(segmented_dir)
+
+    def write():
+        entries = []
+        for document, document_pairs in pairs.items():
+            records = [FragmentRecord.create(document, qa, 1, pair["response"], question=pair["question"],
+                                             source=document + ".txt", cleaned=pair["response"])
+                       for qa, pair in enumerate(document_pairs, 1)]
+            write_segmented(os.path.join(segmented_dir, f"{document}_segmented.json"), document, records,
+                            source=document + ".txt")
+            entries.extend({"id": r.id, "codigos": rng.sample(categories, rng.randint(0, 2))} for r in records)
+        path = os.path.join(output_dir, "all_interviews.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=2, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        return len(entries)
+
+    n, seconds = _timed(write)
+    size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(output_dir) for f in files)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    return {"output": _row(seconds, n, mb_written=round(size / 1e6, 1))}
+
+def run_scale(scale, args, codebook, centers, categories):
+    label = f"{scale:g}x"
+    corpus_dir = os.path.join(args.workdir, f"corpus-{label}-seed{args.seed}")
+    manifest = generate_corpus(corpus_dir, scale=scale, seed=args.seed, source_dir=args.source, workers=args.workers)
+    rng = random.Random(args.seed)
+    results = {}
+
+    pairs, seconds = _timed(lambda: load_corpus(corpus_dir))
+    n_fragments = sum(len(p) for p in pairs.values())
+    if "loader" in args.stages:
+        results["loader"] = _row(seconds, manifest["files"], fragments=n_fragments,
+                                 mb_read=round(manifest["bytes"] / 1e6, 1))
+    if "questions" in args.stages:
+        results.update(bench_questions(pairs, rng))
+    if "similarity" in args.stages:
+        results.update(bench_similarity(n_fragments, codebook, centers))
+    if "output" in args.stages:
+        results.update(bench_output(pairs, os.path.join(args.workdir, f"output-{label}"), rng, categories))
+    for row in results.values():
+        row["peak_rss_mb"] = peak_rss_mb()
+    logger.info("%s: %d transcripts, %d fragments", label, manifest["files"], n_fragments)
+    return label, {"files": manifest["files"], "fragments": n_fragments}, results
+
+def growth(results, corpora):
+    """
+    Exponent of stage time vs corpus size (fragments) between consecutive scales.
+    ~1 for stages that touch every fragment once; ~0 for the fixed number of lookups.
+    """
+    rows = []
+    for (a, corpus_a), (b, corpus_b) in zip(corpora, corpora[1:]):
+        if corpus_b["fragments"] <= corpus_a["fragments"]:
+            continue
+        size = math.log(corpus_b["fragments"] / corpus_a["fragments"])
+        for stage in results[b]:
+            before, after = results[a].get(stage), results[b][stage]
+            if before and before["seconds"] > 0 and after["seconds"] > 0:
+                rows.append((stage, a, b, round(math.log(after["seconds"] / before["seconds"]) / size, 2)))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling of loader, question mapping, similarity and output writing.")
+    parser.add_argument("--scales", nargs="+", default=["1x", "10x"],
+                        help=f"Corpus sizes relative to the real one ({', '.join(PRESETS)} or any Nx)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--source", default=TRANSCRIPTS_DIR, help="Real transcripts the generator learns from")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Generator processes")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "jer-scaling"),
+                        help="Synthetic corpora are generated (and reused) here")
+    parser.add_argument("--output", help="Result file (default benchmarks/results/scaling-<revision>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare stage times against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s", force=True)
+    logging.getLogger("Scripts").setLevel(logging.WARNING)
+    os.makedirs(args.workdir, exist_ok=True)
+
+    from config.codebook_def_def import FINAL_CODEBOOK_JER
+
+    codebook, centers = synthetic_codebook_index(args.seed)
+    categories = list(FINAL_CODEBOOK_JER)
+    scales = sorted(parse_scale(s) for s in args.scales)
+
+    corpora, by_scale, flat = [], {}, {}
+    for scale in scales:
+        label, corpus, results = run_scale(scale, args, codebook, centers, categories)
+        corpora.append((label, corpus))
+        by_scale[label] = results
+        flat.update({f"{stage}@{label}": row for stage, row in results.items()})
+
+    path = write_results("scaling", flat, args.output, corpora=dict(corpora), seed=args.seed)
+
+    stages = list(next(iter(by_scale.values())))
+    print(f"\n{'stage':<18}" + "".join(f"{label + ' s':>14}{'µs/item':>12}" for label, _ in corpora))
+    for stage in stages:
+        cells = "".join(f"{by_scale[label][stage]['seconds']:>14.3f}{by_scale[label][stage]['us_per_item']:>12.1f}"
+                        for label, _ in corpora)
+        print(f"{stage:<18}{cells}")
+    for stage, a, b, exponent in growth(by_scale, corpora):
+        flag = "  <-- superlinear" if exponent > 1.2 else ""
+        print(f"{stage:<18} {a} -> {b}: time ~ fragments^{exponent}{flag}")
+    print(f"\nResults written to {path}")
+    if args.compare:
+        print_comparison(compare(args.compare, flat, key="seconds"), unit="s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# benchmarks/synthetic_corpus.py
+
+"""
+Synthetic interview transcripts for scale testing, in the same "E:" / "P:" format as
+assets/input/interviews/txt.
+
+Each synthetic transcript copies the turn structure of a real transcript from the same
+folder (number of questions, lines per answer and the length of every line, with ±20%
+jitter), and fills every line with new text from order-2 word Markov chains trained on the
+corpus: one on interviewer lines, one on participant lines plus the codebook `examples`.
+So answer lengths, the Q–A layout and the vocabulary follow the real corpus, while the text
+itself is new (no two synthetic answers are copies of each other or of a real one).
+
+Generation is deterministic: transcript n depends only on (seed, n), so a corpus can be
+grown or regenerated in parallel and still come out identical.
+
+    python -m benchmarks.synthetic_corpus --preset 10x --output /tmp/corpus-10x
+    python -m benchmarks.synthetic_corpus --files 500 --output /tmp/corpus-500 --workers 4
+"""
+
+import os
+import re
+import json
+import time
+import random
+import logging
+import argparse
+from collections import defaultdict
+from multiprocessing import Pool
+
+from benchmarks.common import TRANSCRIPTS_DIR, SEED, transcript_paths
+from Scripts.loader import SPEAKER_PAT
+
+logger = logging.getLogger(__name__)
+
+PRESETS = {"1x": 1, "10x": 10, "100x": 100, "1000x": 1000}
+MANIFEST_NAME = "synthetic_corpus.json"
+GENERATOR_VERSION = "1"
+LENGTH_JITTER = 0.2
+_SENTENCE_END_RE = re.compile(r'[.!?…]["”»)]*$')
+
+class MarkovText:
+    """Order-2 word chain; sentences start from the states seen at the start of a sentence."""
+
+    def __init__(self, texts):
+        self.transitions = defaultdict(list)
+        self.starts = []
+        for text in texts:
+            words = text.split()
+            if len(words) < 3:
+                continue
+            state = (None, None)
+            for word in words:
+                if state == (None, None) or (state[1] is not None and _SENTENCE_END_RE.search(state[1])):
+                    self.starts.append(word)
+                    state = (None, word)
+                    continue
+                self.transitions[state].append(word)
+                state = (state[1], word)
+        for word in self.starts:
+            self.transitions.setdefault((None, word), [])
+
+    def generate(self, rng: random.Random, target_chars: int) -> str:
+        """About target_chars of text, stopping at the first sentence end past the target."""
+        words, length = [], 0
+        state = None
+        while length < target_chars or (words and not _SENTENCE_END_RE.search(words[-1]) and length < 2 * target_chars):
+            options = self.transitions.get(state) if state else None
+            if not options:
+                word = rng.choice(self.starts)
+                state = (None, word)
+            else:
+                word = rng.choice(options)
+                state = (state[1], word)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)
+
+def read_turns(path):
+    """[(speaker, text)] of the tagged lines of a transcript, as the loader sees them."""
+    turns = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            m = SPEAKER_PAT.match(line.strip())
+            if m:
+                turns.append(m.groups())
+    return turns
+
+class CorpusModel:
+    """Per-folder transcript templates plus the two text models."""
+
+    def __init__(self, source_dir: str = TRANSCRIPTS_DIR):
+        from config.codebook_def_def import FINAL_CODEBOOK_JER
+
+        self.source_dir = source_dir
+        self.templates = defaultdict(list)      # carpeta -> [[(speaker, length), ...], ...]
+        questions, answers = [], []
+        for path in transcript_paths(source_dir):
+            folder = os.path.dirname(os.path.relpath(path, source_dir))
+            turns = read_turns(path)
+            if not turns:
+                continue
+            self.templates[folder].append([(speaker, len(text)) for speaker, text in turns])
+            for speaker, text in turns:
+                (questions if speaker == "E" else answers).append(text)
+        if not self.templates:
+            raise ValueError(f"No transcripts with E:/P: lines under {source_dir}")
+        examples = [ex for details in FINAL_CODEBOOK_JER.values() for ex in details.get("examples", [])]
+        self.questions = MarkovText(questions)
+        self.answers = MarkovText(answers + examples)
+        self.folders = sorted(self.templates)
+
+    @property
+    def source_files(self) -> int:
+        return sum(len(t) for t in self.templates.values())
+
+    def layout(self, n_files: int):
+        """(folder, template index) for synthetic transcript n, keeping the folder proportions of the corpus."""
+        slots = [(folder, i) for folder in self.folders for i in range(len(self.templates[folder]))]
+        return [slots[n % len(slots)] for n in range(n_files)]
+
+    def transcript(self, seed: int, n: int, folder: str, template: int) -> str:
+        rng = random.Random(f"{seed}:{n}")
+        lines = ["Inicio de la transcripción:", ""]
+        for speaker, length in self.templates[folder][template]:
+            target = max(8, int(length * rng.uniform(1 - LENGTH_JITTER, 1 + LENGTH_JITTER)))
+            model = self.questions if speaker == "E" else self.answers
+            lines.append(f"{speaker}: {model.generate(rng, target)}")
+            lines.append("")
+        return "\n".join(lines)
+
+_model = None
+
+def _init_worker(source_dir):
+    global _model
+    _model = CorpusModel(source_dir)
+
+def _write_one(job):
+    output_dir, seed, n, folder, template = job
+    name = f"SYN_{(folder or 'root').replace(os.sep, '_')}_{n:06d}.txt"
+    path = os.path.join(output_dir, folder, name)
+    text = _model.transcript(seed, n, folder, template)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return len(text.encode("utf-8"))
+
+def read_manifest(output_dir: str):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def generate_corpus(output_dir: str, n_files: int = 0, scale: float = 0, seed: int = SEED,
+                    source_dir: str = TRANSCRIPTS_DIR, workers: int = 1) -> dict:
+    """
+    Writes n_files transcripts (or scale x the number of real ones) under output_dir, in the
+    source folder layout, and returns the manifest. An existing corpus with the same
+    parameters is reused.
+    """
+    model = CorpusModel(source_dir)
+    if not n_files:
+        n_files = max(1, int(round(model.source_files * (scale or 1))))
+    wanted = {"version": GENERATOR_VERSION, "seed": seed, "files": n_files,
+              "source_files": model.source_files}
+    existing = read_manifest(output_dir)
+    if existing and all(existing.get(k) == v for k, v in wanted.items()):
+        logger.info("Reusing synthetic corpus in %s (%d files)", output_dir, n_files)
+        return existing
+
+    layout = model.layout(n_files)
+    for folder in model.folders:
+        os.makedirs(os.path.join(output_dir, folder), exist_ok=True)
+        # Transcripts of an earlier, different corpus in the same folder would be mixed in
+        for name in os.listdir(os.path.join(output_dir, folder)):
+            if name.startswith("SYN_") and name.endswith(".txt"):
+                os.remove(os.path.join(output_dir, folder, name))
+    jobs = [(output_dir, seed, n, folder, template) for n, (folder, template) in enumerate(layout)]
+    start = time.perf_counter()
+    if workers > 1:
+        with Pool(workers, initializer=_init_worker, initargs=(source_dir,)) as pool:
+            sizes = pool.map(_write_one, jobs, chunksize=max(1, len(jobs) // (workers * 8)))
+    else:
+        global _model
+        _model = model
+        sizes = [_write_one(job) for job in jobs]
+    manifest = dict(wanted, bytes=sum(sizes), seconds=round(time.perf_counter() - start, 2),
+                    folders={folder: sum(1 for f, _ in layout if f == folder) for folder in model.folders})
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    logger.info("Wrote %d synthetic transcripts (%.1f MB) to %s in %.1fs",
+                n_files, manifest["bytes"] / 1e6, output_dir, manifest["seconds"])
+    return manifest
+
+def parse_scale(value: str) -> float:
+    """'10x' / '10' -> 10.0"""
+    value = value.strip().lower()
+    return float(PRESETS.get(value, value.rstrip("x")))
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic interview transcripts for scale tests.")
+    parser.add_argument("--output", required=True, help="Folder to write the corpus to")
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--preset", help="Corpus size relative to the real one: 1x, 10x, 100x, 1000x (or any N/Nx)")
+    size.add_argument("--files", type=int, help="Exact number of transcripts")
+    parser.add_argument("--source", default=TRANSCRIPTS_DIR, help="Real transcripts to learn from")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    manifest = generate_corpus(args.output, n_files=args.files or 0,
+                               scale=parse_scale(args.preset) if args.preset else 1,
+                               seed=args.seed, source_dir=args.source, workers=args.workers)
+    print(json.dumps(manifest, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Accuracy report for the reduced-precision codebook scan (CodebookIndex with
+EMBEDDING_QUANTIZATION / EMBEDDING_PCA_DIM / QUANTIZED_RESCORE_K, see Scripts/quantization.py).
+
+Builds the same labeled codebook examples twice: once as CodebookIndex(quantization="none"),
+the float32 index the pipeline uses by default, and once per quantized configuration. Every
+query fragment is scored by both and the quantized results are compared with the exact ones:
+
+    recall_at_k          share of the exact top-k examples (combined score) still in the top-k
+    top1_agreement       fragments whose best example is unchanged
+    matches_agreement    fragments with the same classify_by_similarity matches (matches_from_scores)
+    prefilter_agreement  fragments with the same Stage-1 prefilter categories (top_categories)
+    max_abs_error        largest combined-score error, over all examples and over the exact top-k
+    bytes_per_vector     memory of the scanned form (float32: 4 bytes per dimension)
+
+    python check_quantization.py                     # codebook examples + fragments of the configured store
+    python check_quantization.py --synthetic 2000 --output quantization_report.json
+"""
+
+import json
+import time
+import logging
+import argparse
+
+import numpy as np
+
+from config.config import QUANTIZED_RESCORE_K
+from Scripts.quantization import top_k
+
+logger = logging.getLogger(__name__)
+
+CONFIGS = [
+    ("float16", 0),
+    ("int8", 0),
+    ("int8", 256),
+    ("int8", 128),
+    ("int8", 32),
+]
+
+def synthetic_data(n_queries):
+    """Codebook examples with synthetic embeddings and fragments scattered around their centers."""
+    from benchmarks.common import synthetic_codebook_index, synthetic_embeddings
+
+    index, centers = synthetic_codebook_index()
+    queries = synthetic_embeddings(n_queries, seed=1, centers=centers, noise=0.5)
+    return list(index), queries, f"synthetic ({n_queries})"
+
+def store_data(n_queries):
+    """Codebook examples (embedded through the cache) and a sample of the stored vectors as fragments."""
+    from Scripts.classification import build_labeled_examples_from_codebook
+    from Scripts.vectorize import embedding_cache, STORE_DIR
+
+    examples = list(build_labeled_examples_from_codebook())
+    vectors = np.array(embedding_cache.matrix())
+    if not len(vectors):
+        raise SystemExit(f"No vectors found in {STORE_DIR}")
+    rows = np.random.default_rng(0).permutation(len(vectors))[:n_queries]
+    return examples, vectors[rows], STORE_DIR
+
+def evaluate(examples, queries, exact_index, exact_scores, mode, pca_dim, k, rescore_k):
+    """One row of the report for a given configuration."""
+    from Scripts.classification import CodebookIndex
+
+    start = time.perf_counter()
+    index = CodebookIndex(examples, quantization=mode, pca_dim=pca_dim, rescore_k=rescore_k)
+    build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scores = index.scores(queries)
+    scan_s = time.perf_counter() - start
+
+    exact_top, found_top = top_k(exact_scores, k), top_k(scores, k)
+    recall = np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(found_top, exact_top)])
+    top_error = np.abs(np.take_along_axis(scores, exact_top, axis=1) - np.take_along_axis(exact_scores, exact_top, axis=1))
+
+    def agreement(fn):
+        return float(np.mean([fn(exact_index, e) == fn(index, s) for e, s in zip(exact_scores, scores)]))
+
+    return {
+        "mode": mode,
+        "pca_dim": index.quantized.pca.dim if index.quantized.pca is not None else 0,
+        "recall_at_k": round(float(recall), 4),
+        "top1_agreement": round(float(np.mean(found_top[:, 0] == exact_top[:, 0])), 4),
+        "matches_agreement": round(agreement(lambda idx, row: [c for c, _, _ in idx.matches_from_scores(row)]), 4),
+        "prefilter_agreement": round(agreement(lambda idx, row: idx.top_categories(row)), 4),
+        "max_abs_error": round(float(np.abs(scores - exact_scores).max()), 5),
+        "max_abs_error_top_k": round(float(top_error.max()), 5),
+        "bytes_per_vector": round(index.quantized.nbytes / len(index), 1),
+        "build_s": round(build_s, 3),
+        "scan_ms_per_query": round(scan_s * 1000 / len(queries), 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare quantized CodebookIndex scores with the float32 index.")
+    parser.add_argument("--synthetic", type=int, default=0, help="Use N synthetic fragments instead of the store")
+    parser.add_argument("--queries", type=int, default=500, help="Stored vectors used as fragments")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore-k", type=int, default=QUANTIZED_RESCORE_K, help="Examples re-scored in float32")
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from Scripts.classification import CodebookIndex
+
+    examples, queries, source = synthetic_data(args.synthetic) if args.synthetic else store_data(args.queries)
+    exact_index = CodebookIndex(examples, quantization="none")
+    exact_scores = exact_index.scores(queries)
+    logger.info("Scoring %d fragments against %d codebook examples from %s", len(queries), len(exact_index), source)
+
+    report = {
+        "source": source,
+        "examples": len(exact_index),
+        "queries": len(queries),
+        "dim": exact_index.dim,
+        "k": args.k,
+        "rescore_k": args.rescore_k,
+        "float32_bytes_per_vector": exact_index.dim * 4,
+        "results": [evaluate(examples, queries, exact_index, exact_scores, mode, pca_dim, args.k, args.rescore_k)
+                    for mode, pca_dim in CONFIGS if pca_dim < min(exact_index.dim, len(exact_index))],
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
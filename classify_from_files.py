@@ -4,14 +4,22 @@ import os
 import json
 import logging
 import time
+import zlib
 from pathlib import Path
 import pandas as pd
 from datetime import datetime
 import numpy as np
+from difflib import SequenceMatcher
 from typing import Dict, List, Optional, Tuple
 
-from Scripts.classification import build_labeled_examples_from_codebook, classify_fragment_cosine, normalize_text
-from Scripts.vectorize import load_cache, get_embedding, save_cache
+from Scripts.classification import (build_labeled_examples_from_codebook, classify_fragments_batch, normalize_text,
+                                    classification_fingerprint)
+from Scripts.vectorize import load_cache, get_embeddings, save_cache
+from Scripts.api_client import log_metrics, failed_requests
+from Scripts.manifest import RunManifest, file_hash, fingerprint
+from Scripts.records import load_segmented, load_records, expand_results, is_legacy_segmented
+from Scripts.result_log import LOG_PATH as CLASSIFICATION_LOG
+from Scripts.tracing import trace_context
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,9 +30,7 @@ SEGMENTED_DIR = BASE_DIR / "assets/output/interviews/coding/segmented"
 OUTPUT_DIR = BASE_DIR / "assets/output/interviews/coding/classified"
 ANALYSIS_DIR = BASE_DIR / "assets/output/interviews/coding/analysis"
 ALL_INTERVIEWS_PATH = BASE_DIR / "assets/output/interviews/coding/all_interviews.json"
-
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-os.makedirs(ANALYSIS_DIR, exist_ok=True)
+MANIFEST_PATH = OUTPUT_DIR / "classification_manifest.json"
 
 # Critical parameters for perfect classification
 MAX_RETRIES = 5  # Increased for robustness
@@ -40,65 +46,182 @@ SEMANTIC_COHERENCE_THRESHOLD = 0.65
 
 def load_fragment_questions_mapping() -> Dict[str, str]:
     """
-    Load the mapping of fragments to questions from all_interviews.json.
-    Returns a dictionary with fragment text as key and question as value.
+    Load the mapping of fragments to questions used for legacy segmented files (no provenance).
+    Questions come from the fragment records of the segmented files written by main_interview
+    and, for outputs of older runs, from the "fragment"/"question" entries of all_interviews.json.
+    Returns a dictionary with normalized fragment text as key and question as value.
     """
     logger.info("Loading fragment-to-question mapping...")
     fragment_to_question = {}
     
+    try:
+        records = load_records(SEGMENTED_DIR)
+        for record in records.values():
+            if record.question:
+                fragment_to_question[record.normalized] = record.question.strip()
+    except Exception as e:
+        logger.error(f"Error loading fragment records from {SEGMENTED_DIR}: {e}")
+        records = {}
+    
     try:
         with open(ALL_INTERVIEWS_PATH, 'r', encoding='utf-8') as f:
             all_interviews = json.load(f)
         
-        for entry in all_interviews:
-            fragment = entry.get("fragment", "").strip()
-            question = entry.get("question", "").strip()
+        # Id-only entries ({"id", "codigos"}) resolve through the records; legacy ones carry their text
+        unresolved = 0
+        for entry in expand_results(all_interviews, records):
+            fragment = (entry.get("fragment") or "").strip()
+            question = (entry.get("question") or "").strip()
             
             if fragment and question:
                 # Normalize fragment text for matching
                 normalized_fragment = normalize_text(fragment)
                 fragment_to_question[normalized_fragment] = question
+            elif "fragment" not in entry:
+                unresolved += 1
         
-        logger.info(f"Loaded {len(fragment_to_question)} fragment-question mappings")
-        return fragment_to_question
-        
+        if unresolved:
+            logger.warning(f"{unresolved} id-only entries in {ALL_INTERVIEWS_PATH.name} have no fragment record in "
+                           f"{SEGMENTED_DIR}; their questions cannot be used for legacy lookups")
     except FileNotFoundError:
-        logger.warning(f"Could not find {ALL_INTERVIEWS_PATH}, continuing without question mapping")
-        return {}
+        logger.warning(f"Could not find {ALL_INTERVIEWS_PATH}, using the segmented records only")
     except Exception as e:
         logger.error(f"Error loading fragment-question mapping: {e}")
-        return {}
+    
+    if not fragment_to_question:
+        logger.warning("No fragment-question mappings found: every fragment of a legacy segmented file "
+                       "will be reported as 'Question not found'")
+    logger.info(f"Loaded {len(fragment_to_question)} fragment-question mappings")
+    return fragment_to_question
 
-def find_question_for_fragment(fragment: str, fragment_to_question: Dict[str, str]) -> str:
+class FragmentQuestionIndex:
+    """
+    Prebuilt fragment -> question lookup answering the same three queries as the original
+    linear find_question_for_fragment, in the same priority order:
+
+    1. exact: dict hit on the normalized fragment;
+    2. near-duplicate (difflib ratio >= 0.95): MinHash-LSH over character shingles proposes
+       candidates, which are length-pruned and verified with SequenceMatcher (shingles are
+       hashed with crc32, not the per-process salted hash(), so candidates are the same on every run);
+    3. containment (either text inside the other, > 50 chars): an inverted index of word
+       trigrams proposes candidates, verified with `in`; ties resolve to the earliest stored
+       fragment, as in the original scan.
+    """
+
+    SHINGLE = 5
+    BANDS = 20
+    ROWS = 3
+    PRIME = (1 << 31) - 1
+    NEAR_CUTOFF = 0.95
+    MIN_CONTAINMENT = 50
+
+    def __init__(self, fragment_to_question: Dict[str, str]):
+        self.questions = list(fragment_to_question.values())
+        self.fragments = list(fragment_to_question.keys())
+        self.position = {fragment: i for i, fragment in enumerate(self.fragments)}
+        self.stats = {"exact": 0, "near": 0, "contained": 0, "not_found": 0}
+
+        rng = np.random.default_rng(1234)
+        n_hashes = self.BANDS * self.ROWS
+        self._a = rng.integers(1, self.PRIME, size=n_hashes, dtype=np.uint64)
+        self._b = rng.integers(0, self.PRIME, size=n_hashes, dtype=np.uint64)
+
+        self.lsh = [dict() for _ in range(self.BANDS)]
+        self.trigram_postings = {}      # trigram -> ids whose text contains it (query inside stored)
+        self.anchor_index = {}          # first interior trigram -> ids (stored inside query)
+        self.short = []                 # stored fragments too short to index by trigrams
+        for i, fragment in enumerate(self.fragments):
+            for band, key in enumerate(self._band_keys(fragment)):
+                self.lsh[band].setdefault(key, []).append(i)
+            words = fragment.split()
+            for gram in set(zip(words, words[1:], words[2:])):
+                self.trigram_postings.setdefault(gram, []).append(i)
+            if len(fragment) > self.MIN_CONTAINMENT:
+                if len(words) >= 5:
+                    self.anchor_index.setdefault(tuple(words[1:4]), []).append(i)
+                else:
+                    self.short.append(i)
+
+    def __len__(self):
+        return len(self.fragments)
+
+    def _band_keys(self, text: str):
+        k = self.SHINGLE
+        shingles = {text[i:i + k] for i in range(max(1, len(text) - k + 1))}
+        hashes = np.fromiter((zlib.crc32(sh.encode('utf-8')) for sh in shingles), dtype=np.uint64, count=len(shingles))
+        signature = ((self._a[:, None] * hashes[None, :] + self._b[:, None]) % self.PRIME).min(axis=1)
+        rows = signature.reshape(self.BANDS, self.ROWS)
+        return [row.tobytes() for row in rows]
+
+    def _near_duplicate(self, query: str) -> Optional[int]:
+        candidates = set()
+        for band, key in enumerate(self._band_keys(query)):
+            candidates.update(self.lsh[band].get(key, ()))
+        best, best_score = None, 0.0
+        n = len(query)
+        for i in sorted(candidates):
+            stored = self.fragments[i]
+            # ratio() <= 2*min/(a+b): skip candidates whose length alone rules them out
+            if 2.0 * min(n, len(stored)) / (n + len(stored)) < self.NEAR_CUTOFF:
+                continue
+            matcher = SequenceMatcher(None, stored, query)
+            if matcher.real_quick_ratio() < self.NEAR_CUTOFF or matcher.quick_ratio() < self.NEAR_CUTOFF:
+                continue
+            score = matcher.ratio()
+            if score >= self.NEAR_CUTOFF and score > best_score:
+                best, best_score = i, score
+        return best
+
+    def _containing(self, query: str) -> Optional[int]:
+        words = query.split()
+        candidates = set()
+        if len(query) > self.MIN_CONTAINMENT:
+            # query inside stored: interior words of the query are whole words of the stored text
+            interior = words[1:-1]
+            if len(interior) >= 3:
+                grams = list(zip(interior, interior[1:], interior[2:]))
+                postings = min((self.trigram_postings.get(g, ()) for g in (grams[0], grams[len(grams) // 2], grams[-1])),
+                               key=len)
+                candidates.update(i for i in postings if query in self.fragments[i])
+            else:
+                candidates.update(i for i, stored in enumerate(self.fragments) if query in stored)
+        # stored inside query: the stored text's first interior trigram occurs in the query
+        for gram in set(zip(words, words[1:], words[2:])):
+            candidates.update(i for i in self.anchor_index.get(gram, ()) if self.fragments[i] in query)
+        candidates.update(i for i in self.short if self.fragments[i] in query)
+        return min(candidates) if candidates else None
+
+    def lookup(self, normalized_fragment: str) -> Optional[str]:
+        """Question for an already normalized fragment, or None."""
+        i = self.position.get(normalized_fragment)
+        if i is not None:
+            self.stats["exact"] += 1
+            return self.questions[i]
+        i = self._near_duplicate(normalized_fragment)
+        if i is not None:
+            self.stats["near"] += 1
+            return self.questions[i]
+        i = self._containing(normalized_fragment)
+        if i is not None:
+            self.stats["contained"] += 1
+            return self.questions[i]
+        self.stats["not_found"] += 1
+        return None
+
+def find_question_for_fragment(fragment: str, fragment_to_question) -> str:
     """
     Find the corresponding question for a given fragment.
     Uses exact matching first, then fuzzy matching if needed.
+    `fragment_to_question` is a FragmentQuestionIndex (build it once per run) or the plain mapping.
     """
     if not fragment_to_question:
         return "Question not available"
     
-    # Normalize the fragment for matching
-    normalized_fragment = normalize_text(fragment)
-    
-    # Try exact match first
-    if normalized_fragment in fragment_to_question:
-        return fragment_to_question[normalized_fragment]
+    if not isinstance(fragment_to_question, FragmentQuestionIndex):
+        fragment_to_question = FragmentQuestionIndex(fragment_to_question)
     
-    # Try fuzzy matching for slight variations
-    from difflib import get_close_matches
-    close_matches = get_close_matches(normalized_fragment, fragment_to_question.keys(), n=1, cutoff=0.95)
-    
-    if close_matches:
-        return fragment_to_question[close_matches[0]]
-    
-    # Try partial matching for truncated fragments
-    for stored_fragment, question in fragment_to_question.items():
-        if len(normalized_fragment) > 50 and normalized_fragment in stored_fragment:
-            return question
-        elif len(stored_fragment) > 50 and stored_fragment in normalized_fragment:
-            return question
-    
-    return "Question not found"
+    question = fragment_to_question.lookup(normalize_text(fragment))
+    return question if question is not None else "Question not found"
 
 def validate_fragment_quality(fragment: str) -> float:
     """
@@ -153,14 +276,20 @@ def validate_classification_coherence(fragment: str, categories: List[str],
     # Additional semantic validation could be added here
     return True
 
-def classify_files():
+def classify_files(force: bool = False):
     """
     Enhanced classification with interpretation focus, comprehensive logging, and question mapping.
+    Segmented files already classified with the same content and codebook (and, for legacy files
+    without provenance, the same question mapping; see classification_manifest.json) are skipped
+    unless force=True.
     """
     logger.info("Starting enhanced fragment classification with interpretation focus and question mapping...")
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    os.makedirs(ANALYSIS_DIR, exist_ok=True)
     
-    # Load fragment-to-question mapping
-    fragment_to_question = load_fragment_questions_mapping()
+    # Records written by main_interview carry their question; the fragment-to-question index is
+    # only built (once) if a legacy segmented file without provenance shows up
+    fragment_to_question = None
     
     # Load cache and build labeled examples
     cache = load_cache()
@@ -175,14 +304,36 @@ def classify_files():
     # Process all segmented files
     segmented_files = list(SEGMENTED_DIR.glob("*.json"))
     logger.info(f"Found {len(segmented_files)} segmented files to process.")
+
+    manifest = RunManifest(str(MANIFEST_PATH))
+    class_fp = classification_fingerprint()
+    content_hashes = {file_path: file_hash(file_path) for file_path in segmented_files}
+    legacy_files = {file_path for file_path in segmented_files if is_legacy_segmented(file_path)}
+    # Only legacy files depend on the question mapping (the other segmented files and all_interviews.json)
+    mapping_hash = None
+    if legacy_files:
+        mapping_hash = fingerprint(
+            file_hash(ALL_INTERVIEWS_PATH) if ALL_INTERVIEWS_PATH.exists() else None,
+            sorted((p.name, h) for p, h in content_hashes.items() if p not in legacy_files),
+        )
+    skipped = 0
     
     for file_path in segmented_files:
+        content_hash = content_hashes[file_path]
+        run_fingerprint = fingerprint(class_fp, mapping_hash if file_path in legacy_files else None)
+        output_file = OUTPUT_DIR / f"{file_path.stem}.json"
+        if (not force and output_file.exists()
+                and manifest.is_complete(file_path.name, content_hash, "classify", run_fingerprint)):
+            logger.info(f"Skipping unchanged file: {file_path.name}")
+            skipped += 1
+            continue
+
         logger.info(f"Processing file: {file_path.name}")
         
         try:
-            # Load fragments
-            with open(file_path, 'r', encoding='utf-8') as f:
-                fragments = json.load(f)
+            # Load fragment records
+            records = load_segmented(file_path)
+            fragments = [record.text for record in records]
             
             if not fragments:
                 logger.warning(f"No fragments found in {file_path.name}")
@@ -193,35 +344,47 @@ def classify_files():
             classified_fragments = []
             document_name = file_path.stem  # Extract document name from filename
             
-            for i, fragment_text in enumerate(fragments, 1):
+            # Embed every fragment of the document in a few batched requests
+            with trace_context(document=document_name):
+                fragment_embeddings = get_embeddings(fragments)
+            fragment_ids = [record.id for record in records]
+            
+            missing_embeddings = 0
+            for fragment_id, fragment_embedding in zip(fragment_ids, fragment_embeddings):
+                if fragment_embedding is None:
+                    missing_embeddings += 1
+                    logger.warning(f"Could not get embedding for fragment {fragment_id} in {file_path.name}")
+            
+            # Classify the whole document: one similarity pass and batched Stage-1/Stage-2 prompts
+            # (failed requests fall back to similarity; they are collected so the file is retried)
+            with failed_requests() as failed:
+                results = classify_fragments_batch(
+                    fragments,
+                    fragment_embeddings,
+                    labeled_examples,
+                    document_name=document_name,
+                    fragment_ids=fragment_ids
+                )
+            
+            lookup_time = 0.0
+            for record, result in zip(records, results):
+                fragment_id = record.id
                 try:
-                    # Get embedding
-                    fragment_embedding = cache.get(fragment_text)
-                    if fragment_embedding is None:
-                        fragment_embedding = get_embedding(fragment_text)
-                        if fragment_embedding is not None:
-                            cache[fragment_text] = fragment_embedding
-                    
-                    if fragment_embedding is None:
-                        logger.warning(f"Could not get embedding for fragment {i} in {file_path.name}")
-                        continue
-                    
-                    # Find corresponding question
-                    question = find_question_for_fragment(fragment_text, fragment_to_question)
-                    
-                    # Classify with document tracking and interpretation focus
-                    fragment_id = f"F{i:03d}"
-                    result = classify_fragment_cosine(
-                        fragment_text, 
-                        fragment_embedding, 
-                        labeled_examples,
-                        document_name=document_name,
-                        fragment_id=fragment_id
-                    )
-                    
                     if result["category"]:  # Only keep classified fragments
+                        # Find corresponding question
+                        lookup_start = time.perf_counter()
+                        if record.question is not None:
+                            question = record.question
+                        else:
+                            if fragment_to_question is None:
+                                fragment_to_question = FragmentQuestionIndex(load_fragment_questions_mapping())
+                                logger.info(f"Indexed {len(fragment_to_question)} fragments for legacy question lookup")
+                            question = find_question_for_fragment(record.text, fragment_to_question)
+                        lookup_time += time.perf_counter() - lookup_start
+                        
                         # Enhanced result with question included
                         enhanced_result = {
+                            "id": record.id,
                             "fragment": result["fragment"],
                             "question": question,
                             "category": result["category"], 
@@ -234,15 +397,22 @@ def classify_files():
                         logger.debug(f"Fragment {fragment_id} rejected (no classification)")
                 
                 except Exception as e:
-                    logger.error(f"Error processing fragment {i} in {file_path.name}: {e}")
+                    logger.error(f"Error processing fragment {fragment_id} in {file_path.name}: {e}")
                     continue
 
             # Save results
-            output_file = OUTPUT_DIR / f"{file_path.stem}.json"
             output_file.parent.mkdir(parents=True, exist_ok=True)
             
             with open(output_file, 'w', encoding='utf-8') as f:
                 json.dump(classified_fragments, f, ensure_ascii=False, indent=2)
+            # A file with fragments left unclassified or on a fallback classification is not recorded,
+            # so the next run classifies it again
+            if missing_embeddings or failed:
+                logger.warning(f"{file_path.name} left incomplete: {missing_embeddings} fragments without embedding "
+                               f"and {len(failed)} failed API requests; it will be classified again on the next run")
+            else:
+                manifest.mark_complete(file_path.name, content_hash, "classify", run_fingerprint,
+                                       classified=len(classified_fragments))
             
             logger.info(f"Saved {len(classified_fragments)} classified fragments to {output_file.name}")
             
@@ -267,7 +437,7 @@ def classify_files():
                 === DOCUMENT SUMMARY: {document_name} ===
                 Total fragments processed: {len(fragments)}
                 Total fragments classified: {len(classified_fragments)} ({len(classified_fragments)/len(fragments)*100:.1f}%)
-                Questions successfully mapped: {question_mapped_count}/{len(classified_fragments)} ({question_mapping_rate:.1f}%)
+                Questions successfully mapped: {question_mapped_count}/{len(classified_fragments)} ({question_mapping_rate:.1f}%) in {lookup_time * 1000:.1f} ms
                 Average confidence: {avg_confidence:.3f}
                 Average categories per fragment: {avg_categories_per_fragment:.1f}
                 Most frequent categories:
@@ -281,11 +451,22 @@ def classify_files():
             logger.error(f"Error processing file {file_path.name}: {e}")
             continue
     
+    if skipped:
+        logger.info(f"Skipped {skipped} unchanged files (use --force to reclassify them)")
+    if fragment_to_question is not None:
+        logger.info(f"Legacy question lookups by strategy: {fragment_to_question.stats}")
+    
     # Save updated cache
     save_cache(cache)
+    log_metrics()
     logger.info("Enhanced classification with interpretation focus and question mapping completed!")
-    logger.info("Check 'classification_results.log' for detailed fragment-by-fragment logging.")
-    logger.info("Final results now include: fragment, question, category, and confidence.")
+    logger.info(f"Check '{CLASSIFICATION_LOG}' for the fragment-by-fragment JSONL log.")
+    logger.info("Final results now include: id, fragment, question, category, and confidence.")
 
 if __name__ == "__main__":
-    classify_files()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Classify every segmented interview file.")
+    parser.add_argument("--force", action="store_true", help="Reclassify every file, ignoring the manifest")
+    args = parser.parse_args()
+    classify_files(force=args.force)
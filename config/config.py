@@ -9,11 +9,73 @@ env = os.getenv
 
 # OpenAI settings
 OPENAI_API_KEY   = env("OPENAI_API_KEY", "")
+OPENAI_API_BASE  = env("OPENAI_API_BASE", "")      # vacío: API oficial; p.ej. http://127.0.0.1:8765/v1 (fake_openai_server.py)
 GPT_MODEL        = env("GPT_MODEL", "gpt-4.1-nano")   # chat model por defecto
 EMBEDDING_MODEL  = env("EMBEDDING_MODEL", "text-embedding-ada-002")
 MAX_CHUNK_LENGTH = int(env("MAX_CHUNK_LENGTH", "3000"))
-API_DELAY        = float(env("API_DELAY", "1.8"))
-INITIAL_DELAY    = float(env("INITIAL_DELAY", "2"))
+API_DELAY        = float(env("API_DELAY", "1.8"))     # obsoleto: el ritmo lo fija el token bucket de api_client
+INITIAL_DELAY    = float(env("INITIAL_DELAY", "2"))      # base del backoff exponencial
+
+# Rate limiting (shared client layer)
+OPENAI_RPM       = float(env("OPENAI_RPM", "500"))       # requests por minuto
+OPENAI_TPM       = float(env("OPENAI_TPM", "200000"))    # tokens por minuto
+API_MAX_RETRIES  = int(env("API_MAX_RETRIES", "5"))
+API_BACKOFF_CAP  = float(env("API_BACKOFF_CAP", "60"))   # espera máxima entre reintentos (s)
+API_COMPLETION_ESTIMATE = float(env("API_COMPLETION_ESTIMATE", "0.25"))  # fracción de max_tokens reservada en el bucket TPM (luego, la que usa la etapa)
+
+# Grabación/reproducción de requests a la API (Scripts/cassette.py)
+#   off    : sin cassette
+#   record : llama a la API y guarda cada respuesta
+#   replay : solo responde desde el cassette (sin red); un request no grabado falla
+#   auto   : reproduce lo grabado y graba lo que falte
+API_CASSETTE_MODE         = env("API_CASSETTE_MODE", "off").lower()
+API_CASSETTE_PATH         = env("API_CASSETTE_PATH", "")                    # vacío: OUTPUT_DIR/api_cassette.sqlite3
+
+# Embedding provider: openai | hashing (local, sin red) | sentence_transformers (modelo local)
+EMBEDDING_PROVIDER        = env("EMBEDDING_PROVIDER", "openai")
+LOCAL_EMBEDDING_DIM       = int(env("LOCAL_EMBEDDING_DIM", "1024"))         # dimensión del proveedor hashing
+LOCAL_EMBEDDING_MODEL     = env("LOCAL_EMBEDDING_MODEL", "")                # ruta o nombre del modelo sentence-transformers
+
+# Embedding batching
+EMBEDDING_BATCH_SIZE      = int(env("EMBEDDING_BATCH_SIZE", "100"))        # textos por request
+EMBEDDING_BATCH_MAX_CHARS = int(env("EMBEDDING_BATCH_MAX_CHARS", "200000")) # tope de caracteres por request
+
+# Tier opcional de embeddings reducidos para scans de similitud (con re-puntuación exacta)
+EMBEDDING_QUANTIZATION    = env("EMBEDDING_QUANTIZATION", "none")          # none | float16 | int8
+EMBEDDING_PCA_DIM         = int(env("EMBEDDING_PCA_DIM", "0"))             # 0: sin proyección PCA
+QUANTIZED_RESCORE_K       = int(env("QUANTIZED_RESCORE_K", "32"))          # candidatos re-puntuados en float32
+
+# Classification batching
+CLASSIFICATION_BATCH_SIZE = int(env("CLASSIFICATION_BATCH_SIZE", "8"))      # fragmentos por prompt Stage-1/Stage-2
+
+# Classification mode
+#   two_stage       : Stage 1 (filtrado) y Stage 2 (análisis) con la API
+#   local_prefilter : Stage 1 se resuelve localmente con el índice de embeddings del codebook
+#   similarity_only : sin llamadas de clasificación; solo la asignación por similitud
+CLASSIFICATION_MODE       = env("CLASSIFICATION_MODE", "two_stage")
+LOCAL_PREFILTER_K         = int(env("LOCAL_PREFILTER_K", "8"))              # candidatos por fragmento
+LOCAL_PREFILTER_MARGIN    = float(env("LOCAL_PREFILTER_MARGIN", "0.02"))    # empates cerca del k-ésimo también entran
+# Respuestas Stage-1/Stage-2 con JSON schema (ids cortos de código) en lugar de texto libre
+STRUCTURED_OUTPUT         = env("STRUCTURED_OUTPUT", "false").lower() in ("1", "true", "yes")
+STRUCTURED_OUTPUT_RETRIES = int(env("STRUCTURED_OUTPUT_RETRIES", "2"))      # reintentos por fragmento inválido
+
+# Log JSONL de resultados de clasificación (uno por fragmento), con rotación
+CLASSIFICATION_LOG_PATH    = env("CLASSIFICATION_LOG_PATH", "")             # vacío: OUTPUT_DIR/classification_results.jsonl
+CLASSIFICATION_LOG_MAX_MB  = float(env("CLASSIFICATION_LOG_MAX_MB", "20"))  # tamaño antes de rotar
+CLASSIFICATION_LOG_BACKUPS = int(env("CLASSIFICATION_LOG_BACKUPS", "5"))    # archivos rotados que se conservan
+
+# Trazas por llamada a la API (Scripts/tracing.py): etapa, documento, fragmento, tokens, latencia, intentos, cache
+# Desactivadas por defecto; API_TRACE=true las activa (resumen: python -m Scripts.tracing)
+API_TRACE                  = env("API_TRACE", "false").lower() in ("1", "true", "yes")
+API_TRACE_PATH             = env("API_TRACE_PATH", "")                      # vacío: OUTPUT_DIR/api_trace.jsonl
+API_TRACE_MAX_MB           = float(env("API_TRACE_MAX_MB", "50"))           # tamaño antes de rotar
+API_TRACE_BACKUPS          = int(env("API_TRACE_BACKUPS", "5"))             # archivos rotados que se conservan
+
+# Concurrency
+MAX_IN_FLIGHT             = int(env("MAX_IN_FLIGHT", "8"))                  # llamadas a la API simultáneas
+
+# Cache persistente de respuestas del LLM (limpieza y segmentación); 0 lo desactiva
+RESPONSE_CACHE_MAX_MB     = float(env("RESPONSE_CACHE_MAX_MB", "256"))
 
 # Folders
 INPUT_DIR           = env(
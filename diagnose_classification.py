@@ -35,7 +35,7 @@ def test_api_classification():
         
         # Get embedding
         embedding = get_embedding(fragment)
-        if not embedding:
+        if embedding is None:
             print("❌ Failed to get embedding")
             continue
             
@@ -87,7 +87,7 @@ def analyze_similarity_bias():
         rep = f"{definition} {definition} {keywords}".strip()
         embedding_2_4 = get_embedding(rep)
         
-        if embedding_2_4:
+        if embedding_2_4 is not None:
             print("✅ 2.4 has valid embedding")
             
             # Test against a few other categories
@@ -96,7 +96,7 @@ def analyze_similarity_bias():
             test_fragment = "Los estudiantes participan en círculos de diálogo"
             test_embedding = get_embedding(test_fragment)
             
-            if test_embedding:
+            if test_embedding is not None:
                 from Scripts.classification import cosine_similarity
                 
                 print(f"\nTest fragment: {test_fragment}")
@@ -110,7 +110,7 @@ def analyze_similarity_bias():
                         cat_rep = f"{cat_def} {cat_def} {cat_keywords}".strip()
                         cat_embedding = get_embedding(cat_rep)
                         
-                        if cat_embedding:
+                        if cat_embedding is not None:
                             similarity = cosine_similarity(test_embedding, cat_embedding)
                             print(f"  {cat[:30]}: {similarity:.3f}")
                 
@@ -1,52 +1,157 @@
+"""
+Converts the interview DOCX files under documents/ into the .txt transcripts read by the pipeline.
+
+Every subfolder of documents/ (directivos, docentes, sed, ...) is mirrored under the
+output folder. Conversions run in a process pool; a file is skipped when its .txt is
+newer than the .docx, or when the .docx content hash matches the one recorded at its
+last conversion (e.g. after a copy that only touched mtimes). Use --force to redo all.
+
+    python docx_to_txt.py                      # documents/ -> INPUT_DIR
+    python docx_to_txt.py --only sed familia   # only some subfolders
+"""
+
 import os
-from docx import Document
+import time
+import logging
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from docx import Document
+
+from config.config import INPUT_DIR
+from Scripts.manifest import RunManifest, file_hash
+
+logger = logging.getLogger(__name__)
+
+DOCUMENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "documents")
+MANIFEST_NAME = ".docx_manifest.json"
+MANIFEST_STAGE = "docx_to_txt"
+CONVERTER_VERSION = "1"
 
 def convert_docx_to_txt(input_file, output_file):
     """
-    Convert a DOCX file to TXT format
+    Convert a DOCX file to TXT format.
+    The text is written to a temp file and renamed, so an interrupted run never leaves a
+    truncated .txt that looks newer than its source.
+
+    Returns:
+        int: Number of characters written.
     """
+    # Load the document
+    doc = Document(input_file)
+
+    # Extract text from paragraphs
+    text = '\n'.join(para.text for para in doc.paragraphs)
+
+    # Write to output file
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_file, output_file)
+    return len(text)
+
+def _convert_job(job):
+    """Worker entry point: (rel_path, input, output) -> (rel_path, chars, error)."""
+    rel_path, input_path, output_path = job
     try:
-        # Load the document
-        doc = Document(input_file)
-        
-        # Extract text from paragraphs
-        full_text = []
-        for para in doc.paragraphs:
-            full_text.append(para.text)
-        
-        # Write to output file
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(full_text))
-            
-        print(f"Successfully converted {input_file} to {output_file}")
-        
+        return rel_path, convert_docx_to_txt(input_path, output_path), None
     except Exception as e:
-        print(f"Error converting {input_file}: {str(e)}")
+        return rel_path, 0, str(e)
+
+def find_jobs(input_root, output_root, manifest, only=None, force=False):
+    """
+    Lists the DOCX files that need converting.
 
-def process_folder(input_folder, output_folder):
+    Returns:
+        (jobs, skipped): jobs as (rel_path, input, output, content_hash) tuples.
     """
-    Process all DOCX files in the input folder and save TXT files to output folder
+    jobs, skipped = [], 0
+    for dirpath, dirnames, filenames in os.walk(input_root):
+        dirnames.sort()
+        rel_dir = os.path.relpath(dirpath, input_root)
+        if only and rel_dir != "." and rel_dir.split(os.sep)[0] not in only:
+            continue
+        for filename in sorted(filenames):
+            if not filename.lower().endswith('.docx') or filename.startswith('~$'):
+                continue
+            input_path = os.path.join(dirpath, filename)
+            rel_path = os.path.normpath(os.path.join(rel_dir, filename))
+            output_name = os.path.splitext(filename)[0] + '.txt'
+            output_path = os.path.join(output_root, rel_dir, output_name)
+
+            if not force and os.path.exists(output_path):
+                if os.path.getmtime(output_path) >= os.path.getmtime(input_path):
+                    skipped += 1
+                    continue
+                content_hash = file_hash(input_path)
+                if manifest.is_complete(rel_path, content_hash, MANIFEST_STAGE, CONVERTER_VERSION):
+                    skipped += 1
+                    continue
+            else:
+                content_hash = None
+            jobs.append((rel_path, input_path, output_path, content_hash))
+    return jobs, skipped
+
+def process_folder(input_folder, output_folder, workers=None, force=False, only=None):
     """
-    # Create output folder if it doesn't exist
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-    
-    # Process each DOCX file in the input folder
-    for filename in os.listdir(input_folder):
-        if filename.endswith('.docx'):
-            input_path = os.path.join(input_folder, filename)
-            output_filename = os.path.splitext(filename)[0] + '.txt'
-            output_path = os.path.join(output_folder, output_filename)
-            convert_docx_to_txt(input_path, output_path)
+    Converts every DOCX under input_folder (recursively) into output_folder in a process pool.
+
+    Returns:
+        dict: Summary with converted/skipped/failed counts, elapsed seconds and throughput.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    manifest = RunManifest(os.path.join(output_folder, MANIFEST_NAME))
+    start = time.perf_counter()
+    jobs, skipped = find_jobs(input_folder, output_folder, manifest, only=only, force=force)
+    logger.info("%d DOCX files to convert, %d up to date", len(jobs), skipped)
+
+    converted, failed, total_bytes, total_chars = 0, 0, 0, 0
+    by_rel = {job[0]: job for job in jobs}
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_convert_job, job[:3]) for job in jobs]
+            for future in as_completed(futures):
+                rel_path, chars, error = future.result()
+                _, input_path, _, content_hash = by_rel[rel_path]
+                if error:
+                    failed += 1
+                    logger.error("Error converting %s: %s", rel_path, error)
+                    continue
+                converted += 1
+                total_chars += chars
+                total_bytes += os.path.getsize(input_path)
+                manifest.mark_complete(rel_path, content_hash or file_hash(input_path),
+                                       MANIFEST_STAGE, CONVERTER_VERSION, chars=chars)
+                logger.debug("Converted %s (%d chars)", rel_path, chars)
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "converted": converted,
+        "skipped": skipped,
+        "failed": failed,
+        "seconds": round(elapsed, 2),
+        "files_per_s": round(converted / elapsed, 2) if elapsed else 0.0,
+        "mb_per_s": round(total_bytes / 1e6 / elapsed, 2) if elapsed else 0.0,
+        "chars": total_chars,
+    }
+    logger.info("Converted %d, skipped %d, failed %d in %.2fs (%.1f files/s, %.1f MB/s)",
+                converted, skipped, failed, elapsed, summary["files_per_s"], summary["mb_per_s"])
+    return summary
 
 def main():
-    # Define input and output folders
-    input_folder = r"C:\Users\Felipe Nunez\Documents\Machine Learning Work\JER\codificacion_final\documents\sed"
-    output_folder = r"C:\Users\Felipe Nunez\Documents\Machine Learning Work\JER\codificacion_final\assets\input\interviews\txt\sed"
-    
-    # Process the folders
-    process_folder(input_folder, output_folder)
+    parser = argparse.ArgumentParser(description="Convert interview DOCX files to TXT transcripts.")
+    parser.add_argument("--input", default=DOCUMENTS_DIR, help="Root folder with the DOCX subfolders")
+    parser.add_argument("--output", default=INPUT_DIR, help="Root folder for the TXT transcripts")
+    parser.add_argument("--only", nargs="+", help="Only convert these subfolders (e.g. sed familia)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Convert every file even if its TXT is up to date")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    summary = process_folder(args.input, args.output, workers=args.workers, force=args.force, only=args.only)
+    if summary["failed"]:
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,330 @@
+"""
+Local OpenAI-compatible stand-in for load testing the pipeline without spending quota.
+
+Implements the two endpoints the code uses, /v1/chat/completions and /v1/embeddings,
+and answers every prompt of the pipeline with a deterministic, well-formed response:
+    - cleaning      : the text between ''' quotes, unchanged
+    - segmentation  : long answers split into up to 3 sentence groups, one per line
+    - Stage 1       : 5 codebook categories per fragment (picked by a hash of its text)
+    - Stage 2       : 1-2 of each fragment's own candidates, with confidence and justification
+    - json_schema   : any response_format schema is answered with a valid instance
+    - embeddings    : hashed character n-gram vectors (similar texts get similar vectors)
+The same input always gets the same answer; latency and injected errors are random (seeded).
+
+Load-testing knobs:
+    --latency-ms / --latency-dist   base latency per request (fixed, uniform, exponential, lognormal)
+    --ms-per-token                  extra latency per completion token
+    --rate-429 / --rate-500         fraction of requests failing with 429 (with Retry-After) or 500
+    --rpm / --tpm                   server-side quota; requests over it get a 429
+GET /stats returns request, error and token counts per endpoint; POST /stats/reset clears them.
+
+    python fake_openai_server.py --port 8765 --latency-ms 300 --rate-429 0.02
+    OPENAI_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=sk-local python main_interview.py
+"""
+
+import re
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Scripts.embedding_providers import HashingEmbeddingProvider
+
+logger = logging.getLogger(__name__)
+
+QUOTED_RE = re.compile(r"'''(.*?)'''", re.S)
+BATCH_FRAGMENT_RE = re.compile(r'^\[(F\d+)\] "(.*?)"$', re.M | re.S)
+BATCH_CANDIDATES_RE = re.compile(r'^\[(F\d+)\] "(.*?)"\n  Candidatos: (.*)$', re.M)
+SINGLE_FRAGMENT_RE = re.compile(r'FRAGMENTO(?: A ANALIZAR)?:\s*\n?"(.*?)"\n', re.S)
+CATEGORY_RE = re.compile(r'^• (.+)$', re.M)
+SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+
+def estimate_tokens(text: str) -> int:
+    """Same rough estimate as api_client (≈ 4 characters per token)."""
+    return max(1, len(text) // 4)
+
+def _seed(*parts) -> int:
+    return int.from_bytes(hashlib.sha256("\x1f".join(parts).encode("utf-8")).digest()[:8], "little")
+
+# ---------------------------------------------------------------------- response content
+
+def instance_for_schema(schema, rng: random.Random):
+    """A deterministic instance of a (strict) JSON schema: objects, arrays, enums, numbers, strings."""
+    kind = schema.get("type")
+    if "enum" in schema:
+        return rng.choice(schema["enum"]) if schema["enum"] else None
+    if kind == "object":
+        props = schema.get("properties", {})
+        return {name: instance_for_schema(sub, rng) for name, sub in props.items()}
+    if kind == "array":
+        items = schema.get("items", {})
+        enum = items.get("enum")
+        if enum is not None:
+            return rng.sample(enum, min(len(enum), rng.randint(1, 3))) if enum else []
+        return [instance_for_schema(items, rng) for _ in range(max(1, schema.get("minItems", 1)))]
+    if kind in ("number", "integer"):
+        value = round(rng.uniform(0.80, 0.95), 2)
+        return int(value * 100) if kind == "integer" else value
+    if kind == "boolean":
+        return True
+    return "Desarrolla específicamente prácticas restaurativas concretas en la institución."
+
+def _stage2_item(code, text):
+    rng = random.Random(_seed("stage2", code, text))
+    return {
+        "código": code,
+        "confianza": round(rng.uniform(0.80, 0.95), 2),
+        "justificación": "El fragmento desarrolla específicamente y de forma concreta este código.",
+    }
+
+def _pick(options, text, n, salt):
+    rng = random.Random(_seed(salt, text))
+    return rng.sample(options, min(n, len(options)))
+
+def chat_content(messages, response_format=None) -> str:
+    """Deterministic assistant message for one of the pipeline's prompts."""
+    user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+
+    if response_format and response_format.get("type") == "json_schema":
+        schema = response_format.get("json_schema", {}).get("schema", {})
+        return json.dumps(instance_for_schema(schema, random.Random(_seed("schema", user))), ensure_ascii=False)
+
+    if "Text to clean:" in user:
+        m = QUOTED_RE.search(user)
+        return m.group(1) if m else user
+
+    if user.startswith("Segmenta"):
+        m = QUOTED_RE.search(user)
+        text = m.group(1) if m else user
+        sentences = SENTENCE_RE.split(text.strip())
+        if len(text) < 1000 or len(sentences) < 3:
+            return text
+        parts = 3 if len(text) > 2000 else 2
+        size = -(-len(sentences) // parts)
+        return "\n".join(" ".join(sentences[i:i + size]) for i in range(0, len(sentences), size))
+
+    categories = CATEGORY_RE.findall(user)
+    if "FILTRADO RÁPIDO" in user:
+        fragments = dict(BATCH_FRAGMENT_RE.findall(user))
+        if fragments:
+            return json.dumps({fid: _pick(categories, text, 5, "stage1") for fid, text in fragments.items()},
+                              ensure_ascii=False)
+        m = SINGLE_FRAGMENT_RE.search(user)
+        return json.dumps(_pick(categories, m.group(1) if m else user, 5, "stage1"), ensure_ascii=False)
+
+    batch = BATCH_CANDIDATES_RE.findall(user)
+    if batch:
+        answer = {}
+        for fid, text, candidates in batch:
+            options = [c.strip() for c in candidates.split(" | ") if c.strip()]
+            n = 1 + _seed("n", text) % 2
+            answer[fid] = [_stage2_item(code, text) for code in _pick(options, text, n, "stage2")]
+        return json.dumps(answer, ensure_ascii=False)
+
+    m = SINGLE_FRAGMENT_RE.search(user)
+    text = m.group(1) if m else user
+    return json.dumps([_stage2_item(code, text) for code in _pick(categories, text, 1, "stage2")],
+                      ensure_ascii=False)
+
+# ---------------------------------------------------------------------- server
+
+class FakeOpenAI:
+    """Shared state: latency/error model, quota windows and token accounting."""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.embedder = HashingEmbeddingProvider(dim=args.dim)
+        self.lock = threading.Lock()
+        self.window = deque()           # (timestamp, tokens) of the last minute
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = defaultdict(lambda: defaultdict(int))
+            self.started = time.time()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+            endpoints = {name: dict(counts) for name, counts in self.stats.items()}
+            total = sum(c.get("requests", 0) for c in endpoints.values())
+            return {"elapsed_s": round(elapsed, 3), "requests_per_s": round(total / elapsed, 2), "endpoints": endpoints}
+
+    def count(self, endpoint, **values):
+        with self.lock:
+            for key, value in values.items():
+                self.stats[endpoint][key] += value
+
+    def latency(self, completion_tokens: int) -> float:
+        a = self.args
+        with self.lock:
+            if a.latency_dist == "uniform":
+                base = self.rng.uniform(0, 2 * a.latency_ms)
+            elif a.latency_dist == "exponential":
+                base = self.rng.expovariate(1.0 / a.latency_ms) if a.latency_ms else 0.0
+            elif a.latency_dist == "lognormal":
+                base = a.latency_ms * self.rng.lognormvariate(0, a.latency_sigma) if a.latency_ms else 0.0
+            else:
+                base = a.latency_ms
+        return (base + a.ms_per_token * completion_tokens) / 1000.0
+
+    def injected_error(self):
+        """(status, message, headers) for a random or quota-driven failure, or None."""
+        with self.lock:
+            roll = self.rng.random()
+        if roll < self.args.rate_429:
+            return 429, "Rate limit reached (injected)", {"retry-after": str(self.args.retry_after)}
+        if roll < self.args.rate_429 + self.args.rate_500:
+            return 500, "The server had an error while processing your request (injected)", {}
+        return None
+
+    def over_quota(self, tokens: int):
+        """Sliding one-minute RPM/TPM window; returns a 429 tuple if the request would exceed it."""
+        a = self.args
+        if not a.rpm and not a.tpm:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            while self.window and now - self.window[0][0] > 60:
+                self.window.popleft()
+            used_tokens = sum(t for _, t in self.window)
+            if (a.rpm and len(self.window) >= a.rpm) or (a.tpm and used_tokens + tokens > a.tpm):
+                wait = 60 - (now - self.window[0][0]) if self.window else 1.0
+                return 429, "Rate limit reached for requests (quota)", {"retry-after": f"{max(wait, 0.1):.2f}"}
+            self.window.append((now, tokens))
+        return None
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOpenAI/1.0"
+
+    def log_message(self, fmt, *args):
+        logger.debug("%s - " + fmt, self.address_string(), *args)
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, endpoint, status, message, headers):
+        self.server.fake.count(endpoint, requests=1, **{f"errors_{status}": 1})
+        kind = "requests" if status == 429 else "server_error"
+        self._send(status, {"error": {"message": message, "type": kind, "code": None}}, headers)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send(200, self.server.fake.snapshot())
+        else:
+            self._send(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        fake = self.server.fake
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+            return
+
+        path = self.path.rstrip("/")
+        if path.endswith("/stats/reset"):
+            fake.reset()
+            self._send(200, fake.snapshot())
+            return
+        if path.endswith("/chat/completions"):
+            endpoint = "chat"
+            messages = payload.get("messages", [])
+            prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in messages)
+        elif path.endswith("/embeddings"):
+            endpoint = "embeddings"
+            texts = payload.get("input", [])
+            texts = texts if isinstance(texts, list) else [texts]
+            prompt_tokens = sum(estimate_tokens(t) for t in texts)
+        else:
+            self._send(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        failure = fake.over_quota(prompt_tokens) or fake.injected_error()
+        if failure:
+            time.sleep(fake.latency(0) / 4)
+            self._error(endpoint, *failure)
+            return
+
+        model = payload.get("model", "fake")
+        if endpoint == "chat":
+            content = chat_content(messages, payload.get("response_format"))
+            completion_tokens = estimate_tokens(content)
+            time.sleep(fake.latency(completion_tokens))
+            body = {
+                "id": "chatcmpl-" + hashlib.sha1(content.encode("utf-8")).hexdigest()[:24],
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            }
+        else:
+            completion_tokens = 0
+            vectors = fake.embedder.embed(texts)
+            time.sleep(fake.latency(0))
+            body = {
+                "object": "list",
+                "model": model,
+                "data": [{"object": "embedding", "index": i, "embedding": [round(float(x), 6) for x in v]}
+                         for i, v in enumerate(vectors)],
+                "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+            }
+        fake.count(endpoint, requests=1, ok=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        self._send(200, body)
+
+def make_server(args) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    server.fake = FakeOpenAI(args)
+    return server
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean base latency per request")
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "exponential", "lognormal"], default="fixed")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Sigma of the lognormal distribution")
+    parser.add_argument("--ms-per-token", type=float, default=0.0, help="Extra latency per completion token")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with injected 429s")
+    parser.add_argument("--rpm", type=int, default=0, help="Server-side requests-per-minute quota (0 = none)")
+    parser.add_argument("--tpm", type=int, default=0, help="Server-side tokens-per-minute quota (0 = none)")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = make_server(args)
+    logger.info("Fake OpenAI API on http://%s:%d/v1", args.host, server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("Served: %s", json.dumps(server.fake.snapshot()))
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -1,129 +1,329 @@
 # main_interview.py
 
+"""
+Full interview pipeline: load Q–A pairs, clean, segment, embed and classify every transcript.
+Work runs on an asyncio event loop; blocking API calls go to worker threads and at most
+MAX_IN_FLIGHT of them run at once, across pairs and files. Outputs are still written
+per file and in deterministic (sorted file, pair, fragment) order.
+
+Runs are incremental: run_manifest.json records the content hash and configuration each
+transcript was completed with, so unchanged transcripts are skipped. Within a file, every
+finished Q–A pair and classified fragment is checkpointed, so a crashed run resumes
+without repeating earlier API calls. Cleaning, segmentation and classification fall back
+(raw text, one fragment, similarity only) when their API requests fail; those fallbacks
+are written to the outputs but never checkpointed. A file is only marked complete when
+every pair and every fragment got a real result; otherwise the checkpoint is kept and the
+next run retries only the missing or fallback pairs and fragments.
+all_interviews.json is rewritten as files complete.
+
+Fragments are written as records with stable ids and provenance (see Scripts/records.py);
+partial/*.json and all_interviews.json hold {"id", "codigos"} entries that join back to
+segmented/<document>_segmented.json.
+"""
+
 import os
 import json
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-from config.config                   import INPUT_DIR, OUTPUT_DIR
-from Scripts.loader                  import load_fragments_with_question
-from Scripts.cleaning                import clean_text
-from Scripts.segmentation            import segment_text
-from Scripts.vectorize               import load_cache, get_embedding, save_cache
-from Scripts.classification          import classify_fragment_cosine, build_labeled_examples_from_codebook
+from config.config                   import INPUT_DIR, OUTPUT_DIR, MAX_IN_FLIGHT, CLASSIFICATION_BATCH_SIZE
+from config.config                   import GPT_MODEL, MIN_FRAGMENT_LENGTH
+from Scripts.loader                  import iter_fragments_with_question
+from Scripts.cleaning                import clean_text, CLEANING_PROMPT_VERSION
+from Scripts.segmentation            import segment_text, SEGMENTATION_PROMPT_VERSION
+from Scripts.vectorize               import load_cache, get_embeddings, save_cache, STORE_DIR
+from Scripts.classification          import (classify_fragments_batch, build_labeled_examples_from_codebook,
+                                             classification_fingerprint)
+from Scripts.manifest                import RunManifest, PairCheckpoint, file_hash, fingerprint
+from Scripts.records                 import FragmentRecord, SEGMENTED_FORMAT, write_segmented
+from Scripts.api_client              import log_metrics, failed_requests
+from Scripts.response_cache          import response_cache
+from Scripts.tracing                 import trace_context
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Carpetas de salida
+CLEANED_DIR   = os.path.join(OUTPUT_DIR, 'cleaned')
+SEGMENTED_DIR = os.path.join(OUTPUT_DIR, 'segmented')
+PARTIAL_DIR   = os.path.join(OUTPUT_DIR, 'partial')
+CHECKPOINT_DIR = os.path.join(OUTPUT_DIR, 'checkpoints')
+MANIFEST_PATH = os.path.join(OUTPUT_DIR, 'run_manifest.json')
+ALL_INTERVIEWS_PATH = os.path.join(OUTPUT_DIR, 'all_interviews.json')
+MANIFEST_STAGE = 'interview'
+
+def preprocessing_fingerprint():
+    """Configuration the cleaned/segmented output of a pair depends on."""
+    return fingerprint(GPT_MODEL, CLEANING_PROMPT_VERSION, SEGMENTATION_PROMPT_VERSION, MIN_FRAGMENT_LENGTH)
+
 def get_input_directories():
     """Get all input directories to process."""
     base_dir = INPUT_DIR
     subdirs = ['directivos', 'docentes', 'estudiantes', 'familia', 'sed']
     return [os.path.join(base_dir, subdir) for subdir in subdirs]
 
-# Cargar cache de embeddings y ejemplos etiquetados
-cache  = load_cache()
-codes  = build_labeled_examples_from_codebook()
-all_results = []
+def get_input_files():
+    """All .txt transcripts under the input directories, in a stable order."""
+    files = []
+    for input_dir in get_input_directories():
+        if not os.path.isdir(input_dir):
+            logger.warning("Input directory not found: %s", input_dir)
+            continue
+        for fn in sorted(os.listdir(input_dir)):
+            if fn.lower().endswith('.txt'):
+                files.append(os.path.join(input_dir, fn))
+    return files
 
-# Preparar carpetas de salida
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-CLEANED_DIR   = os.path.join(OUTPUT_DIR, 'cleaned')
-SEGMENTED_DIR = os.path.join(OUTPUT_DIR, 'segmented')
-PARTIAL_DIR   = os.path.join(OUTPUT_DIR, 'partial')
+async def run_blocking(sem, fn, *args, **kwargs):
+    """Runs a blocking (API) call in a worker thread, holding one of the in-flight slots."""
+    async with sem:
+        return await asyncio.to_thread(fn, *args, **kwargs)
 
-os.makedirs(CLEANED_DIR, exist_ok=True)
-os.makedirs(SEGMENTED_DIR, exist_ok=True)
-os.makedirs(PARTIAL_DIR, exist_ok=True)
+def with_failed_requests(fn, *args, **kwargs):
+    """Runs fn and returns (result, stages of the API requests that failed inside it)."""
+    with failed_requests() as failed:
+        result = fn(*args, **kwargs)
+    return result, failed
 
-# Process each input directory
-for input_dir in get_input_directories():
-    logger.info("Processing directory: %s", input_dir)
-    
-    for fn in os.listdir(input_dir):
-        if not fn.lower().endswith('.txt'):
-            continue
-        path = os.path.join(input_dir, fn)
-        basename = os.path.splitext(fn)[0]
-        logger.info("Processing %s", fn)
+async def process_pair(sem, idx, qa, checkpoint, prep_fp, document=""):
+    """
+    Cleans and segments one Q–A pair. Returns (cleaned, fragments, complete) or None on error;
+    complete is False when a request failed and the stage fell back, and then nothing is checkpointed.
+    """
+    key = PairCheckpoint.key_for(idx, qa['question'], qa['response'], prep_fp)
+    done = checkpoint.get('pair', key)
+    if done is not None:
+        return done['cleaned'], done['fragments'], True
+    try:
+        # Spans of this pair carry its id prefix ("<document>#<qa>", see Scripts/records.py)
+        with trace_context(fragments=f"{document}#{idx:03d}"):
+            # ---- 2a) CLEANING ----
+            cleaned, failed = await run_blocking(sem, with_failed_requests, clean_text, qa['response'])
+            # ---- 2b) SEGMENTATION ----
+            fragments, seg_failed = await run_blocking(sem, with_failed_requests, segment_text, cleaned)
+        failed += seg_failed
+        if failed:
+            logger.warning("QA pair %d: fallo de %s, se usa la salida de respaldo sin guardarla en el checkpoint",
+                           idx, ", ".join(sorted(set(failed))))
+            return cleaned, fragments, False
+        checkpoint.put('pair', key, {'cleaned': cleaned, 'fragments': fragments})
+        return cleaned, fragments, True
+    except Exception as e:
+        logger.error("Error procesando QA pair %d: %s", idx, e)
+        return None
+
+async def classify_chunk(sem, chunk, records, embeddings, codes, basename, checkpoint, class_fp):
+    """
+    Classifies one batch of fragment records and checkpoints each result. Returns (codigos, complete);
+    if a Stage-1/Stage-2 request failed the batch fell back to similarity and is not checkpointed.
+    """
+    classified, failed = await run_blocking(
+        sem, with_failed_requests, classify_fragments_batch,
+        [records[i].text for i in chunk], [embeddings[i] for i in chunk], codes,
+        document_name=basename, fragment_ids=[records[i].id for i in chunk]
+    )
+    codigos = [cls.get('category', []) for cls in classified]
+    if failed:
+        logger.warning("%s: fallo de %s en un lote de %d fragmentos; se reintentará en la próxima ejecución",
+                       basename, ", ".join(sorted(set(failed))), len(chunk))
+        return codigos, False
+    for i, cats in zip(chunk, codigos):
+        checkpoint.put('fragment', PairCheckpoint.key_for(records[i].id, records[i].hash, class_fp), cats)
+    return codigos, True
+
+async def process_file(sem, path, codes, checkpoint, prep_fp, class_fp, source=None):
+    """
+    Runs the whole pipeline for one transcript and writes its per-file outputs.
+    Returns (file_results, complete), where complete is False if a Q–A pair or a fragment
+    failed or only has a fallback result, or None on error.
+    """
+    fn = os.path.basename(path)
+    basename = os.path.splitext(fn)[0]
+    logger.info("Processing %s", fn)
+    # API trace spans of this task (and of the pair/batch tasks it starts) belong to this document
+    with trace_context(document=basename):
+        return await _process_file(sem, path, fn, basename, codes, checkpoint, prep_fp, class_fp, source)
 
+async def _process_file(sem, path, fn, basename, codes, checkpoint, prep_fp, class_fp, source):
+
+    try:
+        # 1) + 2) Leer los pares pregunta–respuesta en streaming: cada par empieza a limpiarse
+        # y segmentarse en cuanto se cierra, sin esperar al resto del archivo (orden preservado)
+        qa_pairs, tasks = [], []
         try:
-            # 1) Cargar pares pregunta–respuesta
-            qa_pairs = load_fragments_with_question(path)
-            file_results = []
-            
-            # Store all cleaned responses and segmented fragments for this file
-            all_cleaned_responses = []
-            all_segmented_fragments = []
-
-            for idx, qa in enumerate(qa_pairs):
-                q    = qa['question']
-                resp = qa['response']
-
-                try:
-                    # ---- 2a) CLEANING ----
-                    cleaned = clean_text(resp)
-                    all_cleaned_responses.append(cleaned)
-
-                    # ---- 2b) SEGMENTATION ----
-                    fragments = segment_text(cleaned)
-                    all_segmented_fragments.extend(fragments)
-
-                    # ---- 3) Para cada fragmento, obtener embedding y clasificar ----
-                    for frag in fragments:
-                        frag = frag.strip()
-                        if not frag:
-                            continue
-
-                        emb = cache.get(frag) or get_embedding(frag)
-                        if emb is None:
-                            logger.error("No se pudo obtener embedding para el fragmento. Saltando.")
-                            continue
-                            
-                        cache[frag] = emb
-
-                        cls = classify_fragment_cosine(frag, emb, codes)
-                        subcats = cls.get('category', [])
-
-                        entry = {
-                            'question':   q,
-                            'fragment':   frag,
-                            'codigos':    subcats
-                        }
-                        file_results.append(entry)
-                        all_results.append(entry)
-
-                except Exception as e:
-                    logger.error("Error procesando QA pair %d: %s", idx, e)
-                    continue
-
-            # Save complete cleaned file
-            cleaned_filename = os.path.join(CLEANED_DIR, f"{basename}_cleaned.txt")
-            with open(cleaned_filename, 'w', encoding='utf-8') as cf:
-                cf.write('\n\n'.join(all_cleaned_responses))
-            logger.info("Saved complete cleaned file → %s", cleaned_filename)
-
-            # Save complete segmented file
-            segmented_filename = os.path.join(SEGMENTED_DIR, f"{basename}_segmented.json")
-            with open(segmented_filename, 'w', encoding='utf-8') as sf:
-                json.dump(all_segmented_fragments, sf, indent=2, ensure_ascii=False)
-            logger.info("Saved complete segmented file → %s", segmented_filename)
-
-            # 4) Escribir JSON parcial para este archivo de entrada
-            partial_path = os.path.join(PARTIAL_DIR, f"{basename}.json")
-            with open(partial_path, 'w', encoding='utf-8') as pf:
-                json.dump(file_results, pf, indent=2, ensure_ascii=False)
-            logger.info("Saved partial results for %s → %s", fn, partial_path)
-
-        except Exception as e:
-            logger.error("Error procesando archivo %s: %s", fn, e)
-            continue
+            for idx, qa in enumerate(iter_fragments_with_question(path)):
+                qa_pairs.append(qa)
+                tasks.append(asyncio.create_task(process_pair(sem, idx, qa, checkpoint, prep_fp, basename)))
+                await asyncio.sleep(0)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            raise
+        logger.info("Found %d Q–A pairs in %s", len(qa_pairs), fn)
+        pair_outputs = await asyncio.gather(*tasks)
+        failed_pairs = sum(output is None or not output[2] for output in pair_outputs)
+
+        # Store all cleaned responses and the fragment records (with provenance) for this file
+        all_cleaned_responses = []
+        records = []
+        for idx, (qa, output) in enumerate(zip(qa_pairs, pair_outputs)):
+            if output is None:
+                continue
+            cleaned, fragments, _ = output
+            all_cleaned_responses.append(cleaned)
+            texts = [f.strip() for f in fragments if f.strip()]
+            records.extend(
+                FragmentRecord.create(basename, idx, n, text, question=qa['question'], source=source, cleaned=cleaned)
+                for n, text in enumerate(texts, 1)
+            )
+
+        # ---- 3) Embeddings y clasificación de todos los fragmentos del archivo en lote ----
+        codigos = {}
+        for i, record in enumerate(records):
+            done = checkpoint.get('fragment', PairCheckpoint.key_for(record.id, record.hash, class_fp))
+            if done is not None:
+                codigos[i] = done
+        todo = [i for i in range(len(records)) if i not in codigos]
+
+        embeddings = await run_blocking(sem, get_embeddings, [records[i].text for i in todo]) if todo else []
+        embeddings = dict(zip(todo, embeddings))
+        missing = sum(emb is None for emb in embeddings.values())
+        if missing:
+            logger.error("No se pudo obtener embedding para %d fragmentos. Saltando.", missing)
+        keep = [i for i in todo if embeddings[i] is not None]
+
+        # Cada lote Stage-1/Stage-2 ocupa su propio slot, así varios lotes quedan en vuelo a la vez
+        chunks = [keep[i:i + CLASSIFICATION_BATCH_SIZE] for i in range(0, len(keep), CLASSIFICATION_BATCH_SIZE)]
+        classified_chunks = await asyncio.gather(*(
+            classify_chunk(sem, chunk, records, embeddings, codes, basename, checkpoint, class_fp)
+            for chunk in chunks
+        ))
+        fallback_fragments = 0
+        for chunk, (cats, chunk_complete) in zip(chunks, classified_chunks):
+            codigos.update(zip(chunk, cats))
+            if not chunk_complete:
+                fallback_fragments += len(chunk)
+
+        # Los resultados solo referencian el id; el texto y la pregunta viven en el archivo segmentado
+        file_results = [{'id': records[i].id, 'codigos': codigos[i]} for i in sorted(codigos)]
+        complete = not failed_pairs and not missing and not fallback_fragments
+        if not complete:
+            logger.warning("%s incompleto: %d pares y %d fragmentos sin resultado definitivo; "
+                           "se reintentarán en la próxima ejecución", fn, failed_pairs, missing + fallback_fragments)
+
+        # Save complete cleaned file
+        cleaned_filename = os.path.join(CLEANED_DIR, f"{basename}_cleaned.txt")
+        with open(cleaned_filename, 'w', encoding='utf-8') as cf:
+            cf.write('\n\n'.join(all_cleaned_responses))
+        logger.info("Saved complete cleaned file → %s", cleaned_filename)
+
+        # Save complete segmented file (fragment records)
+        segmented_filename = os.path.join(SEGMENTED_DIR, f"{basename}_segmented.json")
+        write_segmented(segmented_filename, basename, records, source=source)
+        logger.info("Saved complete segmented file → %s", segmented_filename)
+
+        # 4) Escribir JSON parcial para este archivo de entrada
+        partial_path = os.path.join(PARTIAL_DIR, f"{basename}.json")
+        with open(partial_path, 'w', encoding='utf-8') as pf:
+            json.dump(file_results, pf, indent=2, ensure_ascii=False)
+        logger.info("Saved partial results for %s → %s", fn, partial_path)
+        return file_results, complete
+
+    except Exception as e:
+        logger.error("Error procesando archivo %s: %s", fn, e)
+        return None
+
+def load_partial(path):
+    """Per-file results written by an earlier run, or None if missing/unreadable."""
+    partial_path = os.path.join(PARTIAL_DIR, f"{os.path.splitext(os.path.basename(path))[0]}.json")
+    try:
+        with open(partial_path, 'r', encoding='utf-8') as pf:
+            return json.load(pf)
+    except (OSError, ValueError):
+        return None
+
+def write_all_interviews(files, results_by_file):
+    """Atomically rewrites all_interviews.json with every file finished so far, in input order."""
+    all_results = [entry for path in files for entry in results_by_file.get(path) or []]
+    tmp_path = ALL_INTERVIEWS_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(all_results, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, ALL_INTERVIEWS_PATH)
+    return all_results
+
+async def run_pipeline(max_in_flight=MAX_IN_FLIGHT, force=False):
+    """
+    Processes every new or changed transcript with at most `max_in_flight` blocking API calls at once.
+    With force=True the manifest is ignored and every file is reprocessed.
+    """
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=max_in_flight + 2))
+    sem = asyncio.Semaphore(max_in_flight)
+
+    # Preparar carpetas de salida
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    os.makedirs(CLEANED_DIR, exist_ok=True)
+    os.makedirs(SEGMENTED_DIR, exist_ok=True)
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+
+    # Cargar cache de embeddings y ejemplos etiquetados
+    cache = load_cache()
+    codes = await asyncio.to_thread(build_labeled_examples_from_codebook)
+
+    manifest = RunManifest(MANIFEST_PATH)
+    prep_fp = preprocessing_fingerprint()
+    class_fp = classification_fingerprint()
+    run_fp = fingerprint(prep_fp, class_fp, SEGMENTED_FORMAT)
+
+    files = get_input_files()
+    results_by_file = {}
+    to_process = []
+    for path in files:
+        key = os.path.relpath(path, INPUT_DIR)
+        content_hash = file_hash(path)
+        if not force and manifest.is_complete(key, content_hash, MANIFEST_STAGE, run_fp):
+            previous = load_partial(path)
+            if previous is not None:
+                results_by_file[path] = previous
+                continue
+        to_process.append((path, key, content_hash))
+    logger.info("Processing %d of %d files (%d unchanged) with up to %d requests in flight",
+                len(to_process), len(files), len(files) - len(to_process), max_in_flight)
+
+    async def run_file(path, key, content_hash):
+        basename = os.path.splitext(os.path.basename(path))[0]
+        checkpoint = PairCheckpoint(os.path.join(CHECKPOINT_DIR, f"{basename}.jsonl"))
+        outcome = await process_file(sem, path, codes, checkpoint, prep_fp, class_fp, source=key)
+        if outcome is None:
+            return
+        file_results, complete = outcome
+        results_by_file[path] = file_results
+        # Un archivo incompleto conserva su checkpoint y queda fuera del manifiesto
+        if complete:
+            manifest.mark_complete(key, content_hash, MANIFEST_STAGE, run_fp, fragments=len(file_results))
+            checkpoint.discard()
+        # 5) all_interviews.json se actualiza a medida que terminan los archivos
+        write_all_interviews(files, results_by_file)
+
+    await asyncio.gather(*(run_file(*item) for item in to_process))
+
+    # 5) Escribir JSON completo de todos los archivos procesados
+    all_results = write_all_interviews(files, results_by_file)
+    logger.info("Full JSON saved → %s", ALL_INTERVIEWS_PATH)
+
+    # 6) Guardar cache de embeddings actualizada
+    save_cache(cache)
+    logger.info("Embeddings store holds %d vectors → %s", len(cache), STORE_DIR)
+    log_metrics()
+    logger.info("LLM response cache: %s", response_cache.stats())
+    return all_results
 
-# 5) Escribir JSON completo de todos los archivos procesados
-full_path = os.path.join(OUTPUT_DIR, 'all_interviews.json')
-with open(full_path, 'w', encoding='utf-8') as f:
-    json.dump(all_results, f, indent=2, ensure_ascii=False)
-logger.info("Full JSON saved → %s", full_path)
+if __name__ == "__main__":
+    import argparse
 
-# 6) Guardar cache de embeddings actualizada
-save_cache(cache)
-logger.info("Embeddings cache saved → %s", os.path.join(OUTPUT_DIR, "embeddings_cache.pkl"))
+    parser = argparse.ArgumentParser(description="Clean, segment and classify every interview transcript.")
+    parser.add_argument("--force", action="store_true", help="Reprocess every file, ignoring the run manifest")
+    args = parser.parse_args()
+    asyncio.run(run_pipeline(force=args.force))
@@ -0,0 +1,12 @@
+# tests/conftest.py
+
+import os
+import tempfile
+
+# config.config reads these at import time: keep every store, cache and log of the test
+# session in a scratch folder, and nothing on the configured corpus paths
+_scratch = tempfile.mkdtemp(prefix="jer-tests-")
+os.environ.setdefault("INPUT_DIR", os.path.join(_scratch, "input"))
+os.environ.setdefault("OUTPUT_DIR", os.path.join(_scratch, "output"))
+os.environ.setdefault("RESPONSE_CACHE_MAX_MB", "0")
+os.environ.setdefault("API_TRACE", "false")
@@ -0,0 +1,77 @@
+# tests/test_category_resolver.py
+
+"""
+Pins find_best_category_match / CategoryResolver output for the real codebook keys and the
+ways a model usually writes them back. Expected results live in
+tests/data/category_resolver_cases.json; after an intended change to the matching rules,
+regenerate it with `python -m tests.test_category_resolver` and review the diff.
+"""
+
+import os
+import json
+
+import pytest
+
+from config.codebook_def_def import FINAL_CODEBOOK_JER
+from Scripts.classification import find_best_category_match
+
+CASES_PATH = os.path.join(os.path.dirname(__file__), "data", "category_resolver_cases.json")
+CATEGORIES = list(FINAL_CODEBOOK_JER)
+
+def variants(category: str):
+    """Category names as a model writes them back."""
+    code, _, name = category.partition(" ")
+    half = len(category) // 2
+    return [
+        category,
+        category.lower(),
+        category.upper(),
+        category + ".",
+        f'"{category}"',
+        "  " + category.replace(" ", "  ") + " ",
+        code,                                   # "2.4." / "2.4"
+        code.rstrip("."),
+        name,                                   # without the code
+        name.lower(),
+        f"{code} {name.split()[-1]}",           # code + last word only
+        category[:half] + category[half + 1:],  # one character dropped
+        category[:max(len(code) + 4, int(len(category) * 0.7))],   # truncated
+    ]
+
+def current_cases():
+    return {v: find_best_category_match(v, CATEGORIES) for category in CATEGORIES for v in variants(category)}
+
+def load_cases():
+    with open(CASES_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def test_codebook_keys_resolve_to_themselves():
+    for category in CATEGORIES:
+        assert find_best_category_match(category, CATEGORIES) == category
+
+def test_pinned_variants():
+    expected, current = load_cases(), current_cases()
+    assert set(expected) == set(current)
+    changed = {v: (expected[v], current[v]) for v in expected if expected[v] != current[v]}
+    assert changed == {}
+
+@pytest.mark.parametrize("variant,expected", [
+    # A code prefix wins over the text after it
+    ("0.4. 19", "0.4. COVID 19"),
+    ("0.3. de la IED", "0.3. Contexto de la IED"),
+    ("2.4.", "2.4 Prácticas de restauración y resolución de conflictos"),
+    # Without a code, text strategies apply as before
+    ("de la IED", "0.3. Contexto de la IED"),
+    # A name that normalizes to nothing does not match
+    ("¿?", None),
+    ("", None),
+])
+def test_documented_rules(variant, expected):
+    assert find_best_category_match(variant, CATEGORIES) == expected
+
+if __name__ == "__main__":
+    os.makedirs(os.path.dirname(CASES_PATH), exist_ok=True)
+    with open(CASES_PATH, "w", encoding="utf-8") as f:
+        json.dump(current_cases(), f, indent=1, ensure_ascii=False, sort_keys=True)
+        f.write("\n")
+    print(f"Wrote {CASES_PATH}")
@@ -0,0 +1,48 @@
+# tests/test_records.py
+
+"""
+Id-only results join back to their fragment records, both for the readable export and for
+the question lookup of legacy segmented files in classify_from_files.
+"""
+
+import json
+from pathlib import Path
+
+import classify_from_files as cff
+from Scripts.records import (FragmentRecord, write_segmented, load_records, expand_results,
+                             is_legacy_segmented)
+
+ANSWER = "Hablamos con las familias y los estudiantes sobre los acuerdos de convivencia del colegio."
+
+def write_corpus(tmp_path):
+    segmented = tmp_path / "segmented"
+    segmented.mkdir()
+    records = [FragmentRecord.create("doc", 0, 1, ANSWER, question="¿Cómo se resuelven los conflictos?",
+                                     source="docentes/doc.txt", cleaned=ANSWER)]
+    write_segmented(str(segmented / "doc_segmented.json"), "doc", records, source="docentes/doc.txt")
+    # Legacy file from an older run: bare list of strings, no provenance
+    (segmented / "old_segmented.json").write_text(json.dumps([ANSWER]), encoding="utf-8")
+    all_interviews = tmp_path / "all_interviews.json"
+    all_interviews.write_text(json.dumps([{"id": records[0].id, "codigos": ["1.1. Prueba"]},
+                                          {"id": "gone#001.1", "codigos": []}]), encoding="utf-8")
+    return segmented, all_interviews, records
+
+def test_expand_results(tmp_path):
+    segmented, all_interviews, records = write_corpus(tmp_path)
+    expanded = expand_results(json.loads(all_interviews.read_text(encoding="utf-8")), load_records(str(segmented)))
+    assert expanded[0] == {"id": records[0].id, "question": "¿Cómo se resuelven los conflictos?",
+                           "fragment": ANSWER, "codigos": ["1.1. Prueba"]}
+    assert expanded[1] == {"id": "gone#001.1", "codigos": []}
+
+def test_is_legacy_segmented(tmp_path):
+    segmented, _, _ = write_corpus(tmp_path)
+    assert is_legacy_segmented(segmented / "old_segmented.json")
+    assert not is_legacy_segmented(segmented / "doc_segmented.json")
+
+def test_legacy_lookup_uses_records(tmp_path, monkeypatch):
+    segmented, all_interviews, _ = write_corpus(tmp_path)
+    monkeypatch.setattr(cff, "SEGMENTED_DIR", Path(segmented))
+    monkeypatch.setattr(cff, "ALL_INTERVIEWS_PATH", Path(all_interviews))
+
+    index = cff.FragmentQuestionIndex(cff.load_fragment_questions_mapping())
+    assert cff.find_question_for_fragment(ANSWER, index) == "¿Cómo se resuelven los conflictos?"
@@ -0,0 +1,194 @@
+# tests/test_resume.py
+
+"""
+Incremental runs (main_interview.run_pipeline): a transcript with fragments that failed or
+only got a fallback result is left incomplete, and the next run retries only what is missing.
+The real cleaning and segmentation code runs against a fake ChatCompletion endpoint, so a
+failed request goes through the shared client and the stages fall back exactly as in
+production; embeddings and classification are deterministic fakes. Nothing leaves the process.
+"""
+
+import os
+import json
+import asyncio
+from collections import defaultdict
+
+import openai
+import pytest
+from openai.util import convert_to_openai_object
+
+import main_interview as mi
+from Scripts.api_client import chat_completion
+
+ANSWER = ("Respuesta número {n} sobre convivencia escolar y prácticas restaurativas en la institución, con "
+          "detalles suficientes para superar la longitud mínima de un fragmento y para que la segmentación "
+          "tenga que pedir al modelo que divida el texto en partes. Segunda parte de la respuesta {n}, que habla "
+          "del diálogo entre estudiantes, docentes y familias del colegio, de los acuerdos que se construyeron "
+          "juntos, de cómo se hace el seguimiento de esos acuerdos durante el año escolar y de lo que cambió "
+          "en el ambiente del aula.")
+N_PAIRS = 6
+
+class FakeAPI:
+    """
+    Answers cleaning / segmentation requests and counts every call. `fail(stage, text)` decides
+    which requests fail on this run: the stages then fall back (raw text, one fragment, no
+    categories) without raising, like the real ones.
+    """
+
+    def __init__(self):
+        self.requests = defaultdict(list)
+        self.embedded = []
+        self.fail = lambda stage, text: False
+        self.fail_embedding = lambda text: False
+
+    def clear(self):
+        self.requests.clear()
+        self.embedded.clear()
+
+    def chat(self, model=None, messages=None, **kwargs):
+        prompt = messages[-1]["content"]
+        stage = "cleaning" if prompt.startswith("You are a text cleaning") else "segmentation"
+        text = prompt.split("'''")[1]
+        self.requests[stage].append(text)
+        if self.fail(stage, text):
+            raise RuntimeError("API caída")
+        content = text if stage == "cleaning" else text.replace(". Segunda parte", ".\nSegunda parte", 1)
+        return convert_to_openai_object({"choices": [{"message": {"role": "assistant", "content": content}}],
+                                         "usage": {"prompt_tokens": 10, "completion_tokens": 10}})
+
+    def get_embeddings(self, texts):
+        self.embedded.extend(texts)
+        return [None if self.fail_embedding(t) else [1.0, 0.0] for t in texts]
+
+    def classify_fragments_batch(self, fragments, embeddings, codes, document_name="", fragment_ids=None):
+        # One request per batch through the shared client; on failure, no categories (similarity fallback)
+        try:
+            chat_completion("stage1", [{"role": "user", "content": "'''" + "\n".join(fragments) + "'''"}])
+        except Exception:
+            return [{"category": []} for _ in fragments]
+        return [{"category": ["1.1. Prueba"]} for _ in fragments]
+
+    def stage1(self, model=None, messages=None, **kwargs):
+        fragments = messages[-1]["content"].split("'''")[1].split("\n")
+        self.requests["stage1"].extend(fragments)
+        if any(self.fail("stage1", f) for f in fragments):
+            raise RuntimeError("API caída")
+        return convert_to_openai_object({"choices": [{"message": {"role": "assistant", "content": "[]"}}],
+                                         "usage": {"prompt_tokens": 10, "completion_tokens": 10}})
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    input_dir, output_dir = tmp_path / "input", tmp_path / "output"
+    (input_dir / "docentes").mkdir(parents=True)
+    transcript = "\n".join(f"E: Pregunta {n}\nP: {ANSWER.format(n=n)}" for n in range(N_PAIRS))
+    (input_dir / "docentes" / "entrevista.txt").write_text(transcript, encoding="utf-8")
+
+    api = FakeAPI()
+
+    def create(**kwargs):
+        prompt = kwargs["messages"][-1]["content"]
+        return (api.chat if "'''" in prompt and not prompt.startswith("'''") else api.stage1)(**kwargs)
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    monkeypatch.setattr(mi, "get_embeddings", api.get_embeddings)
+    monkeypatch.setattr(mi, "classify_fragments_batch", api.classify_fragments_batch)
+    monkeypatch.setattr(mi, "load_cache", lambda: {})
+    monkeypatch.setattr(mi, "save_cache", lambda cache: None)
+    monkeypatch.setattr(mi, "build_labeled_examples_from_codebook", lambda: [])
+    monkeypatch.setattr(mi, "INPUT_DIR", str(input_dir))
+    monkeypatch.setattr(mi, "OUTPUT_DIR", str(output_dir))
+    for name, sub in (("CLEANED_DIR", "cleaned"), ("SEGMENTED_DIR", "segmented"), ("PARTIAL_DIR", "partial"),
+                      ("CHECKPOINT_DIR", "checkpoints")):
+        monkeypatch.setattr(mi, name, str(output_dir / sub))
+    monkeypatch.setattr(mi, "MANIFEST_PATH", str(output_dir / "run_manifest.json"))
+    monkeypatch.setattr(mi, "ALL_INTERVIEWS_PATH", str(output_dir / "all_interviews.json"))
+
+    def run():
+        api.clear()
+        return asyncio.run(mi.run_pipeline(max_in_flight=2))
+
+    run.api = api
+    run.checkpoint = output_dir / "checkpoints" / "entrevista.jsonl"
+    run.manifest = output_dir / "run_manifest.json"
+    return run
+
+def manifest_files(path):
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))["files"]
+
+def classified(results):
+    return sum(1 for entry in results if entry["codigos"])
+
+KEY = os.path.join("docentes", "entrevista.txt")
+
+def test_complete_run_is_skipped_next_time(pipeline):
+    first = pipeline()
+    assert len(first) == classified(first) == 2 * N_PAIRS
+    assert KEY in manifest_files(pipeline.manifest)
+    assert not pipeline.checkpoint.exists()
+
+    assert pipeline() == first
+    assert not pipeline.api.requests and pipeline.api.embedded == []
+
+def test_failed_embeddings_keep_file_incomplete(pipeline):
+    api = pipeline.api
+    api.fail_embedding = lambda text: text.startswith("Segunda parte de la respuesta 1,") or \
+        text.startswith("Segunda parte de la respuesta 4,")
+
+    first = pipeline()
+    assert len(first) == 2 * N_PAIRS - 2
+    assert manifest_files(pipeline.manifest) == {}
+    assert pipeline.checkpoint.exists()
+
+    api.fail_embedding = lambda text: False
+    second = pipeline()
+    assert len(second) == classified(second) == 2 * N_PAIRS
+    assert api.requests["cleaning"] == api.requests["segmentation"] == []   # pairs came from the checkpoint
+    assert len(api.embedded) == 2                        # only the two fragments that failed
+    assert sorted(api.requests["stage1"]) == sorted(api.embedded)
+    assert KEY in manifest_files(pipeline.manifest)
+    assert not pipeline.checkpoint.exists()
+
+    third = pipeline()
+    assert third == second
+    assert not api.requests and api.embedded == []
+
+@pytest.mark.parametrize("stage,fallback_entries", [
+    ("cleaning", 2 * N_PAIRS),           # raw answer, still segmented
+    ("segmentation", 2 * N_PAIRS - 1),   # whole answer as one fragment
+])
+def test_pair_fallback_is_not_checkpointed(pipeline, stage, fallback_entries):
+    api = pipeline.api
+    api.fail = lambda s, text: s == stage and "número 3 " in text
+
+    first = pipeline()
+    assert len(first) == fallback_entries                # the fallback output is still written
+    assert manifest_files(pipeline.manifest) == {}
+    assert pipeline.checkpoint.exists()
+
+    api.fail = lambda s, text: False
+    second = pipeline()
+    assert len(second) == classified(second) == 2 * N_PAIRS
+    assert len(api.requests["cleaning"]) == 1            # only the pair that fell back
+    assert len(api.requests["segmentation"]) == 1
+    assert KEY in manifest_files(pipeline.manifest)
+    assert not pipeline.checkpoint.exists()
+
+def test_classification_fallback_is_not_checkpointed(pipeline):
+    api = pipeline.api
+    api.fail = lambda s, text: s == "stage1" and "respuesta 5" in text
+
+    first = pipeline()
+    assert len(first) == 2 * N_PAIRS
+    failed_batch = 2 * N_PAIRS - classified(first)       # the batch holding pair 5 has no categories
+    assert failed_batch > 0
+    assert manifest_files(pipeline.manifest) == {}
+
+    api.fail = lambda s, text: False
+    second = pipeline()
+    assert len(second) == classified(second) == 2 * N_PAIRS
+    assert api.requests["cleaning"] == []
+    assert len(api.requests["stage1"]) == len(api.embedded) == failed_batch
+    assert KEY in manifest_files(pipeline.manifest)
+    assert not pipeline.checkpoint.exists()
@@ -1,4 +1,5 @@
 import os
+import re
 
 def read_text_file(path: str) -> str:
     with open(path, 'r', encoding='utf-8') as f:
@@ -32,4 +33,14 @@ def split_text_into_chunks(text: str, max_len: int) -> list:
                 if sub: chunks.append(sub.strip())
                 buf = ""
     if buf.strip(): chunks.append(buf.strip())
-    return chunks
\ No newline at end of file
+    return chunks
+
+def normalize_text(s: str) -> str:
+    """
+    Enhanced normalization with better handling of special characters and spaces.
+    """
+    # Remove extra whitespace and normalize
+    normalized = " ".join(s.strip().lower().split())
+    # Remove special characters but keep meaningful punctuation
+    normalized = re.sub(r'[^\w\s\.\,\;\:\!\?]', ' ', normalized)
+    return " ".join(normalized.split())